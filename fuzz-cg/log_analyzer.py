@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-# import os
+import os
 # import sys
 from multiprocessing.pool import ThreadPool
 # import subprocess
@@ -227,12 +227,34 @@ def worker(file):
     pass
 
 
+def check_soundness(result_dir, source_dirs, workers=10):
+    # Run every program with the indirect call tracer and check each tool's result
+    # against the observed edges (needs TRACE_PASS and TRACE_RUNTIME in the generator config)
+    from pafuzz.tracer.soundness import campaign_jobs, check_programs
+
+    reports = check_programs(campaign_jobs(result_dir, source_dirs), workers=workers)
+    with open(os.path.join(result_dir, "soundness.json"), "w") as f:
+        f.write(json.dumps([report.to_json() for report in reports], indent=4))
+    for report in reports:
+        if report.error:
+            print(report.source + ": " + report.error)
+        for finding in report.findings:
+            print(report.source + ": " + finding.tool + " misses "
+                  + ", ".join(sorted(finding.missing))
+                  + " at " + finding.file + ":" + str(finding.line))
+    unsound = sum(1 for report in reports if report.findings)
+    print(str(unsound) + " of " + str(len(reports)) + " programs have unsound results")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     # parser.add_argument("-t", "--tool", nargs='+', help="Specifies which tool(s) to run", required=False,
     # default=[ "all" ]) parser.add_argument("-m", "--mode", nargs='+', help="Specifies pointer analysis(es) modes",
     # required=False, default=[ "all" ])
     parser.add_argument("-d", "--dir", help="Specifies input directory for results", required=True)
+    parser.add_argument("-s", "--soundness", nargs='+', metavar="SRC_DIR",
+                        help="Check the results against the traced runs of the programs, "
+                             "whose C sources are in these directories")
     # parser.add_argument("-o", "--out", help="Specifies output directory", required=False, default="./tmp")
     args = parser.parse_args()
 
@@ -249,4 +271,7 @@ if __name__ == "__main__":
     pool.close()
     pool.join()
 
+    if args.soundness:
+        check_soundness(args.dir, args.soundness)
+
     pass
@@ -7,6 +7,7 @@ import subprocess
 from pathlib import Path
 from typing import List, Optional
 from pafuzz.generators.csmith import CsmithGenerator
+from pafuzz.generators.pch import pch_flags
 
 # Configure logging
 logging.basicConfig(
@@ -30,6 +31,7 @@ def generate_llvm_bitcode(generator: CsmithGenerator, c_file: str, bc_file: str)
         cmd = [
             generator.clang_path,
             "-emit-llvm", "-g",
+            *pch_flags(generator.clang_path, generator.csmith_runtime, ["-g"]),
             "-I", generator.csmith_runtime,
             "-o", bc_file,
             "-c", c_file
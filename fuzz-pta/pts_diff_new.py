@@ -13,9 +13,20 @@ from dataclasses import dataclass
 from multiprocessing.pool import Pool
 from pathlib import Path
 from threading import Timer
-from typing import List, Optional
+from typing import List, Optional, Set
 
 from generator_new import CSourceGenerator
+from pafuzz.generators import CsmithGenerator, ProgramPool, YarpgenGenerator
+from pafuzz.generators.config import config as generator_config
+from pafuzz.generators.corpus import Corpus
+from pafuzz.generators.fptr import FptrGenerator
+from pafuzz.generators.swarm import SwarmSelector
+from pafuzz.generators.pch import pch_flags
+from pafuzz.generators.seeds import SeedAllocator, campaign_stats
+from pafuzz.generators.sizing import SizeBand, SizeController
+from pafuzz.reducer.oracle import crash_signature
+from pafuzz.tracer.coverage import CoverageMap, run_covered
+from pafuzz.tracer.soundness import build_traced
 
 
 @dataclass
@@ -31,9 +42,23 @@ class AnalyzerConfig:
 class PointerAnalyzerTester:
     """Differential testing framework for pointer analyses"""
 
-    def __init__(self, config_path: Optional[str] = None):
+    def __init__(self, config_path: Optional[str] = None, prefetch: int = 0,
+                 swarm_stats: Optional[Path] = None, profile: str = 'csmith',
+                 loc_band: Optional[List[int]] = None, node_id: int = 0,
+                 seed_log: Optional[Path] = None, producers: int = 1, coverage: bool = False,
+                 corpus_dir: Optional[Path] = None):
         self.config = self._load_config(config_path)
         self.source_generator = CSourceGenerator()
+        self.prefetch = prefetch
+        self.swarm_stats = swarm_stats
+        self.profile = profile
+        self.loc_band = loc_band
+        self.node_id = node_id
+        self.seed_log = seed_log
+        self.producers = producers
+        self.coverage = coverage
+        self.corpus_dir = corpus_dir
+        self._seen_findings: Set[str] = set()
 
     def _load_config(self, config_path: Optional[str]) -> AnalyzerConfig:
         """Load configuration from file or use defaults"""
@@ -76,6 +101,7 @@ class PointerAnalyzerTester:
         cmd = [
             self.config.compiler_path,
             f'-I{self.config.csmith_runtime}',
+            *pch_flags(self.config.compiler_path, self.config.csmith_runtime, ['-g']),
             '-emit-llvm', '-g', '-c',
             str(c_file), '-o', str(bc_file)
         ]
@@ -135,9 +161,13 @@ class PointerAnalyzerTester:
                 return True
         return False
 
-    def analyze_bitcode(self, bitcode: Path, output_dir: Path) -> None:
-        """Run all analyzers on a bitcode file and check for inconsistencies"""
+    def analyze_bitcode(self, bitcode: Path, output_dir: Path) -> Set[str]:
+        """Run all analyzers on a bitcode file and check for inconsistencies
+
+        Returns the findings: crash buckets and "diff:<i>-<j>" for analyses i and j that disagree
+        """
         results = []
+        findings = set()
 
         for tool in self.config.tools:
             output = self._run_analyzer(tool, bitcode)
@@ -147,18 +177,105 @@ class PointerAnalyzerTester:
             if self._check_output_for_errors(output):
                 logging.info(f"Found error in {bitcode}")
                 shutil.copy(bitcode, output_dir / "crash" / bitcode.name)
+                # Record the crash bucket so that bcdd reduces towards the same bug
+                signature = crash_signature(output)
+                if signature:
+                    (output_dir / "crash" / f"{bitcode.name}.sig").write_text(signature + "\n")
+                findings.add(signature or "crash")
             else:
                 results.append(output)
 
         if len(results) >= 2 and not all(r == results[0] for r in results):
             logging.info(f"Found inconsistency in {bitcode}")
             shutil.copy(bitcode, output_dir / "crash" / bitcode.name)
+            findings.update(f"diff:{i}-{j}" for i in range(len(results))
+                            for j in range(i + 1, len(results)) if results[i] != results[j])
+        return findings
+
+    def _new_patterns(self, program, coverage: CoverageMap) -> int:
+        """Build and run the program with the indirect call tracer; the number of new patterns
+
+        New to the campaign as far as this worker knows: the workers share the
+        virgin map, but only merge it every 50 programs.
+        """
+        exe = program.source.with_suffix('.traced')
+        artifacts = build_traced(str(program.source), str(exe), self.config.compiler_path,
+                                 self.config.csmith_runtime)
+        if not artifacts.ok:
+            logging.warning(f"Could not trace {program.source}: {artifacts.errors}")
+            exe.unlink(missing_ok=True)
+            return 0
+        run_covered(str(exe), coverage, generator_config.RUN_TIMEOUT)
+        exe.unlink(missing_ok=True)
+        return coverage.collect()
 
     def generate_and_test(self, worker_id: int, output_dir: Path, count: int) -> None:
         """Generate programs and test analyzers"""
         input_dir = output_dir / "input"
         counter = 0
 
+        if self.prefetch:
+            # Programs are generated, UB-checked and compiled in the background
+            selector = None
+            if self.swarm_stats:
+                selector = SwarmSelector(CsmithGenerator.SWARM_FEATURES,
+                                         state_file=str(self.swarm_stats))
+            controller = None
+            if self.loc_band:
+                controller = SizeController(SizeBand(min_loc=self.loc_band[0],
+                                                     max_loc=self.loc_band[1]))
+            allocator = SeedAllocator(self.node_id, worker_id,
+                                      str(self.seed_log) if self.seed_log else None)
+            corpus = coverage = None
+            if self.coverage:
+                # Programs whose traced run shows new indirect call patterns are kept, and
+                # most swarm configurations are drawn from them
+                corpus_root = self.corpus_dir or output_dir / "corpus"
+                corpus = Corpus(str(corpus_root / f"worker_{worker_id}"),
+                                selector or SwarmSelector(CsmithGenerator.SWARM_FEATURES))
+                coverage = CoverageMap(str(corpus_root / "virgin.map"))
+            feedback = corpus if corpus is not None else selector
+            if self.profile == 'yarpgen':
+                # Multi-file C++ programs, linked into one module per program
+                generator = YarpgenGenerator(seed_allocator=allocator)
+            else:
+                generator_class = FptrGenerator if self.profile == 'fptr' else CsmithGenerator
+                generator = generator_class(clang_path=self.config.compiler_path,
+                                            csmith_runtime=self.config.csmith_runtime,
+                                            swarm_selector=feedback, size_controller=controller,
+                                            seed_allocator=allocator)
+            with ProgramPool(generator, str(input_dir / f"pool_{worker_id}"),
+                             capacity=self.prefetch, jobs=self.producers) as pool:
+                while counter < count:
+                    program = pool.get()
+                    if program is None:
+                        break
+                    findings = self.analyze_bitcode(program.bitcode, output_dir)
+                    patterns = self._new_patterns(program, coverage) if coverage is not None else 0
+                    if patterns:
+                        corpus.add(program, patterns)
+                    if feedback is not None and program.swarm is not None:
+                        # Reward configurations that found something this worker had not seen yet
+                        productive = bool(findings - self._seen_findings) or patterns > 0
+                        feedback.record(program.swarm, productive)
+                        if counter % 50 == 49:
+                            feedback.save()
+                            if coverage is not None:
+                                coverage.save()
+                    self._seen_findings |= findings
+                    program.remove()
+                    counter += 1
+            if feedback is not None:
+                feedback.save()
+            if coverage is not None:
+                logging.info(f"Worker {worker_id}: {len(corpus)} programs in the corpus, "
+                             f"{coverage.seen} indirect call patterns seen")
+                coverage.close()
+            allocator.close()
+            logging.info(f"Worker {worker_id}: {allocator.duplicates} of {allocator.claims} seeds "
+                         f"were duplicates ({allocator.duplicate_rate:.2%})")
+            return
+
         while counter < count:
             c_file = input_dir / f"input_{worker_id}_{counter}.c"
 
@@ -178,8 +295,53 @@ def main():
     parser.add_argument('--workers', default=1, type=int)
     parser.add_argument('--config', type=Path)
     parser.add_argument('--seed-dir', type=Path)
+    parser.add_argument('--prefetch', default=0, type=int,
+                        help='Keep this many programs generated ahead per worker '
+                             '(0: generate inline)')
+    parser.add_argument('--producers', default=1, type=int,
+                        help='Generator threads per worker filling the --prefetch queue; '
+                             'each runs its own csmith and clang pipeline')
+    parser.add_argument('--swarm-stats', type=Path,
+                        help='Choose swarm configurations by their findings so far, learned '
+                             'in this file (needs --prefetch)')
+    parser.add_argument('--profile', choices=['csmith', 'fptr', 'yarpgen'], default='csmith',
+                        help='fptr: programs dense in function pointers; yarpgen: multi-file C++ '
+                             'programs (both need --prefetch)')
+    parser.add_argument('--loc-band', nargs=2, type=int, metavar=('MIN', 'MAX'),
+                        help='Steer program size into MIN..MAX lines of code (needs --prefetch)')
+    parser.add_argument('--node-id', type=int,
+                        help='Id of this machine (0-63); every (node, worker) draws seeds '
+                             'from its own slice (needs --prefetch; default: NODE_ID of the '
+                             'generator config)')
+    parser.add_argument('--seed-log', type=Path,
+                        help='Log of tested seeds shared by the campaign; tested seeds are skipped '
+                             '(needs --prefetch; default: SEED_LOG of the generator config)')
+    parser.add_argument('--coverage', action='store_true',
+                        help='Coverage-guided generation: run every program with the indirect '
+                             'call tracer (TRACE_PASS and TRACE_RUNTIME of the generator '
+                             'config), keep the programs with new call site/target patterns in '
+                             'the --corpus directory and generate more like them (needs '
+                             '--prefetch and the csmith or fptr profile)')
+    parser.add_argument('--corpus', type=Path,
+                        help='Corpus and virgin map of --coverage (default: <output>/corpus, which '
+                             'is cleared on every start); a directory outside --output lets a '
+                             'campaign resume')
     parser.add_argument('-v', '--verbose', action='store_true')
     args = parser.parse_args()
+    if args.coverage and (not args.prefetch or args.profile == 'yarpgen'):
+        parser.error("--coverage needs --prefetch and the csmith or fptr profile")
+    if args.corpus and not args.coverage:
+        parser.error("--corpus needs --coverage")
+    if args.profile != 'csmith' and not args.prefetch:
+        parser.error(f"--profile {args.profile} needs --prefetch")
+    for option, value in (('--swarm-stats', args.swarm_stats), ('--loc-band', args.loc_band),
+                          ('--node-id', args.node_id), ('--seed-log', args.seed_log)):
+        if value is not None and not args.prefetch:
+            parser.error(f"{option} needs --prefetch")
+    if args.node_id is None:
+        args.node_id = generator_config.NODE_ID
+    if args.seed_log is None and generator_config.SEED_LOG:
+        args.seed_log = Path(generator_config.SEED_LOG)
 
     logging.basicConfig(
         level=logging.DEBUG if args.verbose else logging.INFO,
@@ -192,7 +354,9 @@ def main():
     (output_dir / "crash").mkdir()
     (output_dir / "input").mkdir()
 
-    tester = PointerAnalyzerTester(args.config)
+    tester = PointerAnalyzerTester(args.config, args.prefetch, args.swarm_stats, args.profile,
+                                   args.loc_band, args.node_id, args.seed_log, args.producers,
+                                   args.coverage, args.corpus)
     pool = Pool(args.workers)
 
     def signal_handler(sig, frame):
@@ -221,6 +385,11 @@ def main():
         pool.close()
         pool.join()
 
+        if args.seed_log:
+            stats = campaign_stats(str(args.seed_log))
+            logging.info(f"Campaign: {stats['duplicates']} of {stats['claims']} seeds were "
+                         f"duplicates ({stats['duplicate_rate']:.2%})")
+
     except KeyboardInterrupt:
         pool.terminate()
         sys.exit(0)
@@ -18,11 +18,6 @@ if ! command -v clang &> /dev/null; then
     exit 1
 fi
 
-if ! command -v opt &> /dev/null; then
-    echo "Error: opt not found. Please install LLVM tools."
-    exit 1
-fi
-
 echo "Dependencies OK"
 echo ""
 
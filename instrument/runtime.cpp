@@ -1,17 +1,829 @@
 // runtime.cpp - Runtime support for the instrumentation pass
 #include <stdio.h>
+#include <stdint.h>
 #include <stdlib.h>
 #include <string.h>
 #include <dlfcn.h>
 #include <execinfo.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include <signal.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <sys/uio.h>
+#include <atomic>
 #include <unordered_map>
+#include <unordered_set>
 #include <string>
+#include <vector>
+
+// Binary trace mode (AFL_INDIRECT_CALL_FORMAT=binary)
+//
+// Every indirect call appends a fixed-size record to a buffer private to the
+// calling thread; full buffers are written with a single write() as a RECS
+// chunk. Nothing is symbolized while the program runs: the caller string of
+// every call site is remembered once, and the target addresses are resolved
+// at exit into a SYMS chunk. pafuzz/tracer/reader.py decodes the file.
+//
+// File layout (little endian):
+//   "AFLICT01" u32 version u32 record size
+//   chunks: char tag[4] u32 payload size, payload
+//     RECS: TraceRecord[]
+//     SITE: { u32 site id, u32 length, char caller_info[length] }[]
+//     SYMS: { u64 address, u32 length, char name[length] }[]
+//     EDGS: EdgeRecord[] (edge set mode only)
+namespace {
+
+struct TraceRecord {
+    uint64_t target;
+    uint32_t site;
+    uint32_t thread;
+};
+static_assert(sizeof(TraceRecord) == 16, "trace records are 16 bytes");
+
+const char kTraceMagic[8] = {'A', 'F', 'L', 'I', 'C', 'T', '0', '1'};
+const uint32_t kTraceVersion = 1;
+const size_t kBufferRecords = 1 << 14;  // 256 KiB per thread
+const uint32_t kSitePageBits = 16;
+const uint64_t kFunctionIdBit = 1ULL << 63;  // set in the IDs of registered functions
+
+int trace_fd = -1;
+const char *trace_path;  // AFL_INDIRECT_CALL_LOG; forked children log to <trace_path>.<pid>
+pthread_mutex_t trace_mutex = PTHREAD_MUTEX_INITIALIZER;  // guards the fd and the tables below
+pthread_key_t trace_key;
+std::atomic<uint32_t> trace_threads{0};
+// Allocated and never freed, so that it outlives static destructors run before ours
+std::unordered_set<uint64_t> *trace_targets;
+
+// Call sites
+//
+// The pass registers one table of the module's caller info strings, indexed
+// by call site ID, so nothing about a registered site is stored per call;
+// site_seen marks the sites that made it into the trace. The caller info of
+// calls from unregistered code (any site ID) is remembered on first sight in
+// pages of site_pages that are allocated on demand.
+std::atomic<uint64_t> registered_sites{0};
+const char *site_strings;
+const uint32_t *site_offsets;
+const uint32_t *site_shapes;
+uint8_t *site_seen;
+std::atomic<std::atomic<const char *> *> site_pages[1u << (32 - kSitePageBits)];
+
+// Only the owning thread appends to a buffer, but the buffers of all threads
+// are linked into one list so that exit can flush threads that are still
+// running; count is published with a release store for that reason.
+struct ThreadBuffer {
+    TraceRecord records[kBufferRecords];
+    std::atomic<size_t> count;
+    uint32_t index;
+    ThreadBuffer *next;
+};
+
+ThreadBuffer *thread_buffers;  // guarded by trace_mutex
+__thread ThreadBuffer *thread_buffer;
+__thread bool thread_untraced;  // the buffer could not be allocated
+
+bool write_all(int fd, struct iovec *iov, int count) {
+    while (count > 0) {
+        ssize_t written = writev(fd, iov, count);
+        if (written < 0)
+            return false;
+        while (count > 0 && (size_t)written >= iov->iov_len) {
+            written -= iov->iov_len;
+            ++iov;
+            --count;
+        }
+        if (count > 0) {
+            iov->iov_base = (char *)iov->iov_base + written;
+            iov->iov_len -= written;
+        }
+    }
+    return true;
+}
+
+// Caller holds trace_mutex
+void write_chunk(const char *tag, const void *data, uint32_t size) {
+    char header[8];
+    memcpy(header, tag, 4);
+    memcpy(header + 4, &size, 4);
+    struct iovec iov[2] = {{header, sizeof(header)}, {(void *)data, size}};
+    write_all(trace_fd, iov, 2);
+}
+
+// Caller holds trace_mutex
+void flush_locked(ThreadBuffer *buffer) {
+    size_t count = buffer->count.load(std::memory_order_acquire);
+    if (count && trace_fd >= 0) {
+        uint64_t sites = registered_sites.load(std::memory_order_relaxed);
+        for (size_t i = 0; i < count; ++i) {
+            if (!(buffer->records[i].target & kFunctionIdBit))
+                trace_targets->insert(buffer->records[i].target);
+            if (buffer->records[i].site < sites)
+                site_seen[buffer->records[i].site] = 1;
+        }
+        write_chunk("RECS", buffer->records, count * sizeof(TraceRecord));
+    }
+    buffer->count.store(0, std::memory_order_relaxed);
+}
+
+void flush_thread_buffer(ThreadBuffer *buffer) {
+    pthread_mutex_lock(&trace_mutex);
+    flush_locked(buffer);
+    pthread_mutex_unlock(&trace_mutex);
+}
+
+// Thread exit: write what the thread buffered and unlink its buffer
+void release_thread_buffer(void *data) {
+    ThreadBuffer *buffer = (ThreadBuffer *)data;
+    pthread_mutex_lock(&trace_mutex);
+    flush_locked(buffer);
+    for (ThreadBuffer **link = &thread_buffers; *link; link = &(*link)->next) {
+        if (*link == buffer) {
+            *link = buffer->next;
+            break;
+        }
+    }
+    pthread_mutex_unlock(&trace_mutex);
+    free(buffer);
+}
+
+// nullptr if out of memory: the thread is then not traced, rather than crashing the program
+ThreadBuffer *alloc_thread_buffer() {
+    if (thread_untraced)
+        return nullptr;
+    ThreadBuffer *buffer = (ThreadBuffer *)malloc(sizeof(ThreadBuffer));
+    if (!buffer) {
+        thread_untraced = true;
+        return nullptr;
+    }
+    buffer->count.store(0, std::memory_order_relaxed);
+    buffer->index = trace_threads.fetch_add(1, std::memory_order_relaxed);
+    pthread_mutex_lock(&trace_mutex);
+    buffer->next = thread_buffers;
+    thread_buffers = buffer;
+    pthread_mutex_unlock(&trace_mutex);
+    pthread_setspecific(trace_key, buffer);
+    thread_buffer = buffer;
+    return buffer;
+}
+
+void register_sites(const char *strings, const uint32_t *offsets, const uint32_t *shapes, uint64_t count) {
+    // Call site IDs are per module, so only the first module's table is used
+    if (registered_sites.load(std::memory_order_relaxed) || !count)
+        return;
+    site_strings = strings;
+    site_offsets = offsets;
+    site_shapes = shapes;
+    site_seen = (uint8_t *)calloc(count, 1);
+    if (site_seen)
+        registered_sites.store(count, std::memory_order_release);
+}
+
+void remember_site(uint32_t site, const char *caller_info) {
+    std::atomic<std::atomic<const char *> *> &page_slot = site_pages[site >> kSitePageBits];
+    std::atomic<const char *> *page = page_slot.load(std::memory_order_acquire);
+    if (!page) {
+        // calloc() returns zeroed, lazily mapped memory: untouched entries cost nothing
+        std::atomic<const char *> *fresh = (std::atomic<const char *> *)calloc(
+            1u << kSitePageBits, sizeof(std::atomic<const char *>));
+        if (!fresh)
+            return;
+        if (page_slot.compare_exchange_strong(page, fresh, std::memory_order_acq_rel))
+            page = fresh;
+        else
+            free(fresh);
+    }
+    std::atomic<const char *> &info = page[site & ((1u << kSitePageBits) - 1)];
+    if (!info.load(std::memory_order_relaxed))
+        info.store(caller_info, std::memory_order_relaxed);
+}
+
+inline void note_site(uint32_t site, const char *caller_info) {
+    if (site >= registered_sites.load(std::memory_order_relaxed))
+        remember_site(site, caller_info);
+}
+
+// Calls emit(site, caller info) for every site in the trace; allocation-free
+template <typename Emit>
+void for_each_site(Emit emit) {
+    uint64_t sites = registered_sites.load(std::memory_order_acquire);
+    for (uint32_t site = 0; site < sites; ++site) {
+        if (site_seen[site])
+            emit(site, site_strings + site_offsets[site]);
+    }
+    for (uint32_t page = 0; page < (1u << (32 - kSitePageBits)); ++page) {
+        std::atomic<const char *> *infos = site_pages[page].load(std::memory_order_acquire);
+        for (uint32_t i = 0; infos && i < (1u << kSitePageBits); ++i) {
+            if (const char *info = infos[i].load(std::memory_order_relaxed))
+                emit((page << kSitePageBits) | i, info);
+        }
+    }
+}
+
+// Per-site rate limiting (AFL_INDIRECT_CALL_STABLE=N, AFL_INDIRECT_CALL_SAMPLE=R)
+//
+// The pass gives every call site a SiteState and calls the runtime only if
+//     !(state.countdown && state.last == target)
+// and otherwise just decrements countdown. A site is muted (countdown set)
+// once N calls in a row went to targets it had called before; after that one
+// call in R is logged (none with R=0), and a target new to the site is always
+// logged and unmutes it. So the edge set stays exact, and only the call
+// counts of the text log and the binary trace are sampled. The fields are
+// updated without synchronization: a lost update of a racing thread only
+// moves the next sample.
+struct SiteState {
+    std::atomic<void *> last;
+    std::atomic<uint32_t> countdown;  // calls to skip before the next sample
+    std::atomic<uint32_t> hits;       // calls since the site's last new target
+};
+static_assert(sizeof(SiteState) == 16, "site states are 16 bytes");
+
+const uint32_t kKnownTargetSlots = 1 << 16;
+
+uint32_t stable_hits;     // 0: rate limiting off
+uint32_t sample_rearm;    // countdown after a sample
+std::atomic<uint64_t> *known_targets;  // mixed (site state, target) pairs, 0 is empty
+
+void open_rate_limit() {
+    const char *stable_env = getenv("AFL_INDIRECT_CALL_STABLE");
+    if (!stable_env || atoi(stable_env) <= 0)
+        return;
+    known_targets = (std::atomic<uint64_t> *)calloc(kKnownTargetSlots, sizeof(std::atomic<uint64_t>));
+    if (!known_targets)
+        return;
+    const char *sample_env = getenv("AFL_INDIRECT_CALL_SAMPLE");
+    uint32_t sample = sample_env && atoi(sample_env) > 0 ? atoi(sample_env) : 0;
+    sample_rearm = sample ? sample - 1 : UINT32_MAX;
+    stable_hits = atoi(stable_env);
+}
+
+// True the first time a site calls a target. A full table makes every call
+// new, so that sites only stop being logged while this is exact.
+bool first_call(SiteState *state, void *target) {
+    uint64_t key = (uint64_t)(uintptr_t)state * 0x9e3779b97f4a7c15ULL ^ (uint64_t)(uintptr_t)target;
+    key ^= key >> 33;
+    key *= 0xff51afd7ed558ccdULL;
+    key ^= key >> 33;
+    key |= 1;
+    for (uint32_t probe = 0; probe < kKnownTargetSlots; ++probe) {
+        std::atomic<uint64_t> &slot = known_targets[(key + probe) & (kKnownTargetSlots - 1)];
+        uint64_t seen = slot.load(std::memory_order_relaxed);
+        if (seen == key)
+            return false;
+        if (!seen && slot.compare_exchange_strong(seen, key, std::memory_order_relaxed))
+            return true;
+        if (seen == key)
+            return false;
+    }
+    return true;
+}
+
+// Whether a call that missed the inline check is logged
+bool should_log(SiteState *state, void *target) {
+    if (!stable_hits || !state)
+        return true;
+    state->last.store(target, std::memory_order_relaxed);
+    if (first_call(state, target)) {
+        state->hits.store(0, std::memory_order_relaxed);
+        state->countdown.store(0, std::memory_order_relaxed);
+        return true;
+    }
+    uint32_t hits = state->hits.load(std::memory_order_relaxed);
+    if (hits < stable_hits) {
+        state->hits.store(++hits, std::memory_order_relaxed);
+        if (hits == stable_hits)
+            state->countdown.store(sample_rearm, std::memory_order_relaxed);
+        return true;
+    }
+    // Muted: a known target other than the last one, or a sample is due
+    uint32_t countdown = state->countdown.load(std::memory_order_relaxed);
+    if (countdown) {
+        state->countdown.store(countdown - 1, std::memory_order_relaxed);
+        return false;
+    }
+    state->countdown.store(sample_rearm, std::memory_order_relaxed);
+    return sample_rearm != UINT32_MAX;
+}
+
+// Function table
+//
+// The pass registers a table of the module's address-taken functions, each
+// with a stable ID (FNV-1a of its name with the top bit set, so an ID is never
+// a user-space address). The binary trace and the edge set record the ID of a
+// registered target and the raw address of any other; the tables themselves
+// are written as SYMS entries keyed by ID, so only unregistered targets are
+// resolved with dladdr(), and only at exit.
+struct FunctionEntry {
+    const void *address;
+    uint64_t id;
+    const char *name;
+    uint32_t shape;
+};
+
+struct FunctionTable {
+    const FunctionEntry *entries;
+    size_t count;
+    FunctionTable *next;
+};
+
+// Open addressing on the address; rebuilt and replaced (the old one leaked)
+// on every registration, so lookups never lock
+struct FunctionIndex {
+    size_t mask;
+    const FunctionEntry **slots;
+};
+
+pthread_mutex_t function_mutex = PTHREAD_MUTEX_INITIALIZER;
+FunctionTable *function_tables;  // guarded by function_mutex; tables are never removed
+size_t function_count;
+std::atomic<FunctionIndex *> function_index{nullptr};
+
+inline size_t address_hash(const void *address) {
+    return ((uintptr_t)address >> 4) * 0x9e3779b97f4a7c15ULL >> 16;
+}
+
+void register_functions(const FunctionEntry *entries, size_t count) {
+    pthread_mutex_lock(&function_mutex);
+    function_tables = new FunctionTable{entries, count, function_tables};
+    function_count += count;
+
+    size_t slots = 16;
+    while (slots < 2 * function_count)
+        slots <<= 1;
+    FunctionIndex *index = new FunctionIndex{slots - 1, new const FunctionEntry *[slots]()};
+    for (FunctionTable *table = function_tables; table; table = table->next) {
+        for (size_t i = 0; i < table->count; ++i) {
+            const FunctionEntry *entry = &table->entries[i];
+            size_t slot = address_hash(entry->address) & index->mask;
+            while (index->slots[slot] && index->slots[slot]->address != entry->address)
+                slot = (slot + 1) & index->mask;
+            if (!index->slots[slot])
+                index->slots[slot] = entry;
+        }
+    }
+    function_index.store(index, std::memory_order_release);
+    pthread_mutex_unlock(&function_mutex);
+}
+
+const FunctionEntry *find_function(const void *address) {
+    FunctionIndex *index = function_index.load(std::memory_order_acquire);
+    if (!index)
+        return nullptr;
+    for (size_t slot = address_hash(address) & index->mask;; slot = (slot + 1) & index->mask) {
+        const FunctionEntry *entry = index->slots[slot];
+        if (!entry || entry->address == address)
+            return entry;
+    }
+}
+
+// What the trace records for a target: its ID if it is registered, else its address
+inline uint64_t target_key(const void *target) {
+    const FunctionEntry *entry = find_function(target);
+    return entry ? entry->id : (uint64_t)(uintptr_t)target;
+}
+
+void append_entry(std::string &payload, const void *key, size_t key_size, const std::string &text) {
+    uint32_t length = text.size();
+    payload.append((const char *)key, key_size);
+    payload.append((const char *)&length, sizeof(length));
+    payload.append(text);
+}
+
+std::string resolve_symbol(void *func_ptr);
+
+void write_trace_header(int fd) {
+    char header[16];
+    uint32_t record_size = sizeof(TraceRecord);
+    memcpy(header, kTraceMagic, 8);
+    memcpy(header + 8, &kTraceVersion, 4);
+    memcpy(header + 12, &record_size, 4);
+    struct iovec iov = {header, sizeof(header)};
+    write_all(fd, &iov, 1);
+}
+
+void open_binary_trace(const char *log_path) {
+    trace_fd = open(log_path, O_WRONLY | O_CREAT | O_TRUNC | O_CLOEXEC, 0644);
+    if (trace_fd < 0)
+        return;
+    trace_targets = new std::unordered_set<uint64_t>();
+    pthread_key_create(&trace_key, release_thread_buffer);
+    write_trace_header(trace_fd);
+}
+
+void close_binary_trace() {
+    pthread_mutex_lock(&trace_mutex);
+    // Threads that are still running lose at most the call they are logging
+    for (ThreadBuffer *buffer = thread_buffers; buffer; buffer = buffer->next)
+        flush_locked(buffer);
+
+    std::string sites, symbols;
+    for_each_site([&](uint32_t site, const char *info) { append_entry(sites, &site, sizeof(site), info); });
+    for (uint64_t target : *trace_targets)
+        append_entry(symbols, &target, sizeof(target), resolve_symbol((void *)(uintptr_t)target));
+    pthread_mutex_lock(&function_mutex);
+    for (FunctionTable *table = function_tables; table; table = table->next) {
+        for (size_t i = 0; i < table->count; ++i)
+            append_entry(symbols, &table->entries[i].id, sizeof(uint64_t), table->entries[i].name);
+    }
+    pthread_mutex_unlock(&function_mutex);
+    write_chunk("SITE", sites.data(), sites.size());
+    write_chunk("SYMS", symbols.data(), symbols.size());
+    close(trace_fd);
+    trace_fd = -1;
+    pthread_mutex_unlock(&trace_mutex);
+}
+
+// Coverage map (AFL_INDIRECT_CALL_COVERAGE=/name)
+//
+// For coverage-guided program generation, every call marks one byte of a
+// bitmap in the shared memory object the fuzzing driver created
+// (pafuzz.tracer.coverage.CoverageMap). The byte is picked by the shapes of
+// the call site and of the target that the pass registered; shapes leave out
+// names, so the same pattern marks the same byte in every program. Calls from
+// unregistered sites or to unregistered targets count as shape 0. The map
+// only grows, so a muted site loses nothing, and it works with every format.
+const size_t kCoverageMapBits = 16;
+const size_t kCoverageMapSize = 1 << kCoverageMapBits;  // pafuzz.tracer.coverage.MAP_SIZE
+
+uint8_t *coverage_map;
+
+void open_coverage_map() {
+    const char *shm_name = getenv("AFL_INDIRECT_CALL_COVERAGE");
+    if (!shm_name)
+        return;
+    // The driver owns the map; without it, the program runs without coverage
+    int fd = shm_open(shm_name, O_RDWR, 0600);
+    if (fd < 0)
+        return;
+    struct stat st;
+    if (fstat(fd, &st) == 0 && (size_t)st.st_size >= kCoverageMapSize) {
+        void *map = mmap(nullptr, kCoverageMapSize, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        if (map != MAP_FAILED)
+            coverage_map = (uint8_t *)map;
+    }
+    close(fd);
+}
+
+inline void note_coverage(uint32_t site, const void *target) {
+    uint64_t site_shape = site < registered_sites.load(std::memory_order_relaxed) ? site_shapes[site] : 0;
+    const FunctionEntry *entry = find_function(target);
+    uint64_t pattern = (site_shape << 32 | (entry ? entry->shape : 0)) * 0x9e3779b97f4a7c15ULL;
+    uint8_t &byte = coverage_map[pattern >> (64 - kCoverageMapBits)];
+    if (!byte)
+        byte = 1;  // only the first time, so the cache line is not dirtied by every call
+}
+
+// Edge set mode (AFL_INDIRECT_CALL_FORMAT=edges)
+//
+// Soundness checks only need the distinct (call site, target) edges, so each
+// call is looked up in a fixed-size open-addressing hash set, and only a new
+// edge writes anything. The set lives in shared memory: anonymous, so that
+// forked children add to it, or named by AFL_INDIRECT_CALL_SHM, so that the
+// harness can still read it after killing a program that timed out. It is
+// dumped once, at exit or on a fatal signal, as a trace file with EDGS, SITE
+// and SYMS chunks; besides dladdr and snprintf, the dump only makes
+// async-signal-safe calls.
+struct EdgeSlot {
+    std::atomic<uint64_t> target;
+    std::atomic<uint32_t> site;
+    std::atomic<uint32_t> state;  // kSlotEmpty, kSlotBusy while being filled, kSlotFull
+};
+static_assert(sizeof(EdgeSlot) == 16, "edge slots are 16 bytes");
+
+struct EdgeTableHeader {
+    char magic[8];
+    uint32_t version;
+    uint32_t slots;
+    std::atomic<uint64_t> dropped;  // new edges that did not fit
+    uint64_t owner;                 // pid of the process that dumps the set
+};
+
+struct EdgeRecord {
+    uint64_t target;
+    uint32_t site;
+    uint32_t reserved;
+};
+
+const char kEdgeTableMagic[8] = {'A', 'F', 'L', 'E', 'D', 'G', '0', '1'};
+const uint32_t kSlotEmpty = 0, kSlotBusy = 1, kSlotFull = 2;
+const uint32_t kDefaultEdgeSlots = 1 << 16;
+
+EdgeTableHeader *edge_table;
+EdgeSlot *edge_slots;
+uint32_t edge_mask;
+std::atomic<bool> edges_dumped{false};
+
+inline uint64_t edge_hash(uint32_t site, uint64_t target) {
+    uint64_t h = target ^ ((uint64_t)site << 32 | site);
+    h ^= h >> 33;
+    h *= 0xff51afd7ed558ccdULL;
+    h ^= h >> 33;
+    return h;
+}
+
+void insert_edge(uint32_t site, uint64_t target) {
+    uint64_t h = edge_hash(site, target);
+    for (uint32_t probe = 0; probe <= edge_mask; ++probe) {
+        EdgeSlot &slot = edge_slots[(h + probe) & edge_mask];
+        uint32_t state = slot.state.load(std::memory_order_acquire);
+        if (state == kSlotEmpty) {
+            if (slot.state.compare_exchange_strong(state, kSlotBusy, std::memory_order_acquire)) {
+                slot.target.store(target, std::memory_order_relaxed);
+                slot.site.store(site, std::memory_order_relaxed);
+                slot.state.store(kSlotFull, std::memory_order_release);
+                return;
+            }
+        }
+        // Another thread is filling the slot; it is only busy for two stores
+        while (state == kSlotBusy)
+            state = slot.state.load(std::memory_order_acquire);
+        if (slot.site.load(std::memory_order_relaxed) == site &&
+            slot.target.load(std::memory_order_relaxed) == target)
+            return;
+    }
+    edge_table->dropped.fetch_add(1, std::memory_order_relaxed);
+}
+
+// Chunk writer for the dump: no allocation, sizes patched in afterwards
+char dump_buffer[1 << 16];
+size_t dump_used;
+off_t dump_chunk_start;
+
+void dump_flush(int fd) {
+    struct iovec iov = {dump_buffer, dump_used};
+    if (dump_used)
+        write_all(fd, &iov, 1);
+    dump_used = 0;
+}
+
+void dump_bytes(int fd, const void *data, size_t size) {
+    if (dump_used + size > sizeof(dump_buffer))
+        dump_flush(fd);
+    if (size > sizeof(dump_buffer)) {
+        struct iovec iov = {(void *)data, size};
+        write_all(fd, &iov, 1);
+        return;
+    }
+    memcpy(dump_buffer + dump_used, data, size);
+    dump_used += size;
+}
+
+void dump_begin_chunk(int fd, const char *tag) {
+    dump_flush(fd);
+    dump_chunk_start = lseek(fd, 0, SEEK_CUR);
+    uint32_t size = 0;
+    dump_bytes(fd, tag, 4);
+    dump_bytes(fd, &size, 4);
+}
+
+void dump_end_chunk(int fd) {
+    dump_flush(fd);
+    uint32_t size = lseek(fd, 0, SEEK_CUR) - dump_chunk_start - 8;
+    pwrite(fd, &size, sizeof(size), dump_chunk_start + 4);
+}
+
+void dump_entry(int fd, const void *key, size_t key_size, const char *text) {
+    uint32_t length = strlen(text);
+    dump_bytes(fd, key, key_size);
+    dump_bytes(fd, &length, sizeof(length));
+    dump_bytes(fd, text, length);
+}
+
+void dump_edge_set() {
+    if (edges_dumped.exchange(true) || edge_table->owner != (uint64_t)getpid())
+        return;
+    int fd = open(trace_path, O_WRONLY | O_CREAT | O_TRUNC | O_CLOEXEC, 0644);
+    if (fd < 0)
+        return;
+    write_trace_header(fd);
+
+    dump_begin_chunk(fd, "EDGS");
+    for (uint32_t i = 0; i <= edge_mask; ++i) {
+        if (edge_slots[i].state.load(std::memory_order_acquire) != kSlotFull)
+            continue;
+        EdgeRecord record = {edge_slots[i].target.load(std::memory_order_relaxed),
+                             edge_slots[i].site.load(std::memory_order_relaxed), 0};
+        dump_bytes(fd, &record, sizeof(record));
+    }
+    dump_end_chunk(fd);
+
+    dump_begin_chunk(fd, "SITE");
+    uint64_t sites = registered_sites.load(std::memory_order_acquire);
+    for (uint32_t i = 0; i <= edge_mask; ++i) {
+        if (edge_slots[i].state.load(std::memory_order_acquire) != kSlotFull)
+            continue;
+        uint32_t site = edge_slots[i].site.load(std::memory_order_relaxed);
+        if (site < sites)
+            site_seen[site] = 1;
+    }
+    for_each_site([fd](uint32_t site, const char *info) { dump_entry(fd, &site, sizeof(site), info); });
+    dump_end_chunk(fd);
+
+    // A target reached from several sites is listed once per edge; readers keep one.
+    // Registered targets are named by the function tables instead.
+    dump_begin_chunk(fd, "SYMS");
+    for (uint32_t i = 0; i <= edge_mask; ++i) {
+        if (edge_slots[i].state.load(std::memory_order_acquire) != kSlotFull)
+            continue;
+        uint64_t target = edge_slots[i].target.load(std::memory_order_relaxed);
+        if (target & kFunctionIdBit)
+            continue;
+        Dl_info info;
+        char fallback[32];
+        const char *name = fallback;
+        if (dladdr((void *)(uintptr_t)target, &info) && info.dli_sname)
+            name = info.dli_sname;
+        else
+            snprintf(fallback, sizeof(fallback), "func_%p", (void *)(uintptr_t)target);
+        dump_entry(fd, &target, sizeof(target), name);
+    }
+    if (pthread_mutex_trylock(&function_mutex) == 0) {
+        for (FunctionTable *table = function_tables; table; table = table->next) {
+            for (size_t i = 0; i < table->count; ++i)
+                dump_entry(fd, &table->entries[i].id, sizeof(uint64_t), table->entries[i].name);
+        }
+        pthread_mutex_unlock(&function_mutex);
+    }
+    dump_end_chunk(fd);
+
+    close(fd);
+}
+
+void dump_on_signal(int sig) {
+    dump_edge_set();
+    raise(sig);  // the handler was reset, so this takes the default action
+}
+
+void open_edge_set() {
+    const char *slots_env = getenv("AFL_INDIRECT_CALL_EDGES");
+    uint32_t slots = kDefaultEdgeSlots;
+    if (slots_env && atoi(slots_env) > 0) {
+        slots = 1;
+        while (slots < (uint32_t)atoi(slots_env) && slots < (1u << 30))
+            slots <<= 1;
+    }
+    size_t size = sizeof(EdgeTableHeader) + (size_t)slots * sizeof(EdgeSlot);
+
+    void *table = MAP_FAILED;
+    const char *shm_name = getenv("AFL_INDIRECT_CALL_SHM");
+    if (shm_name) {
+        // Reuse a table the harness created, so that several runs share one set
+        int fd = shm_open(shm_name, O_RDWR | O_CREAT, 0600);
+        if (fd >= 0) {
+            struct stat st;
+            if (fstat(fd, &st) == 0 && ((size_t)st.st_size == size || ftruncate(fd, size) == 0))
+                table = mmap(nullptr, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+            close(fd);
+        }
+    } else {
+        table = mmap(nullptr, size, PROT_READ | PROT_WRITE, MAP_SHARED | MAP_ANONYMOUS, -1, 0);
+    }
+    if (table == MAP_FAILED)
+        return;
+
+    edge_table = (EdgeTableHeader *)table;
+    edge_slots = (EdgeSlot *)(edge_table + 1);
+    edge_mask = slots - 1;
+    if (memcmp(edge_table->magic, kEdgeTableMagic, 8) != 0 || edge_table->slots != slots) {
+        memset(table, 0, size);
+        memcpy(edge_table->magic, kEdgeTableMagic, 8);
+        edge_table->version = kTraceVersion;
+        edge_table->slots = slots;
+    }
+    edge_table->owner = getpid();
+
+    struct sigaction action;
+    memset(&action, 0, sizeof(action));
+    action.sa_handler = dump_on_signal;
+    action.sa_flags = SA_RESETHAND | SA_NODEFER;
+    for (int sig : {SIGSEGV, SIGBUS, SIGFPE, SIGILL, SIGABRT, SIGTERM, SIGINT, SIGALRM})
+        sigaction(sig, &action, nullptr);
+}
+
+// Text mode and symbol cache
+//
+// Each text line is formatted on the stack and written with one write() to an
+// O_APPEND descriptor, so lines of concurrent threads never interleave. The
+// symbols of the text log are cached in shards, each with its own lock, so
+// that threads resolving different targets rarely wait for each other.
+int text_fd = -1;
+const size_t kNameCacheShards = 64;
+
+struct alignas(64) NameCacheShard {
+    pthread_mutex_t lock = PTHREAD_MUTEX_INITIALIZER;
+    std::unordered_map<void *, std::string> *names = nullptr;  // never freed, like the tables above
+};
+NameCacheShard name_cache[kNameCacheShards];
+
+const char *cached_symbol(void *func_ptr) {
+    uintptr_t address = (uintptr_t)func_ptr;
+    NameCacheShard &shard = name_cache[((address >> 4) ^ (address >> 12)) % kNameCacheShards];
+    pthread_mutex_lock(&shard.lock);
+    if (!shard.names)
+        shard.names = new std::unordered_map<void *, std::string>();
+    auto it = shard.names->find(func_ptr);
+    if (it == shard.names->end())
+        it = shard.names->emplace(func_ptr, resolve_symbol(func_ptr)).first;
+    const char *name = it->second.c_str();  // map nodes never move
+    pthread_mutex_unlock(&shard.lock);
+    return name;
+}
+
+void write_text_header(int fd) {
+    static const char header[] =
+        "# AFL Indirect Call Log\n"
+        "# Format: call_site_id|caller_info|target_ptr|target_name\n";
+    ssize_t written = write(fd, header, sizeof(header) - 1);
+    (void)written;
+}
+
+int open_text_log(const char *path) {
+    int fd = open(path, O_WRONLY | O_CREAT | O_TRUNC | O_APPEND | O_CLOEXEC, 0644);
+    if (fd >= 0)
+        write_text_header(fd);
+    return fd;
+}
+
+void write_text_line(int call_site_id, void *target_func, const char *caller_info, const char *target_name) {
+    char line[1024];
+    int length = snprintf(line, sizeof(line), "%d|%s|%p|%s\n", call_site_id, caller_info, target_func, target_name);
+    if (length < 0)
+        return;
+    char *text = line;
+    if ((size_t)length >= sizeof(line)) {
+        text = (char *)malloc(length + 1);
+        if (!text)
+            return;
+        snprintf(text, length + 1, "%d|%s|%p|%s\n", call_site_id, caller_info, target_func, target_name);
+    }
+    ssize_t written = write(text_fd, text, length);
+    (void)written;
+    if (text != line)
+        free(text);
+}
+
+// fork()
+//
+// The locks are taken around fork() so that the child never inherits one held
+// by a thread that does not exist there. The child keeps only the forking
+// thread, drops the records it inherited (the parent still writes them) and
+// logs to a segment of its own, <log>.<pid>, instead of interleaving with the
+// parent; pafuzz.tracer.reader.read_trace(path, segments=True) merges them.
+// In edge set mode the set is shared memory, so children simply add to it
+// and the parent dumps it.
+int open_segment(int flags) {
+    char path[4096];
+    snprintf(path, sizeof(path), "%s.%d", trace_path, (int)getpid());
+    return open(path, flags, 0644);
+}
+
+void fork_prepare() {
+    for (NameCacheShard &shard : name_cache)
+        pthread_mutex_lock(&shard.lock);
+    pthread_mutex_lock(&function_mutex);
+    pthread_mutex_lock(&trace_mutex);
+}
+
+void fork_parent() {
+    pthread_mutex_unlock(&trace_mutex);
+    pthread_mutex_unlock(&function_mutex);
+    for (NameCacheShard &shard : name_cache)
+        pthread_mutex_unlock(&shard.lock);
+}
+
+void fork_child() {
+    if (trace_fd >= 0) {
+        for (ThreadBuffer *buffer = thread_buffers, *next; buffer; buffer = next) {
+            next = buffer->next;
+            if (buffer != thread_buffer)
+                free(buffer);
+        }
+        thread_buffers = thread_buffer;
+        if (thread_buffer) {
+            thread_buffer->next = nullptr;
+            thread_buffer->count.store(0, std::memory_order_relaxed);
+        }
+        trace_targets->clear();
+        close(trace_fd);
+        trace_fd = open_segment(O_WRONLY | O_CREAT | O_TRUNC | O_CLOEXEC);
+        if (trace_fd >= 0)
+            write_trace_header(trace_fd);
+    }
+    if (text_fd >= 0) {
+        close(text_fd);
+        text_fd = open_segment(O_WRONLY | O_CREAT | O_TRUNC | O_APPEND | O_CLOEXEC);
+        if (text_fd >= 0)
+            write_text_header(text_fd);
+    }
+    fork_parent();
+}
+
+} // namespace
 
 extern "C" {
 
-// Global data structures for tracking
-static FILE *afl_log_file = nullptr;
-static std::unordered_map<void*, std::string> function_name_cache;
+static bool afl_log_verbose = false;
 
 // Initialize logging
 __attribute__((constructor))
@@ -20,82 +832,145 @@ void __afl_init_logging() {
     if (!log_path) {
         log_path = "/tmp/afl_indirect_calls.log";
     }
-    
-    afl_log_file = fopen(log_path, "w");
-    if (afl_log_file) {
-        fprintf(afl_log_file, "# AFL Indirect Call Log\n");
-        fprintf(afl_log_file, "# Format: call_site_id|caller_info|target_ptr|target_name\n");
-        fflush(afl_log_file);
+    trace_path = strdup(log_path);
+    afl_log_verbose = getenv("AFL_INDIRECT_CALL_VERBOSE") != nullptr;
+    pthread_atfork(fork_prepare, fork_parent, fork_child);
+    open_rate_limit();
+    open_coverage_map();
+
+    const char *format = getenv("AFL_INDIRECT_CALL_FORMAT");
+    if (format && strcmp(format, "binary") == 0) {
+        open_binary_trace(log_path);
+        return;
+    }
+    if (format && strcmp(format, "edges") == 0) {
+        open_edge_set();
+        return;
+    }
+    if (format && strcmp(format, "none") == 0) {
+        return;  // coverage map only
     }
+    text_fd = open_text_log(log_path);
 }
 
 // Cleanup logging
 __attribute__((destructor))
 void __afl_cleanup_logging() {
-    if (afl_log_file) {
-        fclose(afl_log_file);
+    if (trace_fd >= 0) {
+        close_binary_trace();
+    }
+    if (edge_table) {
+        dump_edge_set();
+    }
+    if (text_fd >= 0) {
+        close(text_fd);
+        text_fd = -1;
     }
 }
 
 // Resolve function name from pointer
 char* __afl_resolve_function_name(void* func_ptr) {
     static char unknown[] = "unknown";
-    
-    if (!func_ptr) {
+
+    // The binary trace and the edge set symbolize their targets at exit
+    if (!func_ptr || trace_fd >= 0 || edge_table || (text_fd < 0 && !afl_log_verbose)) {
         return unknown;
     }
-    
-    // Check cache first
-    auto it = function_name_cache.find(func_ptr);
-    if (it != function_name_cache.end()) {
-        return const_cast<char*>(it->second.c_str());
+    if (const FunctionEntry *entry = find_function(func_ptr)) {
+        return const_cast<char*>(entry->name);
+    }
+    return const_cast<char*>(cached_symbol(func_ptr));
+}
+
+// Called by the constructor the pass adds to every instrumented module
+void __afl_register_sites(const char* strings, const uint32_t* offsets, const uint32_t* shapes,
+                          uint64_t count) {
+    register_sites(strings, offsets, shapes, count);
+}
+
+void __afl_register_functions(const void* table, uint64_t count) {
+    register_functions((const FunctionEntry *)table, count);
+}
+
+// Log indirect call
+void __afl_log_indirect_call(int call_site_id, void* target_func,
+                           char* caller_info, char* target_name) {
+    if (coverage_map) {
+        note_coverage((uint32_t)call_site_id, target_func);
+    }
+    if (edge_table) {
+        note_site((uint32_t)call_site_id, caller_info);
+        insert_edge((uint32_t)call_site_id, target_key(target_func));
+        return;
+    }
+    if (trace_fd >= 0) {
+        uint32_t site = (uint32_t)call_site_id;
+        note_site(site, caller_info);
+        ThreadBuffer *buffer = thread_buffer ? thread_buffer : alloc_thread_buffer();
+        if (!buffer)
+            return;
+        size_t count = buffer->count.load(std::memory_order_relaxed);
+        buffer->records[count] = {target_key(target_func), site, buffer->index};
+        buffer->count.store(++count, std::memory_order_release);
+        if (count == kBufferRecords)
+            flush_thread_buffer(buffer);
+        return;
+    }
+
+    if (text_fd >= 0) {
+        write_text_line(call_site_id, target_func, caller_info, target_name);
+    }
+
+    // Also print to stderr for debugging (AFL_INDIRECT_CALL_VERBOSE)
+    if (afl_log_verbose) {
+        fprintf(stderr, "[AFL] Indirect call %d: %s -> %s (%p)\n",
+                call_site_id, caller_info, target_name, target_func);
+    }
+}
+
+// What instrumented code calls when its inline check fails; site_state is the
+// call site's SiteState. The target is only symbolized if the call is logged.
+void __afl_trace_indirect_call(void* site_state, int call_site_id, void* target_func,
+                               char* caller_info) {
+    if (!should_log((SiteState *)site_state, target_func)) {
+        return;
     }
-    
+    __afl_log_indirect_call(call_site_id, target_func, caller_info,
+                            __afl_resolve_function_name(target_func));
+}
+
+} // extern "C"
+
+namespace {
+
+std::string resolve_symbol(void *func_ptr) {
     // Try to resolve using dladdr
     Dl_info info;
     if (dladdr(func_ptr, &info) && info.dli_sname) {
-        std::string name = info.dli_sname;
-        function_name_cache[func_ptr] = name;
-        return const_cast<char*>(function_name_cache[func_ptr].c_str());
+        return info.dli_sname;
     }
-    
+
     // Try to get symbol info using backtrace_symbols
     char **symbols = backtrace_symbols(&func_ptr, 1);
     if (symbols && symbols[0]) {
         std::string symbol_info = symbols[0];
         free(symbols);
-        
+
         // Extract function name from symbol info
         size_t start = symbol_info.find('(');
         size_t end = symbol_info.find('+');
         if (start != std::string::npos && end != std::string::npos && start < end) {
             std::string name = symbol_info.substr(start + 1, end - start - 1);
             if (!name.empty()) {
-                function_name_cache[func_ptr] = name;
-                return const_cast<char*>(function_name_cache[func_ptr].c_str());
+                return name;
             }
         }
     }
-    
+
     // Fallback: use hex address
     char addr_str[32];
     snprintf(addr_str, sizeof(addr_str), "func_%p", func_ptr);
-    function_name_cache[func_ptr] = addr_str;
-    return const_cast<char*>(function_name_cache[func_ptr].c_str());
-}
-
-// Log indirect call
-void __afl_log_indirect_call(int call_site_id, void* target_func, 
-                           char* caller_info, char* target_name) {
-    if (afl_log_file) {
-        fprintf(afl_log_file, "%d|%s|%p|%s\n", 
-                call_site_id, caller_info, target_func, target_name);
-        fflush(afl_log_file);
-    }
-    
-    // Also print to stderr for debugging
-    fprintf(stderr, "[AFL] Indirect call %d: %s -> %s (%p)\n",
-            call_site_id, caller_info, target_name, target_func);
+    return addr_str;
 }
 
-} // extern "C"
\ No newline at end of file
+} // namespace
@@ -1,3 +1,4 @@
+#include "llvm/Config/llvm-config.h"
 #include "llvm/Pass.h"
 #include "llvm/IR/Function.h"
 #include "llvm/IR/Module.h"
@@ -12,9 +13,13 @@
 #include "llvm/IR/DIBuilder.h"
 #include "llvm/Support/raw_ostream.h"
 #include "llvm/Transforms/Utils/BasicBlockUtils.h"
-#include "llvm/IR/LegacyPassManager.h"
-#include "llvm/Transforms/IPO/PassManagerBuilder.h"
+#include "llvm/Transforms/Utils/ModuleUtils.h"
 #include "llvm/IR/Intrinsics.h"
+#include "llvm/IR/MDBuilder.h"
+#include "llvm/IR/Operator.h"
+#include "llvm/IR/PassManager.h"
+#include "llvm/Passes/PassBuilder.h"
+#include "llvm/Passes/PassPlugin.h"
 #include <vector>
 #include <map>
 #include <string>
@@ -28,26 +33,27 @@ namespace {
         unsigned LineNumber;
         unsigned ColumnNumber;
         uint32_t CallSiteId;
+        uint32_t Shape;
     };
 
-    class AFLIndirectCallTracker : public ModulePass {
-    public:
-        static char ID;
-        AFLIndirectCallTracker() : ModulePass(ID) {}
+    // i8*, or the opaque pointer type of LLVM 17 and later
+    Type *ptrType(LLVMContext &C) {
+#if LLVM_VERSION_MAJOR >= 17
+        return PointerType::getUnqual(C);
+#else
+        return Type::getInt8PtrTy(C);
+#endif
+    }
 
-        bool runOnModule(Module &M) override {
-            LLVMContext &C = M.getContext();
-            
-            // Create global variables and structures for tracking
-            GlobalVariable *CallSiteCounter = createGlobalCounter(M, "__afl_indirect_call_site_counter");
-            GlobalVariable *CallInfoArray = createCallInfoArray(M);
-            
+    // The instrumentation, shared by the new and the legacy pass manager
+    class AFLIndirectCallTracker {
+    public:
+        bool instrumentModule(Module &M) {
             // Get or create the logging function
-            Function *LogFunc = getOrCreateLogFunction(M);
-            Function *ResolveNameFunc = getOrCreateResolveNameFunction(M);
+            FunctionCallee TraceFunc = getOrCreateTraceFunction(M);
             
             bool ModifiedIR = false;
-            std::vector<std::pair<CallInst*, IndirectCallInfo>> IndirectCalls;
+            std::vector<std::pair<CallBase*, IndirectCallInfo>> IndirectCalls;
             uint32_t CallSiteId = 0;
             
             // Collect all indirect call sites with metadata
@@ -56,23 +62,26 @@ namespace {
                 
                 for (BasicBlock &BB : F) {
                     for (Instruction &I : BB) {
-                        if (CallInst *CI = dyn_cast<CallInst>(&I)) {
-                            // Check if this is an indirect call
-                            if (!CI->getCalledFunction()) {
-                                IndirectCallInfo Info = extractCallInfo(CI, F, CallSiteId++);
-                                IndirectCalls.push_back({CI, Info});
-                            }
+                        // Calls, invokes and callbrs through a pointer; inline
+                        // asm has no address to log
+                        CallBase *CB = dyn_cast<CallBase>(&I);
+                        if (CB && !CB->getCalledFunction() && !CB->isInlineAsm()) {
+                            IndirectCallInfo Info = extractCallInfo(CB, F, CallSiteId++);
+                            IndirectCalls.push_back({CB, Info});
                         }
                     }
                 }
             }
             
-            // Create static call site information
-            createStaticCallSiteInfo(M, IndirectCalls);
+            // Create static call site information, the site states and the function table
+            std::vector<Constant*> CallerInfos;
+            createRegistration(M, createSiteTable(M, IndirectCalls, CallerInfos), createFunctionTable(M));
+            std::vector<Constant*> SiteStates = createSiteStates(M, IndirectCalls.size());
             
             // Instrument each indirect call site
-            for (auto &Pair : IndirectCalls) {
-                instrumentIndirectCall(Pair.first, Pair.second, LogFunc, ResolveNameFunc, M);
+            for (size_t I = 0; I < IndirectCalls.size(); ++I) {
+                instrumentIndirectCall(IndirectCalls[I].first, IndirectCalls[I].second, CallerInfos[I],
+                                       SiteStates[I], TraceFunc, M);
                 ModifiedIR = true;
             }
             
@@ -80,20 +89,21 @@ namespace {
         }
 
     private:
-        IndirectCallInfo extractCallInfo(CallInst *CI, Function &F, uint32_t CallSiteId) {
+        IndirectCallInfo extractCallInfo(CallBase *CB, Function &F, uint32_t CallSiteId) {
             IndirectCallInfo Info;
             Info.CallerFunction = F.getName().str();
             Info.CallSiteId = CallSiteId;
             Info.FileName = "unknown";
             Info.LineNumber = 0;
             Info.ColumnNumber = 0;
+            Info.Shape = siteShape(CB);
             
             // Extract debug information if available
-            if (const DebugLoc &DL = CI->getDebugLoc()) {
+            if (const DebugLoc &DL = CB->getDebugLoc()) {
                 Info.LineNumber = DL.getLine();
                 Info.ColumnNumber = DL.getCol();
                 
-                if (DIScope *Scope = DL.getScope()) {
+                if (DIScope *Scope = dyn_cast_or_null<DIScope>(DL.getScope())) {
                     if (DIFile *File = Scope->getFile()) {
                         Info.FileName = File->getFilename().str();
                     }
@@ -103,158 +113,371 @@ namespace {
             return Info;
         }
 
-        GlobalVariable* createGlobalCounter(Module &M, const std::string &Name) {
-            LLVMContext &C = M.getContext();
-            Type *Int32Ty = Type::getInt32Ty(C);
-            
-            GlobalVariable *Counter = new GlobalVariable(
-                M, Int32Ty, false, GlobalValue::ExternalLinkage,
-                ConstantInt::get(Int32Ty, 0), Name);
-            
-            return Counter;
+        // FNV-1a of a shape description, folded to 32 bits; 0 means unknown
+        static uint32_t shapeHash(StringRef Shape) {
+            uint64_t Hash = functionId(Shape);
+            uint32_t Folded = (uint32_t)(Hash ^ (Hash >> 32));
+            return Folded ? Folded : 1;
         }
-        
-        GlobalVariable* createCallInfoArray(Module &M) {
-            LLVMContext &C = M.getContext();
-            Type *Int8PtrTy = Type::getInt8PtrTy(C);
-            
-            // Create array for storing call site info strings
-            ArrayType *ArrayTy = ArrayType::get(Int8PtrTy, 65536);
-            
-            GlobalVariable *InfoArray = new GlobalVariable(
-                M, ArrayTy, false, GlobalValue::ExternalLinkage,
-                ConstantAggregateZero::get(ArrayTy), "__afl_call_site_info");
-            
-            return InfoArray;
+
+        // Where the called pointer comes from, in terms a points-to analysis
+        // cares about
+        static const char *pointerOrigin(Value *V) {
+            V = V->stripPointerCasts();
+            if (LoadInst *Load = dyn_cast<LoadInst>(V)) {
+                Value *Ptr = Load->getPointerOperand()->stripPointerCasts();
+                if (GEPOperator *GEP = dyn_cast<GEPOperator>(Ptr))
+                    return GEP->getSourceElementType()->isStructTy() ? "load-field" : "load-element";
+                if (isa<GlobalVariable>(Ptr))
+                    return "load-global";
+                if (isa<AllocaInst>(Ptr))
+                    return "load-local";
+                if (isa<Argument>(Ptr))
+                    return "load-argument";
+                return "load";
+            }
+            if (isa<Argument>(V))
+                return "argument";
+            if (isa<PHINode>(V) || isa<SelectInst>(V))
+                return "merge";
+            if (isa<CallBase>(V))
+                return "returned";
+            return "other";
         }
-        
-        void createStaticCallSiteInfo(Module &M, 
-                                    const std::vector<std::pair<CallInst*, IndirectCallInfo>> &IndirectCalls) {
+
+        // A call site without its names: the kind of call, the callee type and
+        // the pointer's origin. The same shape in two programs has the same
+        // hash, which the runtime's coverage map is indexed by.
+        static uint32_t siteShape(CallBase *CB) {
+            std::string Shape;
+            raw_string_ostream OS(Shape);
+            OS << (isa<InvokeInst>(CB) ? "invoke" : isa<CallBrInst>(CB) ? "callbr" : "call") << '|';
+            CB->getFunctionType()->print(OS);
+            OS << '|' << pointerOrigin(CB->getCalledOperand());
+            return shapeHash(OS.str());
+        }
+
+        // A target without its name: linkage, whether it is defined here, and type
+        static uint32_t targetShape(Function &F) {
+            std::string Shape;
+            raw_string_ostream OS(Shape);
+            OS << (F.hasLocalLinkage() ? "internal" : "external") << '|'
+               << (F.isDeclaration() ? "declaration" : "definition") << '|';
+            F.getFunctionType()->print(OS);
+            return shapeHash(OS.str());
+        }
+
+        static std::string callerInfo(const IndirectCallInfo &Info) {
+            return Info.CallerFunction + ":" + Info.FileName + ":" +
+                   std::to_string(Info.LineNumber) + ":" +
+                   std::to_string(Info.ColumnNumber);
+        }
+
+        // Global and length of a table the module constructor registers
+        struct Table {
+            GlobalVariable *Global = nullptr;
+            uint64_t Count = 0;
+            GlobalVariable *Strings = nullptr;  // the string pool of the site table
+            GlobalVariable *Shapes = nullptr;   // the shapes of the site table
+        };
+
+        // One pool of distinct, NUL-separated caller info strings
+        // (__afl_site_strings) and the offset of each site's string in it,
+        // indexed by call site ID (__afl_site_offsets), as well as the site's
+        // shape (__afl_site_shapes). CallerInfos receives the constant pointer
+        // to each site's string.
+        Table createSiteTable(Module &M,
+                              const std::vector<std::pair<CallBase*, IndirectCallInfo>> &IndirectCalls,
+                              std::vector<Constant*> &CallerInfos) {
             LLVMContext &C = M.getContext();
-            
-            // Create global strings for each call site
+            Type *Int32Ty = Type::getInt32Ty(C);
+            if (IndirectCalls.empty()) {
+                return Table();
+            }
+
+            std::map<std::string, uint32_t> Offsets;
+            std::string Pool;
+            std::vector<uint32_t> SiteOffsets, SiteShapes;
             for (const auto &Pair : IndirectCalls) {
-                const IndirectCallInfo &Info = Pair.second;
-                
-                std::string InfoStr = Info.CallerFunction + ":" + Info.FileName + ":" + 
-                                    std::to_string(Info.LineNumber) + ":" + 
-                                    std::to_string(Info.ColumnNumber);
-                
-                // Create global string constant
-                Constant *InfoStrConstant = ConstantDataArray::getString(C, InfoStr, true);
-                GlobalVariable *InfoStrGlobal = new GlobalVariable(
-                    M, InfoStrConstant->getType(), true, GlobalValue::PrivateLinkage,
-                    InfoStrConstant, "__afl_call_site_" + std::to_string(Info.CallSiteId));
+                SiteShapes.push_back(Pair.second.Shape);
+                std::string Info = callerInfo(Pair.second);
+                auto It = Offsets.find(Info);
+                if (It == Offsets.end()) {
+                    It = Offsets.emplace(Info, Pool.size()).first;
+                    Pool += Info;
+                    Pool.push_back('\0');
+                }
+                SiteOffsets.push_back(It->second);
+            }
+
+            Constant *PoolConstant = ConstantDataArray::getString(C, Pool, false);
+            GlobalVariable *Strings = new GlobalVariable(
+                M, PoolConstant->getType(), true, GlobalValue::PrivateLinkage,
+                PoolConstant, "__afl_site_strings");
+            Constant *OffsetsConstant = ConstantDataArray::get(C, SiteOffsets);
+            GlobalVariable *OffsetsGlobal = new GlobalVariable(
+                M, OffsetsConstant->getType(), true, GlobalValue::PrivateLinkage,
+                OffsetsConstant, "__afl_site_offsets");
+            Constant *ShapesConstant = ConstantDataArray::get(C, SiteShapes);
+            GlobalVariable *ShapesGlobal = new GlobalVariable(
+                M, ShapesConstant->getType(), true, GlobalValue::PrivateLinkage,
+                ShapesConstant, "__afl_site_shapes");
+
+            for (uint32_t Offset : SiteOffsets) {
+                CallerInfos.push_back(ConstantExpr::getInBoundsGetElementPtr(
+                    PoolConstant->getType(), Strings,
+                    ArrayRef<Constant*>{ConstantInt::get(Int32Ty, 0), ConstantInt::get(Int32Ty, Offset)}));
             }
+            Table Sites;
+            Sites.Global = OffsetsGlobal;
+            Sites.Count = SiteOffsets.size();
+            Sites.Strings = Strings;
+            Sites.Shapes = ShapesGlobal;
+            return Sites;
         }
         
-        Function* getOrCreateLogFunction(Module &M) {
+        // Stable ID of a function: FNV-1a of its name, with the top bit set so
+        // that an ID is never a user-space address. pafuzz.tracer.reader's
+        // function_id() computes the same value.
+        static uint64_t functionId(StringRef Name) {
+            uint64_t Hash = 0xcbf29ce484222325ULL;
+            for (unsigned char Ch : Name) {
+                Hash ^= Ch;
+                Hash *= 0x100000001b3ULL;
+            }
+            return Hash | (1ULL << 63);
+        }
+
+        // { i8* address, i64 id, i8* name, i32 shape } for every address-taken
+        // function; with it the runtime records IDs instead of symbolizing
+        // addresses.
+        Table createFunctionTable(Module &M) {
             LLVMContext &C = M.getContext();
-            
-            Function *LogFunc = M.getFunction("__afl_log_indirect_call");
-            if (LogFunc) {
-                return LogFunc;
+            Type *Int32Ty = Type::getInt32Ty(C);
+            Type *Int64Ty = Type::getInt64Ty(C);
+            Type *Int8PtrTy = ptrType(C);
+            StructType *EntryTy = StructType::get(C, {Int8PtrTy, Int64Ty, Int8PtrTy, Int32Ty});
+
+            std::vector<Constant*> Entries;
+            for (Function &F : M) {
+                if (F.isIntrinsic() || F.hasExternalWeakLinkage() ||
+                    F.getName().find("__afl_") == 0 || !F.hasAddressTaken())
+                    continue;
+
+                Constant *NameStr = ConstantDataArray::getString(C, F.getName(), true);
+                GlobalVariable *NameGlobal = new GlobalVariable(
+                    M, NameStr->getType(), true, GlobalValue::PrivateLinkage,
+                    NameStr, "__afl_function_name");
+                Entries.push_back(ConstantStruct::get(EntryTy, {
+                    ConstantExpr::getPointerCast(&F, Int8PtrTy),
+                    ConstantInt::get(Int64Ty, functionId(F.getName())),
+                    ConstantExpr::getPointerCast(NameGlobal, Int8PtrTy),
+                    ConstantInt::get(Int32Ty, targetShape(F))
+                }));
             }
-            
-            // void __afl_log_indirect_call(int call_site_id, void* target_func, 
-            //                              char* caller_info, char* target_name)
+            if (Entries.empty()) {
+                return Table();
+            }
+
+            ArrayType *TableTy = ArrayType::get(EntryTy, Entries.size());
+            Table Functions;
+            Functions.Global = new GlobalVariable(
+                M, TableTy, true, GlobalValue::PrivateLinkage,
+                ConstantArray::get(TableTy, Entries), "__afl_function_table");
+            Functions.Count = Entries.size();
+            return Functions;
+        }
+
+        // A constructor that registers the module's tables with the runtime
+        void createRegistration(Module &M, const Table &Sites, const Table &Functions) {
+            if (!Sites.Global && !Functions.Global) {
+                return;
+            }
+            LLVMContext &C = M.getContext();
             Type *VoidTy = Type::getVoidTy(C);
-            Type *Int32Ty = Type::getInt32Ty(C);
-            Type *Int8PtrTy = Type::getInt8PtrTy(C);
-            
-            FunctionType *LogFuncTy = FunctionType::get(
-                VoidTy, {Int32Ty, Int8PtrTy, Int8PtrTy, Int8PtrTy}, false);
-            
-            LogFunc = Function::Create(
-                LogFuncTy, Function::ExternalLinkage,
-                "__afl_log_indirect_call", &M);
-            
-            return LogFunc;
+            Type *Int64Ty = Type::getInt64Ty(C);
+            Type *Int8PtrTy = ptrType(C);
+
+            Function *Ctor = Function::Create(
+                FunctionType::get(VoidTy, false), GlobalValue::InternalLinkage,
+                "__afl_register_module", &M);
+            IRBuilder<> Builder(BasicBlock::Create(C, "entry", Ctor));
+            if (Sites.Global) {
+                // void __afl_register_sites(const char* strings, const uint32_t* offsets,
+                //                           const uint32_t* shapes, uint64_t count)
+                FunctionCallee RegisterFunc = M.getOrInsertFunction(
+                    "__afl_register_sites", VoidTy, Int8PtrTy, Int8PtrTy, Int8PtrTy, Int64Ty);
+                Builder.CreateCall(RegisterFunc, {
+                    ConstantExpr::getPointerCast(Sites.Strings, Int8PtrTy),
+                    ConstantExpr::getPointerCast(Sites.Global, Int8PtrTy),
+                    ConstantExpr::getPointerCast(Sites.Shapes, Int8PtrTy),
+                    ConstantInt::get(Int64Ty, Sites.Count)
+                });
+            }
+            if (Functions.Global) {
+                // void __afl_register_functions(const void* table, uint64_t count)
+                FunctionCallee RegisterFunc = M.getOrInsertFunction(
+                    "__afl_register_functions", VoidTy, Int8PtrTy, Int64Ty);
+                Builder.CreateCall(RegisterFunc, {
+                    ConstantExpr::getPointerCast(Functions.Global, Int8PtrTy),
+                    ConstantInt::get(Int64Ty, Functions.Count)
+                });
+            }
+            Builder.CreateRetVoid();
+
+            // Before the program's own constructors, which may already call indirectly
+            appendToGlobalCtors(M, Ctor, 1);
         }
-        
-        Function* getOrCreateResolveNameFunction(Module &M) {
+
+        // { i8* last, i32 countdown, i32 hits } per call site (the runtime's
+        // SiteState), zero-initialized: __afl_site_state
+        static StructType *siteStateType(LLVMContext &C) {
+            return StructType::get(C, {ptrType(C), Type::getInt32Ty(C), Type::getInt32Ty(C)});
+        }
+
+        std::vector<Constant*> createSiteStates(Module &M, size_t Count) {
+            std::vector<Constant*> SiteStates;
+            if (Count == 0) {
+                return SiteStates;
+            }
             LLVMContext &C = M.getContext();
-            
-            Function *ResolveFunc = M.getFunction("__afl_resolve_function_name");
-            if (ResolveFunc) {
-                return ResolveFunc;
+            Type *Int32Ty = Type::getInt32Ty(C);
+            ArrayType *StatesTy = ArrayType::get(siteStateType(C), Count);
+            GlobalVariable *States = new GlobalVariable(
+                M, StatesTy, false, GlobalValue::InternalLinkage,
+                ConstantAggregateZero::get(StatesTy), "__afl_site_state");
+            States->setAlignment(Align(16));
+            for (size_t I = 0; I < Count; ++I) {
+                SiteStates.push_back(ConstantExpr::getInBoundsGetElementPtr(
+                    StatesTy, States,
+                    ArrayRef<Constant*>{ConstantInt::get(Int32Ty, 0), ConstantInt::get(Int32Ty, I)}));
             }
+            return SiteStates;
+        }
+
+        FunctionCallee getOrCreateTraceFunction(Module &M) {
+            LLVMContext &C = M.getContext();
             
-            // char* __afl_resolve_function_name(void* func_ptr)
-            Type *Int8PtrTy = Type::getInt8PtrTy(C);
-            
-            FunctionType *ResolveFuncTy = FunctionType::get(
-                Int8PtrTy, {Int8PtrTy}, false);
-            
-            ResolveFunc = Function::Create(
-                ResolveFuncTy, Function::ExternalLinkage,
-                "__afl_resolve_function_name", &M);
+            // void __afl_trace_indirect_call(void* site_state, int call_site_id,
+            //                                void* target_func, char* caller_info)
+            Type *VoidTy = Type::getVoidTy(C);
+            Type *Int32Ty = Type::getInt32Ty(C);
+            Type *Int8PtrTy = ptrType(C);
             
-            return ResolveFunc;
+            return M.getOrInsertFunction(
+                "__afl_trace_indirect_call", VoidTy, Int8PtrTy, Int32Ty, Int8PtrTy, Int8PtrTy);
         }
         
-        void instrumentIndirectCall(CallInst *CI, const IndirectCallInfo &Info,
-                                  Function *LogFunc, Function *ResolveNameFunc, Module &M) {
+        // The runtime is only called if the site is not muted or calls a
+        // different target than last time; a muted site's call that hits
+        // only decrements its countdown:
+        //
+        //   if (state.countdown != 0 && state.last == target) --state.countdown;
+        //   else __afl_trace_indirect_call(&state, id, target, caller_info);
+        void instrumentIndirectCall(CallBase *CB, const IndirectCallInfo &Info, Constant *CallerInfoPtr,
+                                  Constant *SiteState, FunctionCallee TraceFunc, Module &M) {
             LLVMContext &C = M.getContext();
-            IRBuilder<> Builder(CI);
+            Type *Int32Ty = Type::getInt32Ty(C);
+            Type *Int8PtrTy = ptrType(C);
+            StructType *StateTy = siteStateType(C);
+            IRBuilder<> Builder(CB);
             
             // Get the called value (function pointer)
-            Value *CalledValue = CI->getCalledValue();
+            Value *CalledValue = CB->getCalledOperand();
             
             // Cast function pointer to i8*
-            Value *FuncPtr = Builder.CreateBitCast(
-                CalledValue, Type::getInt8PtrTy(C), "func_ptr");
-            
-            // Create call site info string
-            std::string CallerInfo = Info.CallerFunction + ":" + Info.FileName + ":" + 
-                                   std::to_string(Info.LineNumber) + ":" + 
-                                   std::to_string(Info.ColumnNumber);
-            
-            // Create global string for caller info
-            Constant *CallerInfoStr = ConstantDataArray::getString(C, CallerInfo, true);
-            GlobalVariable *CallerInfoGlobal = new GlobalVariable(
-                M, CallerInfoStr->getType(), true, GlobalValue::PrivateLinkage,
-                CallerInfoStr, "__afl_caller_info_" + std::to_string(Info.CallSiteId));
-            
-            // Get pointer to the string
-            Value *CallerInfoPtr = Builder.CreateInBoundsGEP(
-                CallerInfoStr->getType(), CallerInfoGlobal,
-                {ConstantInt::get(Type::getInt32Ty(C), 0), 
-                 ConstantInt::get(Type::getInt32Ty(C), 0)});
-            
-            // Resolve target function name at runtime
-            Value *TargetName = Builder.CreateCall(ResolveNameFunc, {FuncPtr}, "target_name");
-            
-            // Call logging function
-            Builder.CreateCall(LogFunc, {
-                ConstantInt::get(Type::getInt32Ty(C), Info.CallSiteId),
+            Value *FuncPtr = Builder.CreateBitCast(CalledValue, Int8PtrTy, "func_ptr");
+            
+            // Inline check; the fields are read and written with relaxed atomics,
+            // which are plain loads and stores
+            Value *CountdownPtr = Builder.CreateStructGEP(StateTy, SiteState, 1);
+            LoadInst *Last = Builder.CreateAlignedLoad(Int8PtrTy, Builder.CreateStructGEP(StateTy, SiteState, 0),
+                                                       Align(8), "last_target");
+            Last->setAtomic(AtomicOrdering::Monotonic);
+            LoadInst *Countdown = Builder.CreateAlignedLoad(Int32Ty, CountdownPtr, Align(4), "countdown");
+            Countdown->setAtomic(AtomicOrdering::Monotonic);
+            Value *Skip = Builder.CreateAnd(Builder.CreateICmpNE(Countdown, ConstantInt::get(Int32Ty, 0)),
+                                            Builder.CreateICmpEQ(Last, FuncPtr), "skip_log");
+            
+            Instruction *SkipTerm, *LogTerm;
+            SplitBlockAndInsertIfThenElse(Skip, CB, &SkipTerm, &LogTerm,
+                                          MDBuilder(C).createBranchWeights(2000, 1));
+            
+            Builder.SetInsertPoint(SkipTerm);
+            StoreInst *Decrement = Builder.CreateAlignedStore(
+                Builder.CreateSub(Countdown, ConstantInt::get(Int32Ty, 1)), CountdownPtr, Align(4));
+            Decrement->setAtomic(AtomicOrdering::Monotonic);
+            
+            // Call the runtime, which decides whether to log
+            Builder.SetInsertPoint(LogTerm);
+            Builder.CreateCall(TraceFunc, {
+                ConstantExpr::getPointerCast(SiteState, Int8PtrTy),
+                ConstantInt::get(Int32Ty, Info.CallSiteId),
                 FuncPtr,
-                CallerInfoPtr,
-                TargetName
+                CallerInfoPtr
             });
         }
     };
+
+    // New pass manager
+    struct AFLIndirectCallTrackerPass : PassInfoMixin<AFLIndirectCallTrackerPass> {
+        PreservedAnalyses run(Module &M, ModuleAnalysisManager &) {
+            return AFLIndirectCallTracker().instrumentModule(M) ? PreservedAnalyses::none()
+                                                                : PreservedAnalyses::all();
+        }
+
+        // Also run on optnone functions, which clang -O0 emits
+        static bool isRequired() { return true; }
+    };
 }
 
-char AFLIndirectCallTracker::ID = 0;
+#if LLVM_VERSION_MAJOR < 14
+using OptimizationLevel = PassBuilder::OptimizationLevel;
+#endif
 
-// Register the pass
-static RegisterPass<AFLIndirectCallTracker> X(
-    "afl-indirect-call-tracker", 
-    "AFL Indirect Call Tracker Pass with Detailed Info",
-    false, false);
+// Plugin entry point, for
+//   clang -fpass-plugin=trace_icall.so ...      (runs last in every pipeline, -O0 included)
+//   opt -load-pass-plugin=trace_icall.so -passes=afl-indirect-call-tracker ...
+extern "C" LLVM_ATTRIBUTE_WEAK PassPluginLibraryInfo llvmGetPassPluginInfo() {
+    return {LLVM_PLUGIN_API_VERSION, "AFLIndirectCallTracker", LLVM_VERSION_STRING,
+            [](PassBuilder &PB) {
+                PB.registerPipelineParsingCallback(
+                    [](StringRef Name, ModulePassManager &MPM, ArrayRef<PassBuilder::PipelineElement>) {
+                        if (Name != "afl-indirect-call-tracker") {
+                            return false;
+                        }
+                        MPM.addPass(AFLIndirectCallTrackerPass());
+                        return true;
+                    });
+                PB.registerOptimizerLastEPCallback(
+#if LLVM_VERSION_MAJOR >= 20
+                    [](ModulePassManager &MPM, OptimizationLevel, ThinOrFullLTOPhase) {
+#else
+                    [](ModulePassManager &MPM, OptimizationLevel) {
+#endif
+                        MPM.addPass(AFLIndirectCallTrackerPass());
+                    });
+            }};
+}
+
+#if LLVM_VERSION_MAJOR < 15
+// Legacy pass manager, for opt -enable-new-pm=0 -load trace_icall.so -afl-indirect-call-tracker
+namespace {
+    class LegacyAFLIndirectCallTracker : public ModulePass {
+    public:
+        static char ID;
+        LegacyAFLIndirectCallTracker() : ModulePass(ID) {}
 
-// Register with pass manager
-static void registerAFLIndirectCallTracker(const PassManagerBuilder &,
-                                         legacy::PassManagerBase &PM) {
-    PM.add(new AFLIndirectCallTracker());
+        bool runOnModule(Module &M) override {
+            return AFLIndirectCallTracker().instrumentModule(M);
+        }
+    };
 }
 
-static RegisterStandardPasses RegisterAFLIndirectCallTracker(
-    PassManagerBuilder::EP_OptimizerLast,
-    registerAFLIndirectCallTracker);
+char LegacyAFLIndirectCallTracker::ID = 0;
 
-static RegisterStandardPasses RegisterAFLIndirectCallTracker0(
-    PassManagerBuilder::EP_EnabledOnOptLevel0,
-    registerAFLIndirectCallTracker);
-    
\ No newline at end of file
+static RegisterPass<LegacyAFLIndirectCallTracker> X(
+    "afl-indirect-call-tracker", 
+    "AFL Indirect Call Tracker Pass with Detailed Info",
+    false, false);
+#endif
@@ -9,13 +9,18 @@ like Csmith and YARPGen. The module has been reorganized for better structure:
 """
 
 # Import from the new core module
-from .csmith import CsmithGenerator, generate_c_program
+from .csmith import CsmithGenerator, GeneratedProgram, generate_c_program
+from .pool import ProgramPool
+from .fptr import FptrGenerator
+from .sizing import SizeBand, SizeController
+from .seeds import SeedAllocator
 from .yarpgen import YarpgenGenerator, generate_cpp_program
 
 # Import utilities and config
 from pafuzz.generators.config import config, load_config
 from pafuzz.generators.utils import run_cmd, sanitize_check, cleanup_tmp_files, check_undefined_behavior
 from pafuzz.generators.genbc import generate_llvm_bitcode as generate_bitcode
+from pafuzz.generators.genbc import CompileArtifacts, compile_artifacts, compile_project
 
 __all__ = [
     # Core generators (recommended)
@@ -23,7 +28,16 @@ __all__ = [
     'YarpgenGenerator',
     'generate_c_program',
     'generate_bitcode',
+    'compile_artifacts',
+    'compile_project',
+    'CompileArtifacts',
     'generate_cpp_program',
+    'GeneratedProgram',
+    'ProgramPool',
+    'FptrGenerator',
+    'SizeBand',
+    'SizeController',
+    'SeedAllocator',
     # Utilities
     'config',
     'load_config',
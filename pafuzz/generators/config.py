@@ -24,11 +24,34 @@ DEFAULT_CONFIG = {
     # Compilers
     "GCC": "gcc",
     "CLANG": "clang",
+    "CLANGXX": "clang++",
+    "LLVM_LINK": "llvm-link",
+    "OPT": "opt",
     
     # Sanitizer files
     "SAN_FILE": "",
     "YARP_SAN_FILE": "",
+
+    # Append-only file of UB check verdicts ("" keeps them in memory only)
+    "UB_CACHE": "",
     
+    # Precompiled csmith.h for all clang invocations ("" PCH_DIR: ~/.pafuzz/pch)
+    "USE_PCH": True,
+    "PCH_DIR": "",
+
+    # Cache of per-translation-unit bitcode of multi-file programs ("" disables it)
+    "BC_CACHE_DIR": "",
+
+    # trace_icall pass and its runtime library, for dynamic soundness checks
+    "TRACE_PASS": "",
+    "TRACE_RUNTIME": "",
+
+    # Seed partitioning: id of this machine, and the log of tested (seed, configuration)
+    # pairs shared by a campaign ("" keeps it in memory only); the defaults of
+    # pts_diff_new.py --node-id and --seed-log
+    "NODE_ID": 0,
+    "SEED_LOG": "",
+
     # Constraints
     "MIN_PROGRAM_SIZE": 20000
 }
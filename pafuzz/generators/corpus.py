@@ -0,0 +1,120 @@
+"""Corpus of productive programs for coverage-guided generation.
+
+Csmith programs cannot be mutated at the source level and stay valid, so the
+corpus keeps what produced a program instead: its seed and its swarm
+configuration, next to a copy of its source and bitcode. A program goes into
+the corpus when its traced run showed indirect call patterns that no earlier
+program had (see pafuzz.tracer.coverage).
+
+The corpus is also a swarm selector for CsmithGenerator (it has the
+SwarmSelector interface). Most configurations are drawn from its entries,
+favouring the ones that found many patterns and have been drawn rarely; half
+of them are reused as they are (regenerated with a new seed), the other half
+with one feature flipped. The rest, and all of them while the corpus is
+empty, come from the fallback selector, so that new regions keep being
+explored.
+
+Entries are appended to <directory>/corpus.jsonl and loaded again by the next
+Corpus on the same directory, so a campaign can resume from it, and
+<directory> doubles as a --seed-dir of bitcode files. fuzz-pta/pts_diff_new.py
+clears --output on every start, so it only resumes from a --corpus directory
+outside of it. There, every worker process has a corpus of its own
+(worker_<i>); the virgin map is shared (see pafuzz.tracer.coverage).
+"""
+
+import json
+import os
+import random
+import shutil
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from pafuzz.generators.csmith import GeneratedProgram
+from pafuzz.generators.swarm import SwarmSelector
+
+
+@dataclass
+class CorpusEntry:
+    seed: int
+    swarm: Dict[str, bool]
+    patterns: int  # new patterns the program found when it was added
+    picks: int = field(default=0, compare=False)  # configurations drawn from it so far
+
+
+class Corpus:
+    """Programs that found new patterns, and a swarm selector that generates more like them."""
+
+    def __init__(self, directory: str, fallback: SwarmSelector, explore: float = 0.2,
+                 mutate: float = 0.5):
+        """
+        Args:
+            directory: Where the entries and copies of their programs are kept
+            fallback: Selector for the configurations not drawn from the corpus;
+                it also gets the feedback passed to record()
+            explore: Share of the configurations drawn from the fallback
+            mutate: Share of the corpus configurations with one feature flipped
+        """
+        self.directory = directory
+        self.fallback = fallback
+        self.explore = explore
+        self.mutate = mutate
+        self.entries: List[CorpusEntry] = []
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._log = os.path.join(directory, "corpus.jsonl")
+        if os.path.exists(self._log):
+            with open(self._log) as f:
+                for line in f:
+                    try:
+                        self.entries.append(CorpusEntry(**json.loads(line)))
+                    except (ValueError, TypeError):
+                        continue  # line cut short by an interrupted campaign
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, program: GeneratedProgram, patterns: int) -> Optional[CorpusEntry]:
+        """Keep a program that found new patterns (not if it has no swarm configuration)."""
+        if program.swarm is None or patterns <= 0:
+            return None
+        entry = CorpusEntry(program.seed, dict(program.swarm), patterns)
+        for path in (program.source, program.bitcode):
+            if path is not None and os.path.exists(path):
+                shutil.copy(path, self.directory)
+        with self._lock:
+            self.entries.append(entry)
+            with open(self._log, 'a') as f:
+                f.write(json.dumps(asdict(entry)) + "\n")
+        return entry
+
+    def sample(self, rng: random.Random) -> Dict[str, bool]:
+        """Draw a configuration (feature -> enabled) using rng only."""
+        with self._lock:
+            if not self.entries or rng.random() < self.explore:
+                entry = None
+            else:
+                weights = [e.patterns / (1 + e.picks) for e in self.entries]
+                entry = rng.choices(self.entries, weights)[0]
+                entry.picks += 1
+        if entry is None:
+            return self.fallback.sample(rng)
+
+        config = {feature: entry.swarm.get(feature, False) for feature in self.fallback.features}
+        if rng.random() < self.mutate:
+            # Flip one feature, keeping the fallback's floor of enabled features
+            enabled = sum(config.values())
+            flippable = [f for f, on in config.items()
+                         if not on or enabled > self.fallback.min_enabled]
+            if flippable:
+                feature = rng.choice(flippable)
+                config[feature] = not config[feature]
+        return config
+
+    def record(self, config: Dict[str, bool], productive: bool):
+        """Update the fallback's statistics with the outcome of a program generated with config."""
+        self.fallback.record(config, productive)
+
+    def save(self, path: Optional[str] = None):
+        """Save the fallback's statistics; entries are written as they are added."""
+        self.fallback.save(path)
@@ -4,16 +4,45 @@ import json
 import logging
 import os
 import random
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional
 
 from pafuzz.generators.config import config
+from pafuzz.generators.genbc import compile_artifacts
+from pafuzz.generators.seeds import MAX_SEED, SeedAllocator
+from pafuzz.generators.swarm import SwarmSelector
 from pafuzz.generators.utils import check_undefined_behavior, cleanup_tmp_files
 
+if TYPE_CHECKING:
+    # sizing imports fptr, which builds on this module
+    from pafuzz.generators.sizing import SizeController
+
+@dataclass
+class GeneratedProgram:
+    """A generated test program, ready to be analyzed."""
+    seed: int
+    source: Path  # a directory for multi-file programs
+    bitcode: Optional[Path] = None
+    swarm: Optional[Dict[str, bool]] = None  # swarm configuration it was generated with
+
+    def remove(self):
+        """Delete the files of this program."""
+        for path in (self.source, self.bitcode):
+            if path is not None and path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            elif path is not None:
+                path.unlink(missing_ok=True)
+
 
 class CsmithGenerator:
     """Unified Csmith generator with swarm testing, UB checking, and LLVM bitcode support."""
+
+    # Name of the generation profile, part of the configuration a seed is claimed with
+    PROFILE = 'csmith'
     
     # Comprehensive swarm testing features (merged from both generators)
     SWARM_FEATURES = [
@@ -32,17 +61,35 @@ class CsmithGenerator:
     
     def __init__(self, csmith_path: Optional[str] = None,
                  clang_path: Optional[str] = None,
-                 csmith_runtime: Optional[str] = None):
-        """Initialize generator with optional custom paths."""
+                 csmith_runtime: Optional[str] = None,
+                 swarm_selector: Optional[SwarmSelector] = None,
+                 size_controller: Optional['SizeController'] = None,
+                 seed_allocator: Optional[SeedAllocator] = None):
+        """Initialize generator with optional custom paths.
+
+        If a swarm selector is given, swarm configurations are drawn from it
+        instead of by coin flips (see pafuzz.generators.swarm).
+        If a size controller is given, generate_program() sets the csmith knobs
+        from it and regenerates programs outside its band (see
+        pafuzz.generators.sizing).
+        If a seed allocator is given, missing seeds are taken from its slice
+        of the seed space and generate_program() skips (seed, swarm
+        configuration) pairs that were already tested (see
+        pafuzz.generators.seeds).
+        """
         self.csmith_path = csmith_path or config.CSMITH
         self.clang_path = clang_path or config.CLANG
         self.csmith_runtime = csmith_runtime or config.CSMITH_HOME
+        self.swarm_selector = swarm_selector
+        self.size_controller = size_controller
+        self.seed_allocator = seed_allocator
 
     
     def generate(self, output_file: str, seed: Optional[int] = None,
                 functions: int = 5, swarm: bool = True, check_ub: bool = False,
                 max_struct_fields: int = 6, max_block_depth: int = 5,
-                max_array_dim: int = 3, custom_options: Optional[List[str]] = None) -> bool:
+                max_array_dim: int = 3, custom_options: Optional[List[str]] = None,
+                min_size: Optional[int] = None) -> bool:
         """Generate a C program using Csmith.
         
         Args:
@@ -55,19 +102,35 @@ class CsmithGenerator:
             max_block_depth: Maximum block depth
             max_array_dim: Maximum array dimensions
             custom_options: Additional custom Csmith options
+            min_size: Reject programs smaller than this many bytes
+                (default: MIN_PROGRAM_SIZE, 0 disables)
             
         Returns:
-            True if generation successful, False otherwise
+            True if generation successful, False otherwise (also if the seed
+            was drawn here and the seed allocator had it tested already)
         """
         try:
             
-            if seed is None:
-                seed = random.randint(1, 100000)
+            drawn = seed is None
+            if drawn:
+                seed = self.next_seed()
+
+            # Fix the swarm configuration once, so the claim and the command agree
+            swarm_map = self.swarm_config(seed) if swarm else None
+            custom_options = ((self.swarm_flags(swarm_map) if swarm else []) +
+                              list(custom_options or []))
+            # Explicit seeds are claimed by the caller (see generate_program)
+            if drawn and not self._claim(seed, swarm_map, functions=functions,
+                                         max_struct_fields=max_struct_fields,
+                                         max_block_depth=max_block_depth,
+                                         max_array_dim=max_array_dim,
+                                         custom_options=custom_options):
+                return False
             
             cmd = self._build_command(
-                output_file, seed, functions, swarm,
+                output_file, seed, functions, False,
                 max_struct_fields, max_block_depth, max_array_dim,
-                custom_options or []
+                custom_options
             )
             
             logging.info(f"Generating with seed {seed}: {' '.join(cmd)}")
@@ -85,6 +148,16 @@ class CsmithGenerator:
             if result.returncode != 0:
                 logging.error(f"Csmith failed: {result.stderr}")
                 return False
+
+            # Reject tiny programs before paying for the UB check and the analyzers
+            min_size = config.MIN_PROGRAM_SIZE if min_size is None else min_size
+            size = os.path.getsize(output_file)
+            if size < min_size:
+                logging.info(f"Rejected seed {seed}: {size} bytes < {min_size}")
+                return False
+
+            if not self._postprocess(output_file, seed):
+                return False
             
             # Check for undefined behavior if requested
             if check_ub and check_undefined_behavior(output_file, self.clang_path, self.csmith_runtime) != 0:
@@ -92,9 +165,7 @@ class CsmithGenerator:
                 return False
             
             logging.info(f"Successfully generated: {output_file}")
-            if os.path.exists(output_file):
-                size = os.path.getsize(output_file)
-                logging.info(f"File size: {size} bytes")
+            logging.info(f"File size: {os.path.getsize(output_file)} bytes")
             
             return True
             
@@ -105,6 +176,142 @@ class CsmithGenerator:
             logging.error(f"Generation failed: {str(e)}")
             return False
     
+    def _postprocess(self, output_file: str, seed: int) -> bool:
+        """Rewrite or filter a freshly generated program; False rejects it (see FptrGenerator)."""
+        return True
+
+    def claim_config(self, swarm: Optional[Dict[str, bool]], functions: int = 5,
+                     max_struct_fields: int = 6, max_block_depth: int = 5, max_array_dim: int = 3,
+                     custom_options: Optional[List[str]] = None, **_filters) -> Dict[str, Any]:
+        """The configuration a seed is claimed with: everything besides the seed that shapes
+        the program, i.e. the profile, the swarm configuration and the csmith knobs.
+
+        Takes the keyword arguments of generate(); the ones that only filter
+        programs (check_ub, min_size) are ignored.
+        """
+        return {'generator': self.PROFILE, 'swarm': swarm, 'functions': functions,
+                'max_struct_fields': max_struct_fields, 'max_block_depth': max_block_depth,
+                'max_array_dim': max_array_dim, 'custom_options': list(custom_options or [])}
+
+    def _claim(self, seed: int, swarm: Optional[Dict[str, bool]], **options) -> bool:
+        """Claim seed with the configuration of a generate() call (True without an allocator)."""
+        if (self.seed_allocator is None or
+                self.seed_allocator.claim(seed, self.claim_config(swarm, **options))):
+            return True
+        logging.info(f"Skipped seed {seed}: already tested with this configuration")
+        return False
+
+    def generate_program(self, output_dir: str, seed: int, check_ub: bool = False,
+                         bitcode: bool = False, **kwargs) -> Optional[GeneratedProgram]:
+        """Generate <output_dir>/csmith_<seed>.c, and its bitcode if requested.
+
+        Extra keyword arguments are passed on to generate().
+
+        Returns:
+            The generated program, or None if the seed was already tested, or
+            generation, the UB check or the bitcode compilation failed
+            (nothing is left on disk then)
+        """
+        source = Path(output_dir) / f"csmith_{seed}.c"
+        program = GeneratedProgram(seed, source)
+        if kwargs.pop('swarm', True):
+            # Fix the configuration up front: the program carries it for feedback
+            program.swarm = self.swarm_config(seed)
+            kwargs['custom_options'] = (self.swarm_flags(program.swarm) +
+                                        list(kwargs.get('custom_options') or []))
+        # The size controller picks the knobs; they are claimed before anything is written
+        knobs = self.size_controller.knobs() if self.size_controller is not None else {}
+        if not self._claim(seed, program.swarm, **{**kwargs, **knobs}):
+            return None
+        if self.size_controller is None:
+            generated = self.generate(str(source), seed, swarm=False, check_ub=False, **kwargs)
+        else:
+            generated = self._generate_in_band(source, seed, program.swarm, knobs, **kwargs)
+        if not generated:
+            program.remove()
+            return None
+        if not (check_ub or bitcode):
+            return program
+
+        # The UB check and the bitcode compile run concurrently, one front end each
+        artifacts = compile_artifacts(str(source), bitcode=bitcode, ubsan=check_ub,
+                                      clang_path=self.clang_path,
+                                      csmith_runtime=self.csmith_runtime)
+        if artifacts.bitcode:
+            program.bitcode = Path(artifacts.bitcode)
+        if not artifacts.ok or (check_ub and artifacts.ub_verdict != 0):
+            logging.warning(f"Rejected seed {seed}: "
+                            f"{artifacts.errors or f'UB check verdict {artifacts.ub_verdict}'}")
+            if self.swarm_selector is not None and program.swarm is not None:
+                self.swarm_selector.record(program.swarm, False)
+            program.remove()
+            return None
+        return program
+
+    def _generate_in_band(self, source: Path, seed: int, swarm: Optional[Dict[str, bool]],
+                          knobs: Dict[str, int], **kwargs) -> bool:
+        """Generate with the controller's knobs until the program's metrics are inside its band.
+
+        The first knobs are claimed by the caller; every retry claims its own.
+        """
+        from pafuzz.generators.sizing import measure
+
+        for attempt in range(self.size_controller.max_attempts):
+            if attempt:
+                knobs = self.size_controller.knobs()
+                # The knobs change the program, so the same seed can be reused
+                if not self._claim(seed, swarm, **{**kwargs, **knobs}):
+                    return False
+            if not self.generate(str(source), seed, swarm=False, check_ub=False, min_size=0,
+                                 **{**kwargs, **knobs}):
+                return False
+            if self.size_controller.update(measure(source.read_text())) == 0:
+                return True
+        logging.info(f"Rejected seed {seed}: no program inside the size band")
+        return False
+
+    def generate_batch(self, n: int, output_dir: str, seeds: Optional[Iterable[int]] = None,
+                       jobs: int = 1, check_ub: bool = False, bitcode: bool = False,
+                       **kwargs) -> List[GeneratedProgram]:
+        """Generate up to n programs into output_dir, running jobs generations concurrently.
+
+        Args:
+            n: Number of programs to attempt
+            output_dir: Directory for the generated files
+            seeds: Seeds to use (default: from the seed allocator, or random);
+                only the first n are used
+            jobs: Number of concurrent csmith/clang pipelines
+            check_ub: Drop programs with undefined behavior
+            bitcode: Also compile every program to LLVM bitcode
+            **kwargs: Passed on to generate()
+
+        Returns:
+            The successfully generated programs, in seed order. Failed seeds are
+            dropped, so the result may hold fewer than n programs.
+        """
+        if seeds is None and self.seed_allocator is not None:
+            seeds = [self.seed_allocator.next_seed() for _ in range(n)]
+        elif seeds is None:
+            rng = random.Random()
+            seeds = [rng.randint(1, MAX_SEED) for _ in range(n)]
+        else:
+            seeds = list(seeds)[:n]
+        os.makedirs(output_dir, exist_ok=True)
+
+        def one(seed: int) -> Optional[GeneratedProgram]:
+            return self.generate_program(output_dir, seed, check_ub, bitcode, **kwargs)
+
+        # Generation is dominated by the csmith/clang subprocesses, so threads suffice
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            programs = list(pool.map(one, seeds))
+        return [p for p in programs if p is not None]
+
+    def next_seed(self) -> int:
+        """A fresh seed: the next one of the seed allocator, or a random one."""
+        if self.seed_allocator is not None:
+            return self.seed_allocator.next_seed()
+        return random.randint(1, MAX_SEED)
+
     def _build_command(self, output_file: str, seed: int, functions: int,
                       swarm: bool, max_struct_fields: int, 
                       max_block_depth: int, max_array_dim: int,
@@ -131,13 +338,20 @@ class CsmithGenerator:
         
         return cmd
     
-    def _get_swarm_flags(self, seed: int) -> List[str]:
-        """Generate swarm testing flags based on seed."""
-        random.seed(seed)
-        
+    def swarm_config(self, seed: int) -> Dict[str, bool]:
+        """Choose the enabled swarm features for a seed.
+
+        Uses an RNG private to this call, so the global random state is left
+        alone. Without a swarm selector the configuration only depends on the
+        seed; with one, it also depends on the statistics gathered so far.
+        """
+        rng = random.Random(seed)
+        if self.swarm_selector is not None:
+            return self.swarm_selector.sample(rng)
+
         # Random enable/disable for each feature
         config_map = {
-            feature: random.choice([True, False]) 
+            feature: rng.choice([True, False]) 
             for feature in self.SWARM_FEATURES
         }
         
@@ -147,17 +361,22 @@ class CsmithGenerator:
         
         if enabled_count < min_enabled:
             disabled = [f for f, enabled in config_map.items() if not enabled]
-            to_enable = random.sample(disabled, min_enabled - enabled_count)
+            to_enable = rng.sample(disabled, min_enabled - enabled_count)
             for feature in to_enable:
                 config_map[feature] = True
-        
-        # Build flags
-        flags = []
-        for feature, enabled in config_map.items():
-            flags.append(f"--{feature}" if enabled else f"--no-{feature}")
-        
+        return config_map
+
+    @staticmethod
+    def swarm_flags(config_map: Dict[str, bool]) -> List[str]:
+        """Csmith flags of a swarm configuration."""
+        return [f"--{feature}" if enabled else f"--no-{feature}"
+                for feature, enabled in config_map.items()]
+
+    def _get_swarm_flags(self, seed: int) -> List[str]:
+        """Generate swarm testing flags based on seed."""
+        config_map = self.swarm_config(seed)
         logging.debug(f"Swarm config: {config_map}")
-        return flags
+        return self.swarm_flags(config_map)
     
 
 # Convenience functions for backward compatibility
@@ -0,0 +1,229 @@
+"""Function-pointer-dense generation profile for points-to and call-graph fuzzing.
+
+Csmith never emits function pointers, so a stock program gives the indirect
+call resolution of an analyzer nothing to do. make_fptr_dense() rewrites the
+direct calls of a csmith program (`func_N(...)`) into indirect calls through
+the patterns of instrument/test_indirect_calls.cpp:
+
+- function pointer arrays        fp_tab_0[1](...)
+- struct fields                  fp_box_3.f(...)
+- fields reached via a pointer   fp_boxp_3->f(...)
+- returned function pointers     fp_get_0(1)(...)
+- callbacks                      fp_call_0(func_3, ...)
+
+Functions with the same signature share a table, so every indirect call has
+several type-compatible candidate targets; signatures with a single function
+get a decoy that is never called. Only the helpers that a rewritten call uses
+are emitted, so the program gains no unused-function or unused-variable
+warnings. The rewritten call still calls the same function, so the program's
+behavior (and checksum) is unchanged.
+
+count_indirect_calls() is a cheap syntactic density estimate, used by
+FptrGenerator to reject programs before they are compiled and analyzed.
+"""
+
+import logging
+import random
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pafuzz.generators.csmith import CsmithGenerator
+
+# Default minimum number of indirect call sites of a FptrGenerator program
+MIN_INDIRECT_CALLS = 8
+
+_DECL = re.compile(r'^(?:static\s+)?(?P<ret>[A-Za-z_][^()=;]*?)\s*\b(?P<name>func_\d+)'
+                   r'\s*\((?P<params>[^()]*)\)\s*;\s*$')
+_CALL = re.compile(r'\b(func_\d+)\s*\(')
+_PARAM_NAME = re.compile(r'\s*\b[A-Za-z_]\w*\s*$')
+
+# Syntactic indirect calls: `x)(`, `x](`, `->f(` and `.f(`, minus casts like `(uint8_t)(x)`
+_PAREN_CALL = re.compile(r'[)\]]\s*\(')
+_TYPEDEF = re.compile(r'^typedef\b[^;]*;', re.MULTILINE)
+_MEMBER_CALL = re.compile(r'(?:->|\.)\s*[A-Za-z_]\w*\s*\(')
+# Calls through a make_fptr_dense trampoline: fp_call_N(func_M, ...) calls func_M via `cb(...)`
+_TRAMPOLINE_CALL = re.compile(r'\bfp_call_\d+\s*\(\s*func_\d+\b')
+_CAST = re.compile(r'^\s*(?:(?:const|volatile|signed|unsigned|struct|union)\s+)*'
+                   r'(?:[A-Za-z_]\w*_t|char|short|int|long|float|double|void|[SU]\d+)'
+                   r'(?:\s+(?:long|int))*\s*(?:\*\s*(?:const|volatile)?\s*)*$')
+
+Signature = Tuple[str, Tuple[str, ...]]
+
+
+def _param_types(params: str) -> Tuple[str, ...]:
+    params = params.strip()
+    if params in ('', 'void'):
+        return ()
+    return tuple(' '.join(_PARAM_NAME.sub('', p).split()) for p in params.split(','))
+
+
+def parse_functions(source: str) -> Dict[str, Signature]:
+    """Signatures (return type, parameter types) of the csmith functions, from their prototypes."""
+    functions = OrderedDict()
+    for line in source.splitlines():
+        match = _DECL.match(line)
+        if match:
+            functions[match.group('name')] = (' '.join(match.group('ret').split()),
+                                              _param_types(match.group('params')))
+    return functions
+
+
+def _is_cast(source: str, close: int) -> bool:
+    """True if the parenthesis closing at `close` encloses a type name."""
+    depth = 0
+    for i in range(close, -1, -1):
+        if source[i] == ')':
+            depth += 1
+        elif source[i] == '(':
+            depth -= 1
+            if depth == 0:
+                return bool(_CAST.match(source[i + 1:close]))
+    return False
+
+
+def count_indirect_calls(source: str) -> int:
+    """
+    Cheap syntactic count of the indirect call sites of a C program.
+
+    A call through a make_fptr_dense trampoline counts once per rewritten site,
+    like the other patterns, although its indirect call is the single `cb(...)`.
+    """
+    source = _TYPEDEF.sub('', source)  # `typedef int (*t)(int);` declares, it does not call
+    count = len(_MEMBER_CALL.findall(source)) + len(_TRAMPOLINE_CALL.findall(source))
+    for match in _PAREN_CALL.finditer(source):
+        if source[match.start()] == ']' or not _is_cast(source, match.start()):
+            count += 1
+    return count
+
+
+def make_fptr_dense(source: str, seed: int, ratio: float = 1.0) -> str:
+    """
+    Rewrite direct calls of a csmith program into indirect calls.
+
+    Args:
+        source: Csmith program
+        seed: Seed for the choice of call pattern per call site
+        ratio: Fraction of the call sites to rewrite
+
+    Returns:
+        The rewritten program (the input unchanged if it has no csmith functions)
+    """
+    rng = random.Random(seed)
+    functions = parse_functions(source)
+    groups: Dict[Signature, List[str]] = OrderedDict()
+    for name, signature in functions.items():
+        ret = signature[0]
+        if 'struct' in ret or 'union' in ret:
+            continue  # no sensible decoy return value
+        groups.setdefault(signature, []).append(name)
+    if not groups:
+        return source
+
+    group_of = {name: g for g, members in enumerate(groups.values()) for name in members}
+    index_of = {name: i for members in groups.values() for i, name in enumerate(members)}
+    used = set()  # helpers referenced by a rewritten call; only these are emitted
+
+    def rewrite(match: re.Match) -> str:
+        name = match.group(1)
+        if name not in group_of or rng.random() >= ratio:
+            return match.group(0)
+        g, index = group_of[name], index_of[name]
+        pattern = rng.randrange(5)
+        if pattern == 0:
+            used.add(f"fp_tab_{g}")
+            return f"fp_tab_{g}[{index}]("
+        if pattern in (1, 2):
+            used.add(f"fp_box_{name}")
+            if pattern == 1:
+                return f"fp_box_{name}.f("
+            used.add(f"fp_boxp_{name}")
+            return f"fp_boxp_{name}->f("
+        if pattern == 3:
+            used.add(f"fp_get_{g}")
+            return f"fp_get_{g}({index})("
+        used.add(f"fp_call_{g}")
+        has_args = bool(functions[name][1])
+        return f"fp_call_{g}({name}{', ' if has_args else ''}"
+
+    lines = source.splitlines(keepends=True)
+    insert_at = None
+    for i, line in enumerate(lines):
+        if _DECL.match(line):
+            insert_at = i + 1
+        elif line[:1].isspace():
+            # Only function bodies are indented; headers and declarations are not
+            lines[i] = _CALL.sub(rewrite, line)
+
+    decls = []
+    for g, ((ret, params), members) in enumerate(groups.items()):
+        boxed = [(i, name) for i, name in enumerate(members) if f"fp_box_{name}" in used]
+        tabled = {f"fp_tab_{g}", f"fp_get_{g}"} & used
+        if not tabled and not boxed and f"fp_call_{g}" not in used:
+            continue
+        typed = ', '.join(f"{t} a{i}" for i, t in enumerate(params)) or 'void'
+        args = ', '.join(f"a{i}" for i in range(len(params)))
+        proto = ', '.join(params) or 'void'
+        body = '' if ret.split()[-1] == 'void' and '*' not in ret else 'return 0;'
+        decls.append(f"typedef {ret} (*fpt_{g})({proto});")
+        if tabled:
+            if len(members) == 1:
+                members.append(f"fp_decoy_{g}")
+                decls.append(f"static {ret} fp_decoy_{g}({typed}) {{ {body} }}")
+            if f"fp_tab_{g}" in used:
+                decls.append(f"static fpt_{g} fp_tab_{g}[{len(members)}] = "
+                             f"{{{', '.join(members)}}};")
+            if f"fp_get_{g}" in used:
+                cases = ' '.join(f"case {i}: return {m};" for i, m in enumerate(members))
+                decls.append(f"static fpt_{g} fp_get_{g}(int i) "
+                             f"{{ switch (i) {{ {cases} }} return {members[-1]}; }}")
+        if f"fp_call_{g}" in used:
+            decls.append(f"static {ret} fp_call_{g}(fpt_{g} cb{', ' + typed if params else ''}) "
+                         f"{{ {'return ' if body else ''}cb({args}); }}")
+        if boxed:
+            decls.append(f"struct fp_box_{g} {{ fpt_{g} f; int tag; }};")
+        for i, name in boxed:
+            decls.append(f"static struct fp_box_{g} fp_box_{name} = {{{name}, {i}}};")
+            if f"fp_boxp_{name}" in used:
+                decls.append(f"static struct fp_box_{g} *fp_boxp_{name} = &fp_box_{name};")
+    if not decls:
+        return source
+
+    table = "\n/* --- FUNCTION POINTERS (fptr profile) --- */\n" + "\n".join(decls) + "\n\n"
+    lines.insert(insert_at, table)
+    return ''.join(lines)
+
+
+class FptrGenerator(CsmithGenerator):
+    """Csmith generator whose programs call their functions through function pointers."""
+
+    PROFILE = 'fptr'
+
+    def __init__(self, *args, min_indirect_calls: int = MIN_INDIRECT_CALLS, ratio: float = 1.0,
+                 **kwargs):
+        """
+        Args:
+            min_indirect_calls: Reject programs with fewer indirect call sites
+            ratio: Fraction of the direct calls to rewrite
+            Other arguments as for CsmithGenerator
+        """
+        super().__init__(*args, **kwargs)
+        self.min_indirect_calls = min_indirect_calls
+        self.ratio = ratio
+
+    def claim_config(self, swarm: Optional[Dict[str, bool]], **options) -> Dict[str, Any]:
+        """The csmith configuration, plus the share of rewritten calls."""
+        return {**super().claim_config(swarm, **options), 'ratio': self.ratio}
+
+    def _postprocess(self, output_file: str, seed: int) -> bool:
+        """Make the program function-pointer dense and filter it by density."""
+        with open(output_file) as f:
+            source = make_fptr_dense(f.read(), seed, self.ratio)
+        indirect_calls = count_indirect_calls(source)
+        if indirect_calls < self.min_indirect_calls:
+            logging.info(f"Rejected seed {seed}: "
+                         f"{indirect_calls} indirect calls < {self.min_indirect_calls}")
+            return False
+        with open(output_file, 'w') as f:
+            f.write(source)
+        return True
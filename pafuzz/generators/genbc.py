@@ -1,11 +1,22 @@
 """LLVM bitcode generation utilities."""
 
+import hashlib
 import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
 from pafuzz.generators.config import config
-from pafuzz.generators.utils import run_cmd
+from pafuzz.generators.pch import compiler_hash, pch_flags
+from pafuzz.generators.utils import UB_CHECK_FLAGS, get_ub_cache, run_cmd, run_until_ub
+
+BITCODE_FLAGS = ["-g"]
+CXX_BITCODE_FLAGS = ["-g", "-std=c++17"]
+CXX_SUFFIXES = ('.cpp', '.cc', '.cxx')
 
 
 def generate_llvm_bitcode(c_file: str, bc_file: str, 
@@ -38,6 +49,7 @@ def generate_llvm_bitcode(c_file: str, bc_file: str,
         cmd = [
             clang,
             "-emit-llvm", "-g",
+            *pch_flags(clang, runtime, ["-g"]),
             "-I", runtime,
             "-o", bc_file,
             "-c", c_file
@@ -54,4 +66,256 @@ def generate_llvm_bitcode(c_file: str, bc_file: str,
 
     except Exception as e:
         logging.error(f"Error generating bitcode: {str(e)}")
-        return False 
\ No newline at end of file
+        return False
+
+
+@dataclass
+class CompileArtifacts:
+    """Everything compile_artifacts() or compile_project() built from one program."""
+    source: str
+    bitcode: Optional[str] = None
+    optimized_bitcode: Optional[str] = None
+    ubsan_exe: Optional[str] = None
+    ub_verdict: Optional[int] = None  # see check_undefined_behavior
+    timings: Dict[str, float] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    exit_codes: Dict[str, int] = field(default_factory=dict)  # 124: the step timed out
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def remove(self):
+        """Delete the built files (not the source)."""
+        for path in (self.bitcode, self.optimized_bitcode, self.ubsan_exe):
+            if path:
+                Path(path).unlink(missing_ok=True)
+
+
+def run_step(artifacts: CompileArtifacts, step: str, cmd: List[str], timeout: float) -> bool:
+    """
+    Run one build step, recording its time in artifacts.timings[step].
+
+    Returns:
+        bool: True if the step succeeded; otherwise its error is in artifacts.errors[step]
+    """
+    start = time.perf_counter()
+    ret_code, _, stderr = run_cmd(cmd, timeout)
+    artifacts.timings[step] = time.perf_counter() - start
+    artifacts.exit_codes[step] = ret_code
+    if ret_code != 0:
+        artifacts.errors[step] = stderr or f"exit code {ret_code}"
+        return False
+    return True
+
+
+def pass_plugin_flags(pass_path: Optional[str]) -> List[str]:
+    """
+    clang flags that run a new pass manager plugin, such as the trace_icall pass.
+
+    The plugin runs after clang's optimization pipeline, at -O0 too, so the
+    bitcode or executable clang writes is already instrumented.
+    """
+    return [f"-fpass-plugin={os.path.abspath(pass_path)}"] if pass_path else []
+
+
+def instrument_command(opt: str, pass_path: str, bc_file: str, out_file: str) -> List[str]:
+    """opt invocation that runs the trace_icall pass plugin on bitcode that was already built."""
+    return [opt, f"-load-pass-plugin={os.path.abspath(pass_path)}",
+            "-passes=afl-indirect-call-tracker", bc_file, "-o", out_file]
+
+
+def compile_artifacts(c_file: str, out_dir: Optional[str] = None, bitcode: bool = True,
+                      optimize: Optional[str] = None, ubsan: bool = False, keep_exe: bool = False,
+                      clang_path: Optional[str] = None, csmith_runtime: Optional[str] = None,
+                      opt_path: Optional[str] = None,
+                      trace_pass: Optional[str] = None) -> CompileArtifacts:
+    """
+    Build all artifacts needed for one program with one front-end run per flag family.
+
+    UBSan checks are inserted by the clang front end, so the sanitizer build
+    cannot be derived from the plain bitcode: the two families are compiled
+    concurrently, and the optimized bitcode is derived from the plain one with
+    opt instead of parsing the source again. The UBSan executable is run right
+    away (verdict in ub_verdict); if the verdict cache already knows the source,
+    the UBSan family is not compiled at all.
+
+    Args:
+        c_file: Input C source file
+        out_dir: Directory for the artifacts (default: next to c_file)
+        bitcode: Build <name>.bc (-emit-llvm -g)
+        optimize: Also derive <name>.opt.bc with opt at this level (e.g. "-O2")
+        ubsan: Build the UBSan executable and check the program for undefined behavior
+        keep_exe: Keep the UBSan executable (<name>.ubsan) after the check
+        clang_path: Path to clang compiler (uses config default if None)
+        csmith_runtime: Path to csmith runtime (uses config default if None)
+        opt_path: Path to opt (uses config default if None)
+        trace_pass: trace_icall pass plugin that clang runs on the bitcode (see pass_plugin_flags)
+
+    Returns:
+        The artifacts that were built, their timings in seconds per step
+        ("bitcode", "optimize", "ubsan", "ub_run", "total") and the errors
+        of the steps that failed
+    """
+    clang = clang_path or config.CLANG
+    runtime = csmith_runtime or config.CSMITH_HOME
+    opt = opt_path or config.get('OPT', 'opt')
+    stem = os.path.join(out_dir or os.path.dirname(c_file) or '.', Path(c_file).stem)
+    artifacts = CompileArtifacts(c_file)
+    start = time.perf_counter()
+
+    def build_bitcode():
+        # clang marks -O0 functions optnone, which would make opt a no-op
+        flags = BITCODE_FLAGS + (["-Xclang", "-disable-O0-optnone"] if optimize else [])
+        bc_file = f"{stem}.bc"
+        cmd = [clang, "-emit-llvm", "-c", *flags, *pch_flags(clang, runtime, flags),
+               *pass_plugin_flags(trace_pass), f"-I{runtime}", c_file, "-o", bc_file]
+        if not run_step(artifacts, "bitcode", cmd, config.COMPILE_TIMEOUT):
+            return
+        artifacts.bitcode = bc_file
+        if optimize:
+            opt_file = f"{stem}.opt.bc"
+            if run_step(artifacts, "optimize", [opt, optimize, bc_file, "-o", opt_file],
+                      config.COMPILE_TIMEOUT):
+                artifacts.optimized_bitcode = opt_file
+
+    def build_ubsan():
+        flags = UB_CHECK_FLAGS + [f"-I{runtime}"]
+        cache = get_ub_cache()
+        with open(c_file, 'rb') as f:
+            key = cache.key(f.read(), clang, flags)
+        artifacts.ub_verdict = cache.get(key)
+        if artifacts.ub_verdict is not None:
+            return
+        exe = f"{stem}.ubsan"
+        cmd = [clang, *flags, *pch_flags(clang, runtime, UB_CHECK_FLAGS), c_file, "-o", exe]
+        if not run_step(artifacts, "ubsan", cmd, config.SAN_COMPILE_TIMEOUT):
+            # Like check_undefined_behavior: a timeout depends on the load, so it is not cached
+            if artifacts.exit_codes["ubsan"] == 124:
+                artifacts.ub_verdict = 3
+                return
+            artifacts.ub_verdict = 2
+            cache.put(key, 2)
+            return
+        run_start = time.perf_counter()
+        artifacts.ub_verdict = run_until_ub(exe, config.RUN_TIMEOUT)
+        artifacts.timings["ub_run"] = time.perf_counter() - run_start
+        if artifacts.ub_verdict != 3:
+            cache.put(key, artifacts.ub_verdict)
+        if keep_exe:
+            artifacts.ubsan_exe = exe
+        else:
+            Path(exe).unlink(missing_ok=True)
+
+    steps = [step for step, wanted in ((build_bitcode, bitcode), (build_ubsan, ubsan)) if wanted]
+    if len(steps) > 1:
+        with ThreadPoolExecutor(max_workers=len(steps)) as pool:
+            for future in [pool.submit(step) for step in steps]:
+                future.result()
+    elif steps:
+        steps[0]()
+
+    artifacts.timings["total"] = time.perf_counter() - start
+    return artifacts
+
+
+def _tu_cache_key(tu: str, headers: bytes, compiler: str, flags: List[str]) -> str:
+    digest = hashlib.sha256()
+    with open(tu, 'rb') as f:
+        digest.update(f.read())
+    digest.update(b'\0' + headers + b'\0' + compiler.encode() + b'\0' + '\0'.join(flags).encode())
+    return digest.hexdigest()
+
+
+def compile_project(src_dir: str, bc_file: Optional[str] = None, flags: Optional[List[str]] = None,
+                    clang_path: Optional[str] = None, llvm_link_path: Optional[str] = None,
+                    cache_dir: Optional[str] = None, jobs: int = 0,
+                    trace_pass: Optional[str] = None,
+                    opt_path: Optional[str] = None) -> CompileArtifacts:
+    """
+    Compile a multi-file C++ program (a YARPGen output directory) into one bitcode module.
+
+    Every translation unit is compiled to bitcode concurrently, and the results
+    are linked with llvm-link. Translation unit bitcode is cached in cache_dir,
+    keyed by the unit, the headers next to it, the compiler and the flags, so
+    regenerating a seed with the same flags only pays for the link.
+
+    Args:
+        src_dir: Directory with the .cpp translation units and their headers
+        bc_file: Linked module (default: <src_dir>.bc)
+        flags: Compiler flags (default: CXX_BITCODE_FLAGS)
+        clang_path: Path to clang++ (uses config default if None)
+        llvm_link_path: Path to llvm-link (uses config default if None)
+        cache_dir: Translation unit cache (default: config BC_CACHE_DIR, "" disables it)
+        jobs: Concurrent compiles (default: one per translation unit)
+        trace_pass: Instrument the linked module with this trace_icall pass plugin;
+            it runs once on the whole program, since call site IDs are per module
+        opt_path: Path to opt, which runs trace_pass (uses config default if None)
+
+    Returns:
+        The artifacts, with the linked module in bitcode, timings in seconds
+        per step ("bitcode:<unit>" for the units that were compiled, "link",
+        "instrument", "total") and the errors of the steps that failed
+    """
+    clang = clang_path or config.get('CLANGXX', 'clang++')
+    llvm_link = llvm_link_path or config.get('LLVM_LINK', 'llvm-link')
+    flags = list(CXX_BITCODE_FLAGS if flags is None else flags)
+    cache_dir = config.get('BC_CACHE_DIR', '') if cache_dir is None else cache_dir
+    src = Path(src_dir)
+    bc_file = bc_file or f"{src}.bc"
+    tus = sorted(str(p) for p in src.iterdir() if p.suffix in CXX_SUFFIXES)
+    artifacts = CompileArtifacts(str(src))
+    start = time.perf_counter()
+    if not tus:
+        artifacts.errors["bitcode"] = f"no translation units in {src}"
+        return artifacts
+    headers = b''.join(p.name.encode() + b'\0' + p.read_bytes()
+                       for p in sorted(src.iterdir()) if p.suffix in ('.h', '.hpp'))
+    compiler = ''
+    if cache_dir:
+        try:
+            compiler = compiler_hash(clang)
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as e:
+            logging.warning(f"Bitcode cache disabled: {e}")
+            cache_dir = ''
+
+    def build(tu: str) -> Optional[str]:
+        tu_bc = os.path.join(str(src), Path(tu).stem + '.bc')
+        cached = None
+        if cache_dir:
+            cached = os.path.join(cache_dir, _tu_cache_key(tu, headers, compiler, flags) + '.bc')
+        if cached and os.path.exists(cached):
+            return cached
+        cmd = [clang, "-emit-llvm", "-c", *flags, f"-I{src}", tu, "-o", tu_bc]
+        if not run_step(artifacts, f"bitcode:{Path(tu).name}", cmd, config.COMPILE_TIMEOUT):
+            return None
+        if cached:
+            # Copy then rename, so that concurrent campaigns never see a partial file
+            tmp = f"{cached}.tmp{os.getpid()}.{Path(tu).stem}"
+            shutil.copyfile(tu_bc, tmp)
+            os.replace(tmp, cached)
+        return tu_bc
+
+    with ThreadPoolExecutor(max_workers=jobs or len(tus)) as pool:
+        unit_bcs = list(pool.map(build, tus))
+
+    if all(unit_bcs):
+        if run_step(artifacts, "link", [llvm_link, *unit_bcs, "-o", bc_file],
+                    config.COMPILE_TIMEOUT):
+            artifacts.bitcode = bc_file
+        if artifacts.bitcode and trace_pass:
+            opt = opt_path or config.get('OPT', 'opt')
+            traced_bc = f"{bc_file}.traced"
+            instrument = instrument_command(opt, trace_pass, bc_file, traced_bc)
+            if run_step(artifacts, "instrument", instrument, config.COMPILE_TIMEOUT):
+                os.replace(traced_bc, bc_file)
+            else:
+                artifacts.bitcode = None
+                for path in (bc_file, traced_bc):
+                    Path(path).unlink(missing_ok=True)
+    for unit_bc in unit_bcs:
+        if unit_bc and os.path.dirname(unit_bc) == str(src):
+            Path(unit_bc).unlink(missing_ok=True)
+    artifacts.timings["total"] = time.perf_counter() - start
+    return artifacts
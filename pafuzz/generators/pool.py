@@ -0,0 +1,175 @@
+"""Background producer pool that keeps a bounded queue of ready-to-analyze programs."""
+
+import logging
+import queue
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+from pafuzz.generators.csmith import MAX_SEED, CsmithGenerator, GeneratedProgram
+
+
+class ProgramPool:
+    """Pre-generate programs in the background so that analyzers never wait for csmith.
+
+    Producer threads generate, UB-check and compile programs into output_dir and
+    put them in a queue holding at most `capacity` programs. When the consumers
+    fall behind and the queue is full, the producers block until a program is
+    taken, so at most capacity + jobs programs exist on disk at any time.
+
+    Example:
+        with ProgramPool(CsmithGenerator(), "/tmp/pool", capacity=32, jobs=4) as pool:
+            for program in pool:
+                analyze(program.bitcode)
+                program.remove()
+    """
+
+    def __init__(self, generator: CsmithGenerator, output_dir: str, capacity: int = 16,
+                 jobs: int = 1, seeds: Optional[Iterable[int]] = None,
+                 check_ub: bool = True, bitcode: bool = True, **kwargs):
+        """
+        Args:
+            generator: Generator used by the producers
+            output_dir: Directory for the generated files
+            capacity: Maximum number of ready programs kept in the queue
+            jobs: Number of producer threads
+            seeds: Seeds to generate from; the pool is exhausted after the last
+                one (default: endless seeds from the generator's seed
+                allocator, or random ones)
+            check_ub: Drop programs with undefined behavior
+            bitcode: Also compile every program to LLVM bitcode
+            **kwargs: Passed on to CsmithGenerator.generate()
+        """
+        self.generator = generator
+        self.output_dir = Path(output_dir)
+        self.jobs = max(jobs, 1)
+        self.check_ub = check_ub
+        self.bitcode = bitcode
+        self.kwargs = kwargs
+
+        self._queue: "queue.Queue[GeneratedProgram]" = queue.Queue(maxsize=max(capacity, 1))
+        if seeds is not None:
+            self._seeds = iter(seeds)
+        elif generator.seed_allocator is not None:
+            self._seeds = iter(generator.seed_allocator)
+        else:
+            self._seeds = self._random_seeds()
+        self._seed_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._running = 0
+
+        # Statistics
+        self.produced = 0
+        self.rejected = 0
+        self.consumer_wait = 0.0  # seconds consumers spent waiting for a program
+        self.producer_wait = 0.0  # seconds producers spent blocked on a full queue
+
+    @staticmethod
+    def _random_seeds() -> Iterator[int]:
+        rng = random.Random()
+        while True:
+            yield rng.randint(1, MAX_SEED)
+
+    def _next_seed(self) -> Optional[int]:
+        with self._seed_lock:
+            return next(self._seeds, None)
+
+    def _produce(self):
+        try:
+            while not self._stop.is_set():
+                seed = self._next_seed()
+                if seed is None:
+                    break
+                program = self.generator.generate_program(str(self.output_dir), seed, self.check_ub,
+                                                          self.bitcode, **self.kwargs)
+                with self._seed_lock:
+                    if program is None:
+                        self.rejected += 1
+                        continue
+                    self.produced += 1
+
+                start = time.time()
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put(program, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                else:
+                    program.remove()
+                with self._seed_lock:
+                    self.producer_wait += time.time() - start
+        except Exception as e:
+            logging.error(f"Program pool producer failed: {e}")
+        finally:
+            with self._seed_lock:
+                self._running -= 1
+
+    def start(self) -> 'ProgramPool':
+        """Start the producer threads."""
+        if self._threads:
+            return self
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._running = self.jobs
+        for i in range(self.jobs):
+            thread = threading.Thread(target=self._produce, name=f"program-pool-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    @property
+    def ready(self) -> int:
+        """Number of programs that can be taken without waiting."""
+        return self._queue.qsize()
+
+    @property
+    def exhausted(self) -> bool:
+        """True if all producers have stopped and every program was taken."""
+        return self._running == 0 and self._queue.empty()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[GeneratedProgram]:
+        """Take the next ready program.
+
+        Returns:
+            The program (the caller owns its files and should remove() them), or
+            None if the timeout expired or the pool is exhausted
+        """
+        start = time.time()
+        try:
+            while True:
+                try:
+                    return self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self.exhausted or self._stop.is_set():
+                        return None
+                    if timeout is not None and time.time() - start >= timeout:
+                        return None
+        finally:
+            self.consumer_wait += time.time() - start
+
+    def __iter__(self) -> Iterator[GeneratedProgram]:
+        while True:
+            program = self.get()
+            if program is None:
+                return
+            yield program
+
+    def close(self):
+        """Stop the producers and delete the programs nobody took."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        while True:
+            try:
+                self._queue.get_nowait().remove()
+            except queue.Empty:
+                break
+
+    def __enter__(self) -> 'ProgramPool':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,185 @@
+"""Deterministic seed allocation for distributed generation.
+
+Random seeds from a small range collide quickly once many workers on many
+nodes generate at the same time, and every collision regenerates and
+re-analyzes a program that was already tested. A SeedAllocator hands out
+seeds from a slice of the seed space that belongs to one (node, worker) pair.
+Generators take seeds up to MAX_SEED (31 bits), so by default a seed is
+
+    | node id (6 bits) | worker id (6 bits) | counter (19 bits) |
+
+so workers never overlap, and the counter resumes where the log left off.
+Deployments with more nodes or workers trade counter bits for id bits.
+
+Every tested (seed, configuration) pair is appended to a binary log of
+16-byte records (seed, configuration hash), which several processes can
+share; claim() holds an exclusive flock on the log while it reads the records
+of the other processes and appends its own. It refuses pairs that are already
+in the log, so explicitly given seeds (replays, seed directories, restarted
+campaigns) are not tested twice with the same configuration. Refused claims are logged too, so
+campaign_stats() can report the duplicate rate of a whole campaign.
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import threading
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+_RECORD = struct.Struct('<QQ')
+_SEED_BITS = 31
+# Csmith seeds are unsigned longs; stay in 31 bits so they are portable between hosts
+MAX_SEED = 2**_SEED_BITS - 1
+
+
+def config_hash(config: Optional[Dict[str, Any]]) -> int:
+    """64-bit hash of a generator configuration (0 for no configuration)."""
+    if not config:
+        return 0
+    digest = hashlib.blake2b(json.dumps(config, sort_keys=True).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def read_log(path: str, offset: int = 0) -> Tuple[list, int]:
+    """Records of a seed log from byte offset on, and the offset after the last whole record."""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    end = len(data) - len(data) % _RECORD.size
+    return list(_RECORD.iter_unpack(data[:end])), offset + end
+
+
+def campaign_stats(path: str) -> Dict[str, float]:
+    """Claims, unique (seed, configuration) pairs and duplicate rate of a seed log."""
+    records, _ = read_log(path)
+    unique = len(set(records))
+    return {
+        'claims': len(records),
+        'unique': unique,
+        'duplicates': len(records) - unique,
+        'duplicate_rate': (len(records) - unique) / len(records) if records else 0.0,
+    }
+
+
+class SeedAllocator:
+    """Hand out disjoint seeds per (node, worker) and skip tested (seed, configuration) pairs."""
+
+    def __init__(self, node_id: int = 0, worker_id: int = 0, log_path: Optional[str] = None,
+                 node_bits: int = 6, worker_bits: int = 6):
+        """
+        Args:
+            node_id: Id of this machine, below 2**node_bits
+            worker_id: Id of this worker on the machine, below 2**worker_bits
+            log_path: Append-only log of tested pairs, shared by the campaign (None: in memory only)
+            node_bits, worker_bits: Width of the ids in a seed; the rest of MAX_SEED's
+                31 bits (at least 16) is the counter
+        """
+        counter_bits = _SEED_BITS - node_bits - worker_bits
+        if counter_bits < 16:
+            raise ValueError(f"Only {counter_bits} counter bits left in a seed")
+        if not 0 <= node_id < 2**node_bits or not 0 <= worker_id < 2**worker_bits:
+            raise ValueError(f"Node id {node_id} or worker id {worker_id} out of range")
+        self.node_id = node_id
+        self.worker_id = worker_id
+        self.log_path = log_path
+        self._prefix = ((node_id << worker_bits) | worker_id) << counter_bits
+        self._counter_mask = 2**counter_bits - 1
+        self._counter = 0
+        self._tested: Set[Tuple[int, int]] = set()
+        self._offset = 0
+        self._fd = None
+        self._lock = threading.Lock()
+
+        # Statistics of this allocator
+        self.claims = 0
+        self.duplicates = 0
+
+        if log_path:
+            self._fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._refresh()
+
+    def _refresh(self):
+        """Pick up the pairs appended to the log since the last refresh (by any process)."""
+        records, self._offset = read_log(self.log_path, self._offset)
+        for seed, digest in records:
+            self._tested.add((seed, digest))
+            if seed & ~self._counter_mask == self._prefix:
+                self._counter = max(self._counter, seed & self._counter_mask)
+
+    def next_seed(self) -> int:
+        """The next unused seed of this worker's slice."""
+        with self._lock:
+            if self._counter >= self._counter_mask:
+                raise RuntimeError(f"Seed slice of node {self.node_id} worker {self.worker_id} "
+                                   "is exhausted")
+            self._counter += 1
+            seed = self._prefix | self._counter
+            assert 0 < seed <= MAX_SEED, seed
+            return seed
+
+    def __iter__(self) -> Iterator[int]:
+        while True:
+            yield self.next_seed()
+
+    def claim(self, seed: int, config: Optional[Dict[str, Any]] = None) -> bool:
+        """Record that seed is about to be tested with config.
+
+        Returns:
+            False if the pair was tested before (the caller should skip it)
+        """
+        record = (seed, config_hash(config))
+        with self._lock:
+            if self._fd is not None:
+                # Other processes append to the log too: hold its lock from the refresh to
+                # the write, so no two of them can both find a pair new and claim it
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                    # The next refresh reads this record back along with those of other writers
+                    os.write(self._fd, _RECORD.pack(*record))
+                finally:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self.claims += 1
+            if record in self._tested:
+                self.duplicates += 1
+                return False
+            self._tested.add(record)
+            return True
+
+    @property
+    def duplicate_rate(self) -> float:
+        """Fraction of the claims of this allocator that were duplicates."""
+        return self.duplicates / self.claims if self.claims else 0.0
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def __enter__(self) -> 'SeedAllocator':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the duplicate rate of a seed log")
+    parser.add_argument('logs', nargs='+', help='Seed logs, one per campaign')
+    args = parser.parse_args()
+
+    for path in args.logs:
+        stats = campaign_stats(path)
+        print(f"{path}: {stats['claims']} claims, {stats['unique']} unique, "
+                     f"{stats['duplicates']} duplicates ({stats['duplicate_rate']:.2%})")
+
+
+if __name__ == '__main__':
+    main()
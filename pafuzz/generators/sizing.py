@@ -0,0 +1,130 @@
+"""Program size and complexity targeting.
+
+Analyzer run time grows steeply with program size: tiny programs waste a UB
+check and a round of analyzer runs on nothing, huge ones run into the
+analyzer timeout. A SizeBand describes the programs worth analyzing in terms
+of metrics that are cheap to take right after generation (bytes, lines,
+functions, syntactic indirect calls, pointer depth). The SizeController keeps
+the csmith knobs (--max-funcs, --max-block-depth, --max-struct-fields) where
+programs land inside the band: it grows them after programs that were too
+small and shrinks them after programs that were too large, and
+CsmithGenerator.generate_program() regenerates out-of-band programs with the
+adjusted knobs before anything is compiled.
+"""
+
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from pafuzz.generators.config import config
+from pafuzz.generators.fptr import count_indirect_calls
+
+_FUNCTION_DEF = re.compile(r'^(?:static\s+)?[A-Za-z_][^;()=]*\bfunc_\d+\s*\([^;]*$', re.MULTILINE)
+_COMMENT = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+_POINTER_RUN = re.compile(r'\*(?:\s*(?:const|volatile)?\s*\*)*')
+
+TOO_SMALL, TOO_LARGE = -1, 1
+
+
+@dataclass
+class ProgramMetrics:
+    """Cheap static metrics of a generated program."""
+    bytes: int
+    loc: int
+    functions: int
+    indirect_calls: int
+    pointer_depth: int
+
+
+def measure(source: str) -> ProgramMetrics:
+    """Take the metrics of a C program without compiling it."""
+    code = _COMMENT.sub('', source)
+    return ProgramMetrics(
+        bytes=len(source.encode('utf-8')),
+        loc=sum(1 for line in source.splitlines() if line.strip()),
+        functions=len(_FUNCTION_DEF.findall(source)),
+        indirect_calls=count_indirect_calls(code),
+        pointer_depth=max((run.group(0).count('*') for run in _POINTER_RUN.finditer(code)),
+                          default=0),
+    )
+
+
+@dataclass
+class SizeBand:
+    """Accepted range of every metric (None: unbounded)."""
+    min_bytes: Optional[int] = None  # default: MIN_PROGRAM_SIZE
+    max_bytes: Optional[int] = None
+    min_loc: Optional[int] = None
+    max_loc: Optional[int] = None
+    min_indirect_calls: Optional[int] = None
+    max_pointer_depth: Optional[int] = None
+
+    def __post_init__(self):
+        if self.min_bytes is None:
+            self.min_bytes = config.MIN_PROGRAM_SIZE
+
+    def classify(self, metrics: ProgramMetrics) -> int:
+        """0 if the program is inside the band, TOO_SMALL or TOO_LARGE otherwise."""
+        if self.min_bytes and metrics.bytes < self.min_bytes:
+            return TOO_SMALL
+        if self.min_loc is not None and metrics.loc < self.min_loc:
+            return TOO_SMALL
+        if self.max_bytes is not None and metrics.bytes > self.max_bytes:
+            return TOO_LARGE
+        if self.max_loc is not None and metrics.loc > self.max_loc:
+            return TOO_LARGE
+        if self.max_pointer_depth is not None and metrics.pointer_depth > self.max_pointer_depth:
+            return TOO_LARGE
+        # More code means more calls, so a lack of indirect calls is treated as too small
+        if self.min_indirect_calls is not None and metrics.indirect_calls < self.min_indirect_calls:
+            return TOO_SMALL
+        return 0
+
+
+class SizeController:
+    """Adjust csmith knobs so that generated programs land inside a SizeBand."""
+
+    # knob: (minimum, maximum)
+    LIMITS = {'functions': (1, 64), 'max_block_depth': (1, 10), 'max_struct_fields': (1, 20)}
+
+    def __init__(self, band: SizeBand, functions: int = 5, max_block_depth: int = 5,
+                 max_struct_fields: int = 6, max_attempts: int = 4):
+        """
+        Args:
+            band: Accepted program metrics
+            functions, max_block_depth, max_struct_fields: Initial knob values
+            max_attempts: Programs tried per seed before giving up on it
+        """
+        self.band = band
+        self.max_attempts = max_attempts
+        self._knobs = {'functions': functions, 'max_block_depth': max_block_depth,
+                       'max_struct_fields': max_struct_fields}
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = {TOO_SMALL: 0, TOO_LARGE: 0}
+
+    def knobs(self) -> Dict[str, int]:
+        """Current knob values, as keyword arguments of CsmithGenerator.generate()."""
+        with self._lock:
+            return dict(self._knobs)
+
+    def update(self, metrics: ProgramMetrics) -> int:
+        """Classify a generated program and adjust the knobs; returns the classification."""
+        verdict = self.band.classify(metrics)
+        with self._lock:
+            if verdict == 0:
+                self.accepted += 1
+                return verdict
+            self.rejected[verdict] += 1
+            functions = self._knobs['functions']
+            # Functions drive the size most; step them geometrically, the rest by one
+            self._set('functions',
+                      functions * 3 // 2 + 1 if verdict == TOO_SMALL else functions * 2 // 3)
+            for knob in ('max_block_depth', 'max_struct_fields'):
+                self._set(knob, self._knobs[knob] - verdict)
+        return verdict
+
+    def _set(self, knob: str, value: int):
+        low, high = self.LIMITS[knob]
+        self._knobs[knob] = max(low, min(high, value))
@@ -0,0 +1,112 @@
+"""Feedback-directed swarm testing for CsmithGenerator.
+
+Plain swarm testing enables every csmith feature by a coin flip. The
+SwarmSelector instead learns which features pay off: for every feature it
+keeps a Beta posterior of the probability that a program is "productive" (it
+found a new crash bucket, a new inconsistency, new indirect-call targets...)
+when the feature is enabled, and one for when it is disabled. A configuration
+is drawn by Thompson sampling: both posteriors of a feature are sampled and the
+feature is enabled if the enabled side wins. Features that do not matter keep
+flipping, so the configurations stay diverse.
+
+Statistics can be saved to a JSON file and are merged into it, so several
+fuzzing processes can share one file.
+"""
+
+import fcntl
+import json
+import os
+import random
+import threading
+from typing import Dict, List, Optional
+
+# Per feature: [productive when enabled, unproductive when enabled,
+#               productive when disabled, unproductive when disabled]
+Stats = Dict[str, List[int]]
+
+
+class SwarmSelector:
+    """Thompson-sampling bandit over csmith swarm features."""
+
+    def __init__(self, features: List[str], min_enabled: Optional[int] = None,
+                 state_file: Optional[str] = None):
+        """
+        Args:
+            features: Csmith features to choose from ("pointers" for --pointers/--no-pointers)
+            min_enabled: Minimum number of enabled features (default: a third of them)
+            state_file: JSON file to load the statistics from and save them to
+        """
+        self.features = list(features)
+        self.min_enabled = len(self.features) // 3 if min_enabled is None else min_enabled
+        self.state_file = state_file
+        self.stats: Stats = {feature: [0, 0, 0, 0] for feature in self.features}
+        self._unsaved: Stats = {feature: [0, 0, 0, 0] for feature in self.features}
+        self._lock = threading.Lock()
+        if state_file and os.path.exists(state_file):
+            self.load(state_file)
+
+    def sample(self, rng: random.Random) -> Dict[str, bool]:
+        """Draw a configuration (feature -> enabled) using rng only."""
+        with self._lock:
+            scores = {}
+            for feature in self.features:
+                on_good, on_bad, off_good, off_bad = self.stats[feature]
+                scores[feature] = (rng.betavariate(on_good + 1, on_bad + 1) -
+                                   rng.betavariate(off_good + 1, off_bad + 1))
+        config = {feature: score > 0 for feature, score in scores.items()}
+
+        # Keep the floor of plain swarm testing, enabling the most promising features first
+        missing = self.min_enabled - sum(config.values())
+        if missing > 0:
+            disabled = sorted((f for f, enabled in config.items() if not enabled),
+                              key=lambda f: -scores[f])
+            for feature in disabled[:missing]:
+                config[feature] = True
+        return config
+
+    def record(self, config: Dict[str, bool], productive: bool):
+        """Update the statistics with the outcome of a program generated with config."""
+        with self._lock:
+            for feature, enabled in config.items():
+                if feature not in self.stats:
+                    continue
+                idx = (0 if enabled else 2) + (0 if productive else 1)
+                self.stats[feature][idx] += 1
+                self._unsaved[feature][idx] += 1
+
+    def productivity(self) -> Dict[str, float]:
+        """Posterior mean gain in productivity of enabling each feature."""
+        with self._lock:
+            return {feature: ((on_good + 1) / (on_good + on_bad + 2)
+                              - (off_good + 1) / (off_good + off_bad + 2))
+                    for feature, (on_good, on_bad, off_good, off_bad) in self.stats.items()}
+
+    def load(self, path: str):
+        with open(path) as f:
+            saved = json.load(f)
+        with self._lock:
+            for feature, counts in saved.get('features', {}).items():
+                if feature in self.stats:
+                    self.stats[feature] = [int(c) for c in counts]
+
+    def save(self, path: Optional[str] = None):
+        """Merge the outcomes recorded since the last save into the statistics file."""
+        path = path or self.state_file
+        if not path:
+            return
+        with open(f"{path}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            saved: Stats = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    saved = json.load(f).get('features', {})
+            with self._lock:
+                for feature, delta in self._unsaved.items():
+                    counts = saved.setdefault(feature, [0, 0, 0, 0])
+                    saved[feature] = [c + d for c, d in zip(counts, delta)]
+                    self._unsaved[feature] = [0, 0, 0, 0]
+                    self.stats[feature] = list(saved[feature])
+            tmp = f"{path}.tmp{os.getpid()}"
+            with open(tmp, 'w') as f:
+                json.dump({'features': saved}, f, indent=1)
+            os.replace(tmp, path)
@@ -2,14 +2,19 @@
 This file contains utility functions for program generation.
 """
 
+import hashlib
 import subprocess
 import os
 import signal
 import shutil
 import logging
-from typing import Tuple, Optional, List, Union
-from pathlib import Path
+import tempfile
+import threading
+from typing import Dict, Tuple, Optional, List, Union
 from pafuzz.generators.config import config
+from pafuzz.generators.pch import compiler_hash, pch_flags
+
+UB_CHECK_FLAGS = ["-msse4.2", "-m64", "-O0", "-fsanitize=undefined"]
 
 
 def run_cmd(cmd: Union[str, List[str]], timeout: int, 
@@ -19,11 +24,13 @@ def run_cmd(cmd: Union[str, List[str]], timeout: int,
         cmd = [x for x in cmd.split() if x]
     
     try:
+        # Own process group, so that a timeout takes down the children as well
         process = subprocess.Popen(
             cmd, 
             stdout=subprocess.PIPE, 
             stderr=subprocess.PIPE,
-            cwd=work_dir
+            cwd=work_dir,
+            start_new_session=True
         )
         stdout, stderr = process.communicate(timeout=timeout)
         return (
@@ -32,29 +39,19 @@ def run_cmd(cmd: Union[str, List[str]], timeout: int,
             stderr.decode('utf-8', errors='ignore')
         )
     except subprocess.TimeoutExpired:
-        _kill_process_tree(process.pid)
+        kill_process_group(process)
+        process.communicate()
         return 124, '', 'Command timed out'
     except Exception as e:
         return -1, '', f'Command failed: {e}'
 
-def _kill_process_tree(pid: int):
-    """Kill a process and all its children."""
+
+def kill_process_group(process: subprocess.Popen):
+    """Kill a process started with start_new_session=True, together with its children."""
     try:
-        # Get child processes
-        result = subprocess.run(
-            ['ps', '-o', 'pid', '--ppid', str(pid), '--noheaders'],
-            capture_output=True, text=True
-        )
-        
-        # Kill children recursively
-        for child_pid in result.stdout.split():
-            if child_pid.strip():
-                _kill_process_tree(int(child_pid.strip()))
-        
-        # Kill parent
-        os.kill(pid, signal.SIGTERM)
-    except (ProcessLookupError, ValueError):
-        pass  # Process already dead or invalid PID
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
 
 def sanitize_check(src_file: str, include_path: str, tmp_dir: str) -> int:
     """
@@ -134,21 +131,126 @@ def _safe_remove(filepath: str):
     except OSError:
         pass
 
+def _compiler_id(compiler: str) -> str:
+    """
+    Identify a compiler binary by its content, like the PCH and bitcode caches, so that
+    verdicts are invalidated when it is replaced.
+    """
+    try:
+        return compiler_hash(compiler)
+    except OSError:
+        return compiler  # not found: the compile step reports it
+
+
+class UBVerdictCache:
+    """
+    Verdicts of check_undefined_behavior, keyed by (source hash, compiler, flags).
+
+    If a path is given, verdicts are also appended to that file (one "<key> <verdict>"
+    line each) and loaded from it, so they survive across runs and are shared by
+    all processes of a campaign.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.hits = 0
+        self._verdicts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        key, verdict = line.split()
+                        self._verdicts[key] = int(verdict)
+                    except ValueError:
+                        continue  # torn line of an interrupted writer
+
+    @staticmethod
+    def key(source: bytes, compiler: str, flags: List[str]) -> str:
+        digest = hashlib.sha256(source)
+        digest.update(b'\0' + _compiler_id(compiler).encode() + b'\0' + '\0'.join(flags).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[int]:
+        with self._lock:
+            verdict = self._verdicts.get(key)
+            if verdict is not None:
+                self.hits += 1
+            return verdict
+
+    def put(self, key: str, verdict: int):
+        with self._lock:
+            self._verdicts[key] = verdict
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(f"{key} {verdict}\n")
+
+    def __len__(self) -> int:
+        return len(self._verdicts)
+
+
+_ub_cache: Optional[UBVerdictCache] = None
+
+
+def get_ub_cache() -> UBVerdictCache:
+    """The verdict cache shared by all UB checks of this process (on disk if UB_CACHE is set)."""
+    global _ub_cache
+    if _ub_cache is None:
+        _ub_cache = UBVerdictCache(config.get('UB_CACHE') or None)
+    return _ub_cache
+
+
+def run_until_ub(exe: str, timeout: float) -> int:
+    """Run a UBSan-instrumented program; stop it at the first runtime error report."""
+    process = subprocess.Popen([exe], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, start_new_session=True)
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        kill_process_group(process)
+
+    timer = threading.Timer(timeout, expire)
+    timer.start()
+    try:
+        for line in process.stdout:
+            if b"runtime error" in line:
+                kill_process_group(process)
+                return 1
+        process.wait()
+    finally:
+        timer.cancel()
+        process.stdout.close()
+        process.wait()
+
+    if timed_out.is_set() or process.returncode != 0:
+        return 3
+    return 0
+
+
 def check_undefined_behavior(cfilename: str, clang_path: Optional[str] = None,
-                           csmith_runtime: Optional[str] = None) -> int:
+                           csmith_runtime: Optional[str] = None,
+                           cache: Optional[UBVerdictCache] = None, use_cache: bool = True) -> int:
     """
     Check whether the generated C program has undefined behavior.
+
+    The program is linked with UBSan and run with its output piped back; it is
+    killed as soon as UBSan reports the first runtime error. Verdicts are cached
+    by (source hash, compiler, flags), so a regenerated program is never checked
+    twice; timeouts are not cached since they depend on the machine load.
     
     Args:
         cfilename: Path to the C source file
         clang_path: Path to clang compiler (uses config default if None)
         csmith_runtime: Path to csmith runtime (uses config default if None)
+        cache: Verdict cache to use (default: the process-wide one, see get_ub_cache)
+        use_cache: Set to False to always compile and run the program
     
     Returns:
         0: No undefined behavior detected
         1: Runtime error detected
         2: Compilation error
-        3: Execution timeout
+        3: Execution timeout (or abnormal exit)
     """
     clang = clang_path or config.CLANG
     runtime = csmith_runtime or config.CSMITH_HOME
@@ -156,45 +258,37 @@ def check_undefined_behavior(cfilename: str, clang_path: Optional[str] = None,
     if not clang:
         logging.warning("Clang path not configured, skipping UB check")
         return 0
-        
-    exe = f"{cfilename}.exe-clang"
-    out = f"{cfilename}.out-clang"
-
-    # Compile with UBSan
-    compile_cmd = [
-        "timeout", "30s",
-        clang, "-msse4.2", "-m64",
-        f"-I{runtime}",
-        "-O0", "-fsanitize=undefined",
-        "-c", cfilename, "-o", exe
-    ]
 
-    try:
-        ret_code, stdout, stderr = run_cmd(compile_cmd, config.SAN_COMPILE_TIMEOUT)
+    flags = UB_CHECK_FLAGS + [f"-I{runtime}"]
+    key = None
+    if use_cache:
+        if cache is None:
+            cache = get_ub_cache()
+        with open(cfilename, 'rb') as f:
+            key = cache.key(f.read(), clang, flags)
+        verdict = cache.get(key)
+        if verdict is not None:
+            return verdict
+
+    with tempfile.TemporaryDirectory(prefix="ubcheck-") as tmp_dir:
+        exe = os.path.join(tmp_dir, "a.out")
+        compile_cmd = ([clang] + flags + pch_flags(clang, runtime, UB_CHECK_FLAGS) +
+                       [cfilename, "-o", exe])
+        ret_code, _, stderr = run_cmd(compile_cmd, config.SAN_COMPILE_TIMEOUT)
+        if ret_code == 124:
+            logging.error("Compilation timed out during UB check")
+            return 3
         if ret_code != 0:
-            logging.error("Cannot compile program for UB check")
-            return 2
-
-        # Run the compiled program
-        run_cmd_list = ["timeout", "30s", f"./{exe}"]
-        with open(out, "w") as outf:
-            result = subprocess.run(run_cmd_list,
-                                    stdout=outf,
-                                    stderr=subprocess.DEVNULL)
-            if result.returncode != 0:
+            logging.error(f"Cannot compile program for UB check: {stderr}")
+            verdict = 2
+        else:
+            verdict = run_until_ub(exe, config.RUN_TIMEOUT)
+            if verdict == 1:
+                logging.error("Runtime error detected")
+            elif verdict == 3:
                 logging.error("Program execution timeout during UB check")
                 return 3
 
-        # Check for runtime errors
-        with open(out, "r") as outf:
-            if any("runtime error" in line for line in outf):
-                logging.error("Runtime error detected")
-                return 1
-
-        return 0
-
-    finally:
-        # Cleanup
-        for file in [exe, out]:
-            Path(file).unlink(missing_ok=True)
-    
+    if key is not None:
+        cache.put(key, verdict)
+    return verdict
@@ -3,16 +3,31 @@
 import os
 import random
 import logging
-from typing import Optional, List
+from pathlib import Path
+from typing import Any, Dict, Optional, List
 from pafuzz.generators.utils import run_cmd
 from pafuzz.generators.config import config
+from pafuzz.generators.csmith import GeneratedProgram
+from pafuzz.generators.genbc import compile_project
+from pafuzz.generators.seeds import MAX_SEED, SeedAllocator
 
 class YarpgenGenerator:
     """Generate C++ programs using YARPGen."""
     
-    def __init__(self, yarpgen_bin: Optional[str] = None):
-        """Initialize generator with optional custom path."""
+    def __init__(self, yarpgen_bin: Optional[str] = None,
+                 seed_allocator: Optional[SeedAllocator] = None,
+                 clang_path: Optional[str] = None):
+        """Initialize generator with optional custom path.
+
+        If a seed allocator is given, missing seeds are taken from its slice
+        of the seed space and (seed, options) pairs that were already tested
+        are skipped (see pafuzz.generators.seeds).
+        clang_path (clang++) is used by generate_program() to compile the
+        program to bitcode.
+        """
         self.yarpgen_bin = yarpgen_bin or config.YARPGEN
+        self.seed_allocator = seed_allocator
+        self.clang_path = clang_path or config.get('CLANGXX', 'clang++')
     
     def generate(self, output_dir: str, seed: Optional[int] = None,
                 std: str = "c++17", emit_pragmas: bool = True,
@@ -28,10 +43,18 @@ class YarpgenGenerator:
             max_depth: Maximum nesting depth
             
         Returns:
-            True if generation successful, False otherwise
+            True if generation successful, False otherwise (also if the seed
+            was drawn here and the seed allocator had it tested already)
         """
         if seed is None:
-            seed = random.randint(1, 100000)
+            if self.seed_allocator is not None:
+                seed = self.seed_allocator.next_seed()
+            else:
+                seed = random.randint(1, MAX_SEED)
+            # Explicit seeds are claimed by the caller (see generate_program)
+            if not self._claim(seed, std=std, emit_pragmas=emit_pragmas, emit_ub=emit_ub,
+                               max_depth=max_depth):
+                return False
         
         # Ensure output directory exists
         os.makedirs(output_dir, exist_ok=True)
@@ -51,7 +74,59 @@ class YarpgenGenerator:
         else:
             logging.error(f"Generation failed (code {ret_code}): {stderr}")
             return False
+
+    @staticmethod
+    def claim_config(std: str = "c++17", emit_pragmas: bool = True, emit_ub: bool = False,
+                     max_depth: int = 5) -> Dict[str, Any]:
+        """The configuration a seed is claimed with; takes the keyword arguments of generate()."""
+        return {'generator': 'yarpgen', 'std': std, 'emit_pragmas': emit_pragmas,
+                'emit_ub': emit_ub, 'max_depth': max_depth}
+
+    def _claim(self, seed: int, **options) -> bool:
+        """Claim seed with the options of a generate() call (True without a seed allocator)."""
+        if (self.seed_allocator is None or
+                self.seed_allocator.claim(seed, self.claim_config(**options))):
+            return True
+        logging.info(f"Skipped seed {seed}: already tested with these options")
+        return False
     
+    def generate_program(self, output_dir: str, seed: int, check_ub: bool = False,
+                         bitcode: bool = False, **kwargs) -> Optional[GeneratedProgram]:
+        """Generate <output_dir>/yarpgen_<seed>/, and its linked bitcode if requested.
+
+        Same interface as CsmithGenerator.generate_program(), so YARPGen
+        programs can be fed through a ProgramPool to the same analyzers. The
+        translation units are compiled concurrently and linked into
+        <output_dir>/yarpgen_<seed>.bc (see genbc.compile_project). YARPGen
+        programs are free of undefined behavior unless emit_ub is set, so
+        check_ub is ignored. Extra keyword arguments are passed on to generate().
+
+        Returns:
+            The generated program (source is its directory), or None if the
+            seed was already tested, or generation or compilation failed
+        """
+        # Claim before the program exists, so a refused seed leaves an earlier run's directory alone
+        if not self._claim(seed, **kwargs):
+            return None
+        source = Path(output_dir) / f"yarpgen_{seed}"
+        program = GeneratedProgram(seed, source)
+        if not self.generate(str(source), seed, **kwargs):
+            program.remove()
+            return None
+        if not bitcode:
+            return program
+
+        std = kwargs.get('std', 'c++17')
+        artifacts = compile_project(str(source), f"{source}.bc", flags=["-g", f"-std={std}"],
+                                    clang_path=self.clang_path)
+        if not artifacts.ok:
+            logging.warning(f"Rejected seed {seed}: {artifacts.errors}")
+            artifacts.remove()
+            program.remove()
+            return None
+        program.bitcode = Path(artifacts.bitcode)
+        return program
+
     def _build_command(self, output_dir: str, seed: int, std: str,
                       emit_pragmas: bool, emit_ub: bool, max_depth: int) -> List[str]:
         """Build the YARPGen command."""
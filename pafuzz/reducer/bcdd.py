@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+bcdd is a delta-debugger for LLVM bitcode, used for minimizing analyzer crashes saved by fuzz-pta.
+
+The input bitcode is disassembled once. Reduction then runs on IR entities instead of text lines:
+first whole top-level entities (function definitions, globals, declarations), then individual
+non-terminator instructions inside the remaining function bodies, repeating until neither pass
+removes anything. A candidate that drops a definition while keeping one of its uses is invalid
+and discarded right away. Every other candidate is re-assembled by piping it to llvm-as, so no
+textual IR ever touches the disk, and candidates that llvm-as rejects are discarded without
+running the analyzer.
+
+A candidate is interesting if the analyzer still crashes in the same crash bucket as the original
+input (see pafuzz.reducer.oracle.crash_signature). fuzz-pta stores that bucket next to every saved
+crash as "<name>.bc.sig"; it is picked up automatically. With --pta, a candidate is interesting
+if the given pointer analyses still disagree the way they do on the original input instead.
+
+Usage:
+$bcdd <crash.bc> <output.bc> /path/to/wpa -lander --print-pts
+$bcdd --pta "wpa -lander --print-pts" --pta "wpa -wander --print-pts" <diff.bc> <output.bc>
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from pafuzz.reducer.engine import DeltaReducer
+from pafuzz.reducer.oracle import CrashSignature, DiffPTAOracle, SignatureOracle, crash_signature
+
+TERMINATORS = {'ret', 'br', 'switch', 'indirectbr', 'invoke', 'resume', 'unreachable',
+               'callbr', 'cleanupret', 'catchret', 'catchswitch'}
+
+Units = List[List[int]]
+
+# "Unit" of the lines that belong to no unit and are never removed
+FIXED = -1
+
+_NAME = r'(?:[-\w$.]+|"[^"]*")'
+_GLOBAL_REF_RE = re.compile(r'@' + _NAME)
+_LOCAL_REF_RE = re.compile(r'%' + _NAME)
+_LOCAL_DEF_RE = re.compile(r'\s+(%' + _NAME + r') = ')
+_TYPE_DEF_RE = re.compile(r'(%' + _NAME + r') = type ')
+# Quoted names (kept), string literals and comments (dropped: what they contain is not a reference)
+_NOISE_RE = re.compile(r'[@%]"[^"]*"|c?"[^"]*"|;.*')
+
+
+def disassemble(bc_file: str, llvm_dis: str = 'llvm-dis', timeout: int = 60) -> str:
+    """Disassemble a bitcode file to textual IR."""
+    result = subprocess.run([llvm_dis, bc_file, '-o', '-'], capture_output=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"llvm-dis failed: {result.stderr.decode('utf-8', errors='ignore')}")
+    return result.stdout.decode('utf-8')
+
+
+class AssemblerPool:
+    """
+    Runs llvm-as on candidates, at most `jobs` at a time, and remembers the rejected ones.
+
+    This is not a pool of resident assemblers: llvm-as has no server mode, so every
+    candidate costs one exec, with the IR piped in. Candidates that break a def-use
+    dependency are filtered out before they get here (see unit_dependencies).
+    """
+
+    def __init__(self, llvm_as: str = 'llvm-as', jobs: int = 1, timeout: int = 60):
+        self.llvm_as = llvm_as
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(jobs, 1))
+        self._rejected: Set[bytes] = set()
+        self._lock = threading.Lock()
+
+    def assemble(self, text: bytes, bc_file: str) -> bool:
+        """Assemble textual IR into bc_file. Returns False if the IR is invalid."""
+        key = hashlib.sha1(text).digest()
+        with self._lock:
+            if key in self._rejected:
+                return False
+        with self._slots:
+            try:
+                result = subprocess.run([self.llvm_as, '-', '-o', bc_file], input=text,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                        timeout=self.timeout)
+                ok = result.returncode == 0
+            except subprocess.TimeoutExpired:
+                ok = False
+        if not ok:
+            with self._lock:
+                self._rejected.add(key)
+        return ok
+
+
+def _opcode(line: str) -> str:
+    body = line.strip()
+    if body.startswith('%') and ' = ' in body:
+        body = body.split(' = ', 1)[1]
+    for prefix in ('tail ', 'musttail ', 'notail '):
+        if body.startswith(prefix):
+            body = body[len(prefix):]
+    return body.split(' ', 1)[0]
+
+
+def split_top_level(lines: List[str], reduce_metadata: bool = False) -> Units:
+    """Group IR lines into removable top-level entities; one unit per function definition."""
+    units: Units = []
+    in_function = None
+    for i, line in enumerate(lines):
+        if in_function is not None:
+            in_function.append(i)
+            if line.startswith('}'):
+                units.append(in_function)
+                in_function = None
+            continue
+        if line.startswith('define '):
+            in_function = [i]
+            if line.rstrip().endswith('}'):
+                units.append(in_function)
+                in_function = None
+        elif line.startswith(('@', '%', '$', 'declare ', 'module asm')):
+            units.append([i])
+        elif line.startswith('!') and reduce_metadata:
+            units.append([i])
+    return units
+
+
+def split_instructions(lines: List[str]) -> Units:
+    """One unit per non-terminator instruction inside a function body."""
+    units: Units = []
+    in_function = False
+    in_terminator = False
+    for i, line in enumerate(lines):
+        if line.startswith('define '):
+            in_function = not line.rstrip().endswith('}')
+            continue
+        if not in_function:
+            continue
+        if line.startswith('}'):
+            in_function = False
+            continue
+        if in_terminator:
+            if line.strip().startswith(']'):
+                in_terminator = False
+            continue
+        if not line.startswith('  ') or not line.strip() or line.strip().startswith(';'):
+            continue  # labels, blank lines and comments
+        if _opcode(line) in TERMINATORS:
+            in_terminator = line.rstrip().endswith('[')
+            continue
+        units.append([i])
+    return units
+
+
+def function_regions(lines: List[str], units: Units) -> List[int]:
+    """Index of the function definition every unit belongs to (for the adaptive strategy)."""
+    function_of, current = {}, -1
+    for i, line in enumerate(lines):
+        if line.startswith('define '):
+            current += 1
+        function_of[i] = current
+    return [function_of[unit[0]] for unit in units]
+
+
+def _strip_noise(match: re.Match) -> str:
+    return match.group() if match.group()[0] in '@%' else ''
+
+
+def unit_dependencies(lines: List[str], units: Units) -> Dict[int, Set[int]]:
+    """
+    Map every unit that defines a global or an instruction result to the units that use it.
+
+    Users that belong to no unit are reported as FIXED. A candidate that drops a definition
+    but keeps one of its users is invalid IR (see breaks_dependency). Names that are also
+    type names are not tracked, so a dependency may be missed but never invented.
+    """
+    unit_of = {i: idx for idx, unit in enumerate(units) for i in unit}
+    stripped = [_NOISE_RE.sub(_strip_noise, line) for line in lines]
+    type_names = {m.group(1) for m in map(_TYPE_DEF_RE.match, stripped) if m}
+    definitions: Dict[Tuple[int, str], int] = {}
+    references: List[Tuple[int, Tuple[int, str]]] = []
+    function, in_body = -1, False
+    for i, line in enumerate(stripped):
+        if in_body:
+            if line.startswith('}'):
+                in_body = False
+                continue
+            local = _LOCAL_DEF_RE.match(line)
+            if local and local.group(1) not in type_names:
+                definitions[(function, local.group(1))] = i
+            references.extend((i, (function, name)) for name in _LOCAL_REF_RE.findall(line)
+                              if name not in type_names)
+        elif line.startswith(('@', 'define ', 'declare ')):
+            name = _GLOBAL_REF_RE.search(line)
+            if name:
+                definitions[(FIXED, name.group())] = i
+            if line.startswith('define ') and not line.rstrip().endswith('}'):
+                function, in_body = function + 1, True
+        references.extend((i, (FIXED, name)) for name in _GLOBAL_REF_RE.findall(line))
+
+    users: Dict[int, Set[int]] = {}
+    for i, key in references:
+        provider = unit_of.get(definitions.get(key, FIXED))
+        user = unit_of.get(i, FIXED)
+        if provider is not None and provider != user:
+            users.setdefault(provider, set()).add(user)
+    return users
+
+
+def breaks_dependency(users: Dict[int, Set[int]], enabled: bytearray) -> bool:
+    """True if the candidate drops a unit whose definition a kept unit still uses."""
+    return any(not enabled[provider] and any(user == FIXED or enabled[user] for user in unit_users)
+               for provider, unit_users in users.items())
+
+
+def render(lines: List[str], units: Units, enabled: bytearray) -> bytes:
+    """Materialize the candidate IR in which only the enabled units are kept."""
+    dropped = set()
+    for idx, unit in enumerate(units):
+        if not enabled[idx]:
+            dropped.update(unit)
+    return ''.join(line for i, line in enumerate(lines) if i not in dropped).encode('utf-8')
+
+
+def signature_of(command: List[str], bc_file: str, timeout: int = 600) -> Optional[str]:
+    """Run the analyzer to completion and return the crash bucket of its output."""
+    try:
+        result = subprocess.run(command + [bc_file], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+    return crash_signature(result.stdout.decode('utf-8', errors='ignore'))
+
+
+def reduce_bitcode(infile: str, outfile: str, command: List[str], signature: Optional[str] = None,
+                   jobs: int = 1, timeout: int = 600, reduce_metadata: bool = False,
+                   llvm_as: str = 'llvm-as', llvm_dis: str = 'llvm-dis',
+                   print_out: Callable[..., None] = print,
+                   pta_tools: Optional[List[str]] = None, strategy: str = 'ddmin',
+                   stats: Optional[dict] = None, loose: bool = False) -> Tuple[int, int]:
+    """
+    Reduce a crashing bitcode file while preserving its crash bucket, or, if pta_tools
+    is given, while preserving the points-to discrepancy between those analyses.
+
+    With loose, a pointer discrepancy only has to keep its pair of analyses and its
+    direction, not the names of the pointers involved (see DiffPTAOracle).
+
+    If stats is given, it is filled with probe counts: 'probes' (candidates tried),
+    'oracle_calls' (analyzer runs) and 'invalid' (candidates that are not valid IR).
+
+    Returns:
+        (number of IR lines in the original, number of IR lines kept)
+    """
+    if pta_tools:
+        oracle = DiffPTAOracle(pta_tools, timeout, jobs=jobs, loose=loose)
+        oracle.target = oracle.discrepancy(infile)
+        if not oracle.target:
+            raise RuntimeError(f"The analyses agree on {infile}, nothing to reduce")
+        print_out(f"Points-to discrepancies to preserve: {len(oracle.target)}")
+    else:
+        if signature is None:
+            signature = signature_of(command, infile, timeout)
+            if signature is None:
+                raise RuntimeError(f"{' '.join(command)} {infile} does not crash, "
+                                   "nothing to reduce")
+        print_out(f"Crash bucket: {signature}")
+        oracle = SignatureOracle(command, CrashSignature.from_bucket(signature), timeout,
+                                 include_stdout=True)
+
+    assembler = AssemblerPool(llvm_as, jobs)
+    counts = stats if stats is not None else {}
+    counts.update(probes=0, oracle_calls=0, invalid=0)
+    count_lock = threading.Lock()
+
+    def count(name: str):
+        with count_lock:
+            counts[name] += 1
+    lines = disassemble(infile, llvm_dis).splitlines(keepends=True)
+    n_original = len(lines)
+    splitters = [('entities', lambda ls: split_top_level(ls, reduce_metadata)),
+                 ('instructions', split_instructions)]
+
+    changed = True
+    while changed:
+        changed = False
+        for phase, splitter in splitters:
+            units = splitter(lines)
+            if not units:
+                continue
+            users = unit_dependencies(lines, units)
+
+            def interesting(candidate: bytearray, units=units, users=users) -> bool:
+                if breaks_dependency(users, candidate):
+                    count('invalid')
+                    return False
+                fd, probe = tempfile.mkstemp(suffix='.bc')
+                os.close(fd)
+                try:
+                    if not assembler.assemble(render(lines, units, candidate), probe):
+                        count('invalid')
+                        return False
+                    count('oracle_calls')
+                    return oracle.run(probe)
+                finally:
+                    os.remove(probe)
+
+            def save(enabled: bytearray, units=units):
+                assembler.assemble(render(lines, units, enabled), outfile)
+
+            def progress(dd: DeltaReducer, phase=phase):
+                if dd.round > 1 and dd.round_tried == 0:
+                    print_out('')
+                print_out(f"\r{phase}: Round {dd.round}: Tried {dd.round_tried}, "
+                          f"Removed {dd.round_removed}/{dd.round_size}", end='')
+
+            # Instructions are grouped by function: removals cluster in a few big functions
+            regions = function_regions(lines, units) if phase == 'instructions' else None
+            reducer = DeltaReducer(len(units), interesting, jobs=jobs, on_update=save,
+                                   on_progress=progress, strategy=strategy, regions=regions)
+            enabled = reducer.reduce()
+            counts['probes'] += reducer.probes
+            print_out('')
+            if reducer.removed:
+                changed = True
+                lines = render(lines, units, enabled).decode('utf-8').splitlines(keepends=True)
+
+    if not assembler.assemble(''.join(lines).encode('utf-8'), outfile):
+        raise RuntimeError("Reduced IR no longer assembles")
+    return n_original, len(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bcdd: delta debugger for crashing LLVM bitcode")
+    parser.add_argument("infile", help="Crashing bitcode file (will not be altered)")
+    parser.add_argument("outfile", help="Path to store the reduced bitcode in")
+    parser.add_argument("command", nargs=argparse.REMAINDER,
+                        help="Analyzer command; the bitcode file is appended to it")
+    parser.add_argument("--signature", default=None,
+                        help="Crash bucket to preserve "
+                             "(default: <infile>.sig, else computed from infile)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of concurrent probes (default: 1)")
+    parser.add_argument("--timeout", type=int, default=600,
+                        help="Per-probe analyzer timeout in seconds")
+    parser.add_argument("--pta", action='append', default=[], metavar="ANALYSIS",
+                        help="Reduce a discrepancy between these pointer analyses instead of a "
+                             "crash (give at least twice)")
+    parser.add_argument("--loose-diff", action='store_true',
+                        help="With --pta, only require the same analyses to disagree in the same "
+                             "direction, on any pointer")
+    parser.add_argument("--strategy", choices=['ddmin', 'adaptive'], default='ddmin',
+                        help="Probe scheduling (default: ddmin)")
+    parser.add_argument("--reduce-metadata", action='store_true',
+                        help="Also try to remove metadata nodes (slow on -g bitcode)")
+    parser.add_argument("--llvm-as", default='llvm-as')
+    parser.add_argument("--llvm-dis", default='llvm-dis')
+    parser.add_argument('-q', '--quiet', action='store_true', help="Suppress progress information")
+    args = parser.parse_args()
+
+    if not args.command and not args.pta:
+        parser.error("no analyzer command specified")
+    if len(args.pta) == 1:
+        parser.error("--pta needs at least two analyses")
+
+    signature = args.signature
+    if signature is None and os.path.exists(args.infile + '.sig'):
+        with open(args.infile + '.sig') as f:
+            signature = f.read().strip() or None
+
+    def print_out(*pargs, **kwargs):
+        if not args.quiet:
+            print(*pargs, **kwargs)
+            sys.stdout.flush()
+
+    try:
+        n_original, n_kept = reduce_bitcode(args.infile, args.outfile, args.command, signature,
+                                            args.jobs, args.timeout, args.reduce_metadata,
+                                            args.llvm_as, args.llvm_dis, print_out, args.pta,
+                                            args.strategy, loose=args.loose_diff)
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        logging.error(str(e))
+        sys.exit(1)
+    print(f"Done. Kept {n_kept}/{n_original} IR lines. "
+          f"Minimized bitcode written to {args.outfile}.")
+
+
+if __name__ == "__main__":
+    main()
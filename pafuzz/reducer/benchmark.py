@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Compare reduction strategies on a fixed corpus of saved crash repros.
+
+Every bitcode file of the corpus (e.g. a fuzz-pta crash/ directory) is reduced
+once per strategy with bcdd, and the number of analyzer (oracle) calls needed
+to reach the fixed point is recorded, together with the number of candidates
+tried, the final size and the wall time.
+
+Usage:
+$python -m pafuzz.reducer.benchmark <corpus_dir> [--json out.json] /path/to/wpa -lander --print-pts
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pafuzz.reducer.bcdd import reduce_bitcode
+from pafuzz.reducer.engine import STRATEGIES
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+def _read_signature(bc_file: Path) -> Optional[str]:
+    sig_file = Path(f"{bc_file}.sig")
+    if sig_file.exists():
+        return sig_file.read_text().strip() or None
+    return None
+
+
+def benchmark(corpus: List[Path], command: List[str], strategies: List[str], jobs: int = 1,
+              timeout: int = 600, pta_tools: Optional[List[str]] = None) -> List[Dict]:
+    """Reduce every repro with every strategy; returns one record per (repro, strategy)."""
+    records = []
+    for bc_file in corpus:
+        signature = _read_signature(bc_file)
+        for strategy in strategies:
+            stats: Dict = {}
+            fd, outfile = tempfile.mkstemp(suffix='.bc')
+            os.close(fd)
+            start = time.time()
+            try:
+                n_original, n_kept = reduce_bitcode(str(bc_file), outfile, command, signature,
+                                                    jobs, timeout, print_out=_quiet,
+                                                    pta_tools=pta_tools, strategy=strategy,
+                                                    stats=stats)
+            except RuntimeError as e:
+                logging.warning(f"Skipping {bc_file}: {e}")
+                break
+            finally:
+                os.remove(outfile)
+            records.append({
+                'repro': str(bc_file),
+                'strategy': strategy,
+                'oracle_calls': stats['oracle_calls'],
+                'probes': stats['probes'],
+                'invalid': stats['invalid'],
+                'lines_original': n_original,
+                'lines_kept': n_kept,
+                'seconds': round(time.time() - start, 3),
+            })
+    return records
+
+
+def summarize(records: List[Dict], strategies: List[str]) -> str:
+    lines = [f"{'repro':40} {'strategy':9} {'oracle':>8} {'probes':>8} {'kept':>12} {'seconds':>9}"]
+    for r in records:
+        lines.append(f"{Path(r['repro']).name[-40:]:40} {r['strategy']:9} "
+                     f"{r['oracle_calls']:8} {r['probes']:8} "
+                     f"{r['lines_kept']:5}/{r['lines_original']:<6} {r['seconds']:9.1f}")
+
+    totals = {s: sum(r['oracle_calls'] for r in records if r['strategy'] == s) for s in strategies}
+    lines.append("")
+    for strategy in strategies:
+        lines.append(f"total oracle calls to fixpoint ({strategy}): {totals[strategy]}")
+    if len(strategies) > 1 and totals[strategies[0]]:
+        base = totals[strategies[0]]
+        for strategy in strategies[1:]:
+            lines.append(f"{strategy} / {strategies[0]}: {totals[strategy] / base:.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark reduction strategies on a corpus of crash repros")
+    parser.add_argument("corpus", type=Path,
+                        help="Directory with the saved .bc repros (searched recursively)")
+    parser.add_argument("command", nargs=argparse.REMAINDER,
+                        help="Analyzer command; the bitcode file is appended to it")
+    parser.add_argument("--strategies", nargs='+', choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument("--pta", action='append', default=[], metavar="ANALYSIS",
+                        help="Reduce discrepancies between these analyses instead of crashes")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--timeout", type=int, default=600,
+                        help="Per-probe analyzer timeout in seconds")
+    parser.add_argument("--json", type=Path, default=None,
+                        help="Also write the raw records to this file")
+    args = parser.parse_args()
+
+    if not args.command and not args.pta:
+        parser.error("no analyzer command specified")
+
+    corpus = sorted(args.corpus.glob('**/*.bc'))
+    if not corpus:
+        logging.error(f"No .bc files found in {args.corpus}")
+        sys.exit(1)
+
+    records = benchmark(corpus, args.command, args.strategies, args.jobs, args.timeout,
+                        args.pta or None)
+    print(summarize(records, args.strategies))
+    if args.json:
+        args.json.write_text(json.dumps(records, indent=2))
+
+
+if __name__ == "__main__":
+    main()
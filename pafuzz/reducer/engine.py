@@ -0,0 +1,438 @@
+"""
+Delta-debugging engine shared by the reducer front ends.
+
+The search is the one linedd has always used: remove `stride` enabled units at
+a time, halve the stride until single units are removed, and repeat rounds
+until nothing more can be removed. A "unit" is whatever the front end decides
+(a text line for linedd, an IR entity for bcdd); the engine only sees indices.
+
+Probes are memoized on the exact set of enabled units, and up to `jobs`
+consecutive chunks are probed concurrently. When one probe of a batch
+succeeds, the later probes of that batch were run against a stale state, so
+their chunks are simply re-queued.
+
+With strategy="adaptive" the engine learns where removals succeed: chunks
+are probed region by region, highest observed success rate first; stride
+levels that have recently not removed anything are skipped (except single
+units, so the result stays 1-minimal); and failed chunks next to a chunk that
+was just removed are retried, since the removal may have unblocked them.
+Every stride level is swept once per round, so its statistics are carried
+over to the next round, halved: a level that keeps failing is skipped, and
+comes back once its old failures have decayed below the threshold.
+
+Long runs can checkpoint their full search state (bitmap, round, stride and
+memo cache) to a JSON file and resume from it; re-sweeping the interrupted
+stride is then answered from the memo cache. A separate JSON progress file
+is rewritten periodically for dashboards.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+STATE_VERSION = 1
+STRATEGIES = ('ddmin', 'adaptive')
+
+# adaptive: a stride level is skipped after this many (decayed) probes without a success
+SKIP_LEVEL_AFTER = 4
+
+
+class DeltaReducer:
+    """Memoized, optionally parallel delta debugger over `n_units` units."""
+
+    def __init__(self, n_units: int, test: Callable[[bytearray], bool],
+                 first: int = 0, last: int = -1, reverse: bool = False,
+                 linear: bool = False, jobs: int = 1,
+                 on_update: Optional[Callable[[bytearray], None]] = None,
+                 on_progress: Optional[Callable[['DeltaReducer'], None]] = None,
+                 unit_sizes: Optional[List[int]] = None, unit_name: str = 'units',
+                 state_file: Optional[str] = None, progress_file: Optional[str] = None,
+                 checkpoint_interval: float = 60.0, progress_interval: float = 1.0,
+                 input_id: Optional[str] = None, strategy: str = 'ddmin',
+                 regions: Optional[List[int]] = None, region_size: int = 64):
+        """
+        Args:
+            n_units: Number of units in the original input
+            test: Oracle; gets a candidate bitmap (1 = unit kept) and returns
+                True if the candidate is still interesting. Must be thread-safe
+                when jobs > 1.
+            first: First unit that may be removed
+            last: Units at and after this index are never removed (-1: none)
+            reverse: Sweep from the end of the input instead of the beginning
+            linear: Only remove units one by one
+            jobs: Number of probes evaluated concurrently
+            on_update: Called with the new bitmap after every accepted removal
+            on_progress: Called after every probe
+            unit_sizes: Size in bytes of every unit, for progress reports
+            unit_name: What a unit is called in progress reports ("lines", ...)
+            state_file: Where to checkpoint the search state (see load_state)
+            progress_file: Where to write machine-readable progress
+            checkpoint_interval: Seconds between two checkpoints
+            progress_interval: Seconds between two progress file updates
+            input_id: Fingerprint of the input; a state saved for a different
+                input is refused on load
+            strategy: "ddmin" (sweep in order) or "adaptive" (see module doc)
+            regions: adaptive: region id of every unit, e.g. the function it
+                belongs to (default: blocks of region_size consecutive units)
+            region_size: adaptive: size of the default regions
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown reduction strategy {strategy}, expected one of {STRATEGIES}")
+        self.n_units = n_units
+        self.test = test
+        self.first = max(first, 0)
+        self.last = n_units if last < 0 else min(last, n_units)
+        self.reverse = reverse
+        self.linear = linear
+        self.jobs = max(jobs, 1)
+        self.on_update = on_update
+        self.on_progress = on_progress
+
+        self.unit_sizes = unit_sizes
+        self.unit_name = unit_name
+        self.state_file = state_file
+        self.progress_file = progress_file
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_interval = progress_interval
+        self.input_id = input_id
+        self.strategy = strategy
+        if regions is None:
+            regions = [i // max(region_size, 1) for i in range(n_units)]
+        self.regions = regions
+        # adaptive statistics: region -> [probes, successes], stride level -> [probes,
+        # successes], halved at every new round
+        self.region_stats: Dict[int, List[int]] = {}
+        self.level_stats: Dict[int, List[int]] = {}
+        self.skipped_strides = 0
+
+        self.enabled = bytearray([1]) * n_units
+        self.cache: Dict[bytes, bool] = {}
+        self._lock = threading.Lock()
+        self._resume_stride: Optional[int] = None
+        self._started = time.time()
+        self._elapsed_before = 0.0
+        self._last_checkpoint = self._last_report = time.time()
+
+        # Statistics, readable from the callbacks
+        self.round = 0
+        self.stride = 0
+        self.probes = 0
+        self.cache_hits = 0
+        self.successes = 0
+        self.removed = 0
+        self.round_tried = 0
+        self.round_removed = 0
+        self.round_size = 0
+        self.round_changed = False
+        self.done = False
+
+    @staticmethod
+    def _key(candidate: bytearray) -> bytes:
+        return hashlib.sha1(candidate).digest()
+
+    @property
+    def num_enabled(self) -> int:
+        return self.enabled.count(1)
+
+    @property
+    def num_left(self) -> int:
+        """Number of enabled units that are still candidates for removal."""
+        return self.enabled[self.first:self.last].count(1)
+
+    @property
+    def elapsed(self) -> float:
+        return self._elapsed_before + time.time() - self._started
+
+    @property
+    def num_bytes(self) -> Optional[int]:
+        if self.unit_sizes is None:
+            return None
+        return sum(size for size, e in zip(self.unit_sizes, self.enabled) if e)
+
+    def progress(self) -> dict:
+        """Machine-readable progress, as written to the progress file."""
+        elapsed = self.elapsed
+        return {
+            'round': self.round,
+            'stride': self.stride,
+            'probes': self.probes,
+            'successes': self.successes,
+            'cache_hits': self.cache_hits,
+            'removed': self.removed,
+            f'{self.unit_name}_total': self.n_units,
+            f'{self.unit_name}_left': self.num_enabled,
+            'bytes_total': sum(self.unit_sizes) if self.unit_sizes is not None else None,
+            'bytes': self.num_bytes,
+            'elapsed': round(elapsed, 3),
+            'probes_per_sec': round(self.probes / elapsed, 3) if elapsed > 0 else 0.0,
+            'done': self.done,
+            'timestamp': time.time(),
+        }
+
+    @staticmethod
+    def _write_json(path: str, data: dict):
+        # Write-then-rename, so that readers never see a half-written file
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def write_progress(self):
+        if self.progress_file:
+            self._write_json(self.progress_file, self.progress())
+        self._last_report = time.time()
+
+    def save_state(self, path: Optional[str] = None):
+        """Checkpoint everything needed to resume the search."""
+        path = path or self.state_file
+        if not path:
+            return
+        with self._lock:
+            cache = {key.hex(): int(value) for key, value in self.cache.items()}
+        self._write_json(path, {
+            'version': STATE_VERSION,
+            'input_id': self.input_id,
+            'n_units': self.n_units,
+            'first': self.first,
+            'last': self.last,
+            'enabled': base64.b64encode(zlib.compress(bytes(self.enabled))).decode('ascii'),
+            'round': self.round,
+            'stride': self.stride,
+            'round_changed': self.round_changed,
+            'round_removed': self.round_removed,
+            'round_size': self.round_size,
+            'probes': self.probes,
+            'successes': self.successes,
+            'cache_hits': self.cache_hits,
+            'removed': self.removed,
+            'elapsed': self.elapsed,
+            'done': self.done,
+            'cache': cache,
+            'region_stats': {str(k): v for k, v in self.region_stats.items()},
+            'level_stats': {str(k): v for k, v in self.level_stats.items()},
+        })
+        self._last_checkpoint = time.time()
+
+    def load_state(self, path: Optional[str] = None):
+        """
+        Restore a checkpoint written by save_state(); the next reduce() continues
+        the interrupted round at the interrupted stride.
+
+        Raises:
+            ValueError: if the checkpoint belongs to a different input
+        """
+        path = path or self.state_file
+        with open(path) as f:
+            state = json.load(f)
+        if state.get('version') != STATE_VERSION:
+            raise ValueError(f"Unsupported reducer state version in {path}")
+        if (state['n_units'] != self.n_units or
+                (self.input_id and state.get('input_id') != self.input_id)):
+            raise ValueError(f"Reducer state in {path} was saved for a different input")
+
+        self.enabled = bytearray(zlib.decompress(base64.b64decode(state['enabled'])))
+        self.cache = {bytes.fromhex(key): bool(value) for key, value in state['cache'].items()}
+        for name in ('round', 'round_changed', 'round_removed', 'round_size', 'probes',
+                     'successes', 'cache_hits', 'removed', 'done'):
+            setattr(self, name, state[name])
+        self.region_stats = {int(k): v for k, v in state.get('region_stats', {}).items()}
+        self.level_stats = {int(k): v for k, v in state.get('level_stats', {}).items()}
+        self.stride = state['stride']
+        self._resume_stride = state['stride'] if state['round'] > 0 and not state['done'] else None
+        self._elapsed_before = state['elapsed']
+        self._started = time.time()
+
+    def _periodic(self):
+        now = time.time()
+        if self.state_file and now - self._last_checkpoint >= self.checkpoint_interval:
+            self.save_state()
+        if self.progress_file and now - self._last_report >= self.progress_interval:
+            self.write_progress()
+
+    def _probe(self, candidate: bytearray) -> bool:
+        key = self._key(candidate)
+        with self._lock:
+            if key in self.cache:
+                self.cache_hits += 1
+                return self.cache[key]
+        result = bool(self.test(candidate))
+        with self._lock:
+            self.cache[key] = result
+        return result
+
+    def _candidate(self, chunk: List[int]) -> bytearray:
+        candidate = bytearray(self.enabled)
+        for i in chunk:
+            candidate[i] = 0
+        return candidate
+
+    def _accept(self, chunk: List[int], candidate: bytearray):
+        self.enabled = candidate
+        self.successes += 1
+        self.removed += len(chunk)
+        self.round_removed += len(chunk)
+        if self.on_update:
+            self.on_update(self.enabled)
+
+    def _progress(self):
+        if self.on_progress:
+            self.on_progress(self)
+
+    def _chunks(self, stride: int) -> List[List[int]]:
+        """Partition the removable enabled units into sweep-ordered chunks."""
+        order = range(self.first, self.last)
+        if self.reverse:
+            order = order[::-1]
+        chunks, current = [], []
+        for i in order:
+            if self.enabled[i]:
+                current.append(i)
+                if len(current) == stride:
+                    chunks.append(current)
+                    current = []
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _sweep(self, chunks: List[List[int]], pool: Optional[ThreadPoolExecutor]) -> bool:
+        """Try to remove each chunk in turn. Returns True if anything was removed."""
+        changed = False
+        pos = 0
+        while pos < len(chunks):
+            batch = chunks[pos:pos + self.jobs]
+            candidates = [self._candidate(chunk) for chunk in batch]
+            if pool is None or len(batch) == 1:
+                results = [self._probe(candidates[0])]
+            else:
+                results = list(pool.map(self._probe, candidates))
+
+            self.probes += len(results)
+            self.round_tried += len(results)
+            accepted = next((idx for idx, ok in enumerate(results) if ok), None)
+            if accepted is None:
+                pos += len(batch)
+            else:
+                self._accept(batch[accepted], candidates[accepted])
+                changed = True
+                pos += accepted + 1
+            self._progress()
+            self._periodic()
+        return changed
+
+    def _region_score(self, region: int) -> float:
+        probes, successes = self.region_stats.get(region, (0, 0))
+        return (successes + 1) / (probes + 2)
+
+    def _learn(self, chunk: List[int], ok: bool):
+        for stats in (self.region_stats.setdefault(self.regions[chunk[0]], [0, 0]),
+                      self.level_stats.setdefault(self.stride.bit_length() - 1, [0, 0])):
+            stats[0] += 1
+            stats[1] += int(ok)
+
+    def _decay_level_stats(self):
+        for stats in self.level_stats.values():
+            stats[0] //= 2
+            stats[1] //= 2
+
+    def _skip_stride(self) -> bool:
+        if self.strategy != 'adaptive' or self.stride <= 1:
+            return False
+        probes, successes = self.level_stats.get(self.stride.bit_length() - 1, (0, 0))
+        return successes == 0 and probes >= SKIP_LEVEL_AFTER
+
+    def _sweep_adaptive(self, chunks: List[List[int]], pool: Optional[ThreadPoolExecutor]) -> bool:
+        """Like _sweep, but chunks are drawn from the most productive region first."""
+        pending: Dict[int, List[List[int]]] = {}
+        for chunk in chunks:
+            pending.setdefault(self.regions[chunk[0]], []).append(chunk)
+        failed: List[List[int]] = []
+        retried = set()
+        changed = False
+
+        while pending:
+            batch = []
+            while pending and len(batch) < self.jobs:
+                region = max(pending, key=self._region_score)
+                batch.append(pending[region].pop(0))
+                if not pending[region]:
+                    del pending[region]
+
+            candidates = [self._candidate(chunk) for chunk in batch]
+            if pool is None or len(batch) == 1:
+                results = [self._probe(candidates[0])]
+            else:
+                results = list(pool.map(self._probe, candidates))
+            self.probes += len(results)
+            self.round_tried += len(results)
+            accepted = next((idx for idx, ok in enumerate(results) if ok), None)
+
+            evaluated = batch if accepted is None else batch[:accepted + 1]
+            for chunk, ok in zip(evaluated, results):
+                self._learn(chunk, ok)
+            if accepted is None:
+                failed.extend(batch)
+            else:
+                failed.extend(batch[:accepted])
+                for chunk in batch[accepted + 1:]:  # probed against a stale state
+                    pending.setdefault(self.regions[chunk[0]], []).insert(0, chunk)
+                removed = batch[accepted]
+                self._accept(removed, candidates[accepted])
+                changed = True
+
+                # Retry failed chunks next to the removed one, once per sweep
+                low, high = min(removed), max(removed)
+                for chunk in list(failed):
+                    if id(chunk) in retried:
+                        continue
+                    if min(chunk) - high <= self.stride and low - max(chunk) <= self.stride:
+                        failed.remove(chunk)
+                        retried.add(id(chunk))
+                        pending.setdefault(self.regions[chunk[0]], []).insert(0, chunk)
+            self._progress()
+            self._periodic()
+        return changed
+
+    def reduce(self) -> bytearray:
+        """Run rounds until a fixed point is reached and return the final bitmap."""
+        pool = ThreadPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+        self.done = False
+        try:
+            while True:
+                if self._resume_stride is None:
+                    self.round += 1
+                    self.round_tried = 0
+                    self.round_removed = 0
+                    self.round_size = self.num_left
+                    self.round_changed = False
+                    self._decay_level_stats()
+                    self.stride = self.num_left if not self.linear else 1
+                else:
+                    self.stride, self._resume_stride = self._resume_stride, None
+                self._progress()
+
+                sweep = self._sweep_adaptive if self.strategy == 'adaptive' else self._sweep
+                while self.stride >= 1:
+                    if self._skip_stride():
+                        self.skipped_strides += 1
+                    elif sweep(self._chunks(self.stride), pool):
+                        self.round_changed = True
+                    if self.stride == 1:
+                        break
+                    self.stride //= 2
+                if not self.round_changed:
+                    break
+            self.done = True
+        finally:
+            # Also reached on Ctrl-C / sys.exit(), so an interrupted run can be resumed
+            if pool is not None:
+                pool.shutdown(wait=False)
+            self.save_state()
+            if self.progress_file:
+                self.write_progress()
+        return self.enabled
@@ -2,45 +2,45 @@
 from __future__ import division, print_function
 
 import argparse
+import hashlib
 import mmap
 import os
+import re
 import shutil
 import signal
 import subprocess
 import sys
 import tempfile
 from argparse import REMAINDER
-from threading import Timer
 
-import cup
+from pafuzz.reducer.engine import DeltaReducer
+from pafuzz.reducer.oracle import CrashSignature, DiffPTAOracle, SignatureOracle
 
 """
-linedd is a delta-debugger for line-oriented text formats, used for minimizing inputs to programs while preserving errors.
-In contrast to most delta-debuggers, linedd isn't specialized to deal with any particular syntax or format, beyond line endings.
-It can be directly employed, without modification, to delta-debug any line-oriented text file. 
- 
-Given a system command of the form "command argument1 argument2 file", (with file as the last argument),
-linedd will execute that command on the file and record the exit code. It will then repeatedly attempt to remove one or more individual lines
-from the file, each time executing the original command on the new, smaller file. If the exit code of the command changes after removing
-a line, linedd will backtrack, replacing the line and removing a new one. 
+linedd is a delta-debugger for line-oriented text formats, used for minimizing inputs to programs
+while preserving errors. In contrast to most delta-debuggers, linedd isn't specialized to deal with
+any particular syntax or format, beyond line endings. It can be directly employed, without
+modification, to delta-debug any line-oriented text file.
+
+Given a system command of the form "command argument1 argument2 file", (with file as the last
+argument), linedd will execute that command on the file and record the exit code. It will then
+repeatedly attempt to remove one or more individual lines from the file, each time executing the
+original command on the new, smaller file. If the exit code of the command changes after removing
+a line, linedd will backtrack, replacing the line and removing a new one.
 In this way it continues removing lines until it reaches a fixed point.
 Usage is as simple as
 $linedd <file_to_minimize> <output_file> "command arg1 arg2 arg3"
-Where the file_to_minimize is the file you start with, and output_file is where linedd should write its minimzed version. Command is any arbitrary command, optionally with arguments.
-Command will then be executed repeatedly as "command arg1 arg2 arg3 output_file". linedd assumes that the command expects the file as its last argument. 
+Where the file_to_minimize is the file you start with, and output_file is where linedd should write
+its minimzed version. Command is any arbitrary command, optionally with arguments.
+Command will then be executed repeatedly as "command arg1 arg2 arg3 output_file". linedd assumes
+that the command expects the file as its last argument.
 """
 
 
-def terminate(process):
-    if process.poll() is None:
-        try:
-            process.terminate()
-        except Exception as ex:
-            print("error for interrupting")
-            print(ex)
-
-
 def signal_handler(signal, frame):
+    if args.state:
+        error_quit("\nlinedd terminated by interrupt signal. Search state saved to " + args.state
+                   + "; run again with the same --state to resume.")
     error_quit("\nlinedd terminated by interrupt signal.")
 
 
@@ -56,36 +56,40 @@ class HelpParser(argparse.ArgumentParser):
         sys.exit(2)
 
 
-parser = HelpParser(description="linedd: A line-oriented delta debugger.\nUsage: " + os.path.basename(
-    sys.argv[0]) + " [options] <input_file> <output_file> command"
-                                + "\n\nExample: If \"./buggy_program -buggyflag buggy_input.txt\" crashes with error "
-                                  "code 139\n "
-                                + os.path.basename(
-    sys.argv[0]) + " buggy_input.txt minimized_input.txt ./buggy_program -buggyflag"
-                                + "\nA minimized subset of \"buggy_input.txt\" that produces the same error code will "
-                                  "be created and stored in \"minimized_input.txt\". "
-                    , formatter_class=argparse.RawTextHelpFormatter, usage=argparse.SUPPRESS)
+parser = HelpParser(description="linedd: A line-oriented delta debugger.\nUsage: "
+                                + os.path.basename(sys.argv[0])
+                                + " [options] <input_file> <output_file> command"
+                                + "\n\nExample: If \"./buggy_program -buggyflag buggy_input.txt\" "
+                                  "crashes with error code 139\n "
+                                + os.path.basename(sys.argv[0])
+                                + " buggy_input.txt minimized_input.txt ./buggy_program -buggyflag"
+                                + "\nA minimized subset of \"buggy_input.txt\" that produces the "
+                                  "same error code will be created and stored in "
+                                  "\"minimized_input.txt\". ",
+                    formatter_class=argparse.RawTextHelpFormatter, usage=argparse.SUPPRESS)
 
 # positional arguments
 parser.add_argument("infile",
-                    help="Path to input file (this file will not be altered); this file will be appended to the "
-                         "command before it is executed")
+                    help="Path to input file (this file will not be altered); this file will be "
+                         "appended to the command before it is executed")
 parser.add_argument("outfile", help="Path to store reduced input file in")
-# parser.add_argument("command", type=str, help="Command to execute (with the input file will be appended to the
-# end). May include arguments to be passed to the command", nargs=argparse.REMAINDER, action="store")
+# parser.add_argument("command", type=str, help="Command to execute (with the input file will be
+# appended to the end). May include arguments to be passed to the command",
+# nargs=argparse.REMAINDER, action="store")
 parser.add_argument("command", type=str,
-                    help="Command to execute (with the input file will be appended to the end). May include arguments "
-                         "to be passed to the command",
+                    help="Command to execute (with the input file will be appended to the end). "
+                         "May include arguments to be passed to the command",
                     nargs=REMAINDER)
 
 # optional arguments
 parser.add_argument("--expect", type=int,
-                    help="Expected exit code. If supplied, linedd will skip the initial execution of the command ("
-                         "default: None)",
+                    help="Expected exit code. If supplied, linedd will skip the initial execution "
+                         "of the command (default: None)",
                     default=None)
 
 parser.add_argument('--signal', dest='signal', action='store_true',
-                    help="Use the full unix termination-signal, instead of just the exit code (default: --no-signal)")
+                    help="Use the full unix termination-signal, instead of just the exit code "
+                         "(default: --no-signal)")
 parser.add_argument('--no-signal', dest='signal', action='store_false', help=argparse.SUPPRESS)
 parser.set_defaults(signal=False)
 
@@ -100,26 +104,45 @@ parser.add_argument('--no-verbose', dest='verbose', action='store_false', help=a
 parser.set_defaults(verbose=False)
 
 parser.add_argument('--reverse', dest='reverse', action='store_true',
-                    help="Remove lines starting from the end of the file, rather than the beginning (default: "
-                         "--no-reverse)")
+                    help="Remove lines starting from the end of the file, rather than the "
+                         "beginning (default: --no-reverse)")
 parser.add_argument('--no-reverse', dest='reverse', action='store_false', help=argparse.SUPPRESS)
 parser.set_defaults(reverse=False)
 
 parser.add_argument('--linear', dest='linear', action='store_true',
-                    help="Only remove lines one-by-one, instead of applying a binary search (default: --no-linear)")
+                    help="Only remove lines one-by-one, instead of applying a binary search "
+                         "(default: --no-linear)")
 parser.add_argument('--no-linear', dest='linear', action='store_false', help=argparse.SUPPRESS)
 parser.set_defaults(linear=False)
 
-parser.add_argument("--first", type=int, help="Don't remove lines before this one  (default: 1)", default=1)
-parser.add_argument("--last", type=int, help="Don't remove lines after this one (-1 for infinity)  (default: -1)",
+parser.add_argument("--first", type=int, help="Don't remove lines before this one  (default: 1)",
+                    default=1)
+parser.add_argument("--last", type=int,
+                    help="Don't remove lines after this one (-1 for infinity)  (default: -1)",
                     default=-1)
 
 parser.add_argument("--mmap", dest='mmap', action='store_true',
-                    help="Read the input file using a memory-mapped file (disable if linedd is crashing) (default: true for 64-bit Python, false for 32-bit Python )")
+                    help="Read the input file using a memory-mapped file (disable if linedd is "
+                         "crashing) (default: true for 64-bit Python, false for 32-bit Python )")
 parser.add_argument('--no-mmap', dest='mmap', action='store_false', help=argparse.SUPPRESS)
 parser.set_defaults(mmap=(sys.maxsize > 2 ** 32))
 
-parser.add_argument("--difftest", type=int, help="test diff (default: 0)", default=0)
+parser.add_argument("--difftest", type=int, default=0,
+                    help="Reduce a points-to inconsistency between the --pta analyses instead of a "
+                         "crash (default: 0)")
+parser.add_argument("--pta", action='append', default=[], metavar="ANALYSIS",
+                    help="Pointer analysis command for --difftest, e.g. "
+                         "\"wpa -lander --print-pts\"; give it at least twice. The (compiled) "
+                         "input file is appended. Implies --difftest.")
+parser.add_argument("--compile", default=None, metavar="COMMAND",
+                    help="For --difftest: command turning the input into bitcode, run as "
+                         "\"COMMAND <file> -o <file.bc>\" (default: analyze the input directly)")
+parser.add_argument("--match-pointer", dest="match_pointer", default=None, metavar="NAME",
+                    help="For --difftest: only keep candidates where the analyses disagree on this "
+                         "pointer (default: the pointers of the original disagreement)")
+parser.add_argument("--loose-diff", dest="loose_diff", action='store_true',
+                    help="For --difftest: keep candidates where the same analyses disagree in the "
+                         "same direction on any pointer (default: the pointer names must match)")
 parser.add_argument("--match-out", dest="match_out",
                     default=None,
                     help="match string in stdout to identify "
@@ -128,21 +151,49 @@ parser.add_argument("--match-err", dest="match_err",
                     default=None,
                     help="match string in stderr to identify "
                          "failing input (default: stderr output)")
+parser.add_argument("--match-assert", dest="match_assert", default=None, metavar="FILE:LINE",
+                    help="Keep candidates whose stderr shows a failed assertion at this location "
+                         "(default: None)")
+parser.add_argument("--match-frame", dest="match_frame", default=None, metavar="FUNCTION",
+                    help="Keep candidates whose first sanitizer/LLVM stack frame below the crash "
+                         "handlers is in this function (default: None)")
+parser.add_argument("--match-regex", dest="match_regex", default=None, metavar="REGEX",
+                    help="Keep candidates whose stderr matches this regular expression "
+                         "(default: None)")
+parser.add_argument("--timeout", type=float, default=60,
+                    help="Per-probe timeout in seconds; a probe that times out is not interesting, "
+                         "0 disables the timeout (default: 60)")
 parser.add_argument('--config', dest='config', default='no', type=str)
+parser.add_argument("-j", "--jobs", type=int, default=1,
+                    help="Number of candidates to test concurrently (default: 1)")
+parser.add_argument("--strategy", choices=['ddmin', 'adaptive'], default='ddmin',
+                    help="ddmin: sweep every stride in file order; adaptive: probe regions with "
+                         "the highest removal rate first, skip unproductive strides and retry "
+                         "chunks next to removals (default: ddmin)")
+parser.add_argument("--state", default=None, metavar="FILE",
+                    help="Periodically save the search state to this file, and resume from it if "
+                         "it already exists (default: None)")
+parser.add_argument("--progress", default=None, metavar="FILE",
+                    help="Periodically write machine-readable (JSON) progress to this file "
+                         "(default: None)")
+parser.add_argument("--checkpoint-interval", dest="checkpoint_interval", type=float, default=60,
+                    help="Seconds between two saves of --state (default: 60)")
 
 args = parser.parse_args()
 if args.first < 1:
     args.first = 1
 if 0 <= args.last <= args.first:
-    print("Last line (%d) is not after the first line (%d) to reduce, aborting." % (args.first, args.last))
+    print("Last line (%d) is not after the first line (%d) to reduce, aborting."
+          % (args.first, args.last))
     sys.exit(0)
 
-m_difftest = False
-if args.difftest == 1: m_difftest = True
-z3_tool = ' '
-cvc4_tool = ' '
+m_difftest = args.difftest == 1 or len(args.pta) > 0
+if m_difftest and len(args.pta) < 2:
+    print("--difftest needs at least two --pta analyses, aborting.")
+    sys.exit(1)
 
-first = args.first - 1  # Users usually expect line numbers in text files to be 1-based, not 0-based, so subtract one.
+# Users usually expect line numbers in text files to be 1-based, not 0-based, so subtract one.
+first = args.first - 1
 last = args.last - 1 if args.last > 0 else args.last
 expect = args.expect
 backward = args.reverse
@@ -173,8 +224,8 @@ def usage_quit(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
     print("Usage:\t linedd <file_to_minimize> <output_file> command")
     print(
-        "\te.g., if \"./my_program --my_arg my_buggy_file\" exits with code 134, call\n\tlinedd my_buggy_file "
-        "reduced_file ./my_program --my_arg")
+        "\te.g., if \"./my_program --my_arg my_buggy_file\" exits with code 134, call\n"
+        "\tlinedd my_buggy_file reduced_file ./my_program --my_arg")
     sys.exit(1)
 
 
@@ -192,9 +243,12 @@ try:
     original_open_file = open(infile, "r+b")
     if use_mmap:
         original_file = mmap.mmap(original_open_file.fileno(), 0, access=mmap.ACCESS_READ)
-        n_original_lines = 0
+        # Start offset of every line (plus the end of the file), so candidates can be written with
+        # slices instead of seeking the shared map, which would not be safe with concurrent probes.
+        line_offsets = [0]
         while original_file.readline():
-            n_original_lines += 1
+            line_offsets.append(original_file.tell())
+        n_original_lines = len(line_offsets) - 1
         if n_original_lines == 0:
             error_quit("File contains no lines, aborting!")
         original_file.seek(0)
@@ -211,13 +265,12 @@ try:
 except IOError as e:
     error_quit("Could not read input file " + infile + ", aborting!")
 
-if len(args.command) == 0:
+if len(args.command) == 0 and not m_difftest:
     # This is a very common error - it usually means the user forgot to set an output file.
 
     error_quit(
-        "No command specified, aborting.\nusage: linedd <inputfile> <outputfile> <command>" + "\n(output file was "
-                                                                                              "specified as " + str(
-            args.outfile) + ")." if args.outfile else "")
+        "No command specified, aborting.\nusage: linedd <inputfile> <outputfile> <command>"
+        + "\n(output file was specified as " + str(args.outfile) + ")." if args.outfile else "")
 
 command = " ".join(args.command)
 
@@ -239,30 +292,38 @@ if os.path.exists(outfile):
         mfile = mfile + str(mnum)
 
     if os.path.exists(mfile) and not allowOverwritingBackups:
-        error_quit("Output file " + outfile + " already exists, too many backups already made, aborting!")
+        error_quit("Output file " + outfile
+                   + " already exists, too many backups already made, aborting!")
 
     else:
         if os.path.exists(mfile):
             print_out(
-                "Output file " + outfile + " already exists, too many backups already made, over-writing " + mfile + "!")
+                "Output file " + outfile + " already exists, too many backups already made, "
+                "over-writing " + mfile + "!")
         else:
             print_out("Output file " + outfile + " already exists, moving to " + mfile)
         shutil.move(outfile, mfile)
 
-    # Dangerous: I used cup from Baidu to set a timeotu
 
 
 def run(filename):
     cmd = command + " " + filename
-    shellexec = cup.shell.ShellExec()
     if verbose:
         print_out("running: " + cmd)
-        # retval = os.system(cmd + " 2>&1");
-        retval = shellexec.run(cmd=cmd, timeout=10)['returncode']
+    try:
+        retcode = subprocess.run(cmd, shell=True, timeout=args.timeout or None,
+                                 stdout=None if verbose else subprocess.DEVNULL,
+                                 stderr=subprocess.STDOUT if verbose else subprocess.DEVNULL
+                                 ).returncode
+    except subprocess.TimeoutExpired:
+        if verbose:
+            print_out("timeout")
+        return None
+    # Encode like a wait status (as os.system used to return it): exit code in the high byte,
+    # signal in the low one
+    retval = retcode << 8 if retcode >= 0 else -retcode
+    if verbose:
         print_out("exit " + str(retval) + "(" + str(retval >> 8) + ")")
-    else:
-        # retval = shellexec.run(cmd=cmd, timeout=10)['returncode']
-        retval = os.system(cmd + " >/dev/null 2>&1")
     sig_val = 0
     if not use_signal:
         sig_val = retval & 0xF
@@ -275,116 +336,57 @@ def run(filename):
     return retval
 
 
-'''            
-def run(filename):
-    cmd = command + " " + filename
-    if(verbose):
-        print_out("running: " + cmd)
-        retval = os.system(cmd + " 2>&1");
-        print_out("exit " + str(retval) + "(" + str(retval>>8) + ")")
-    else:
-        retval = os.system(cmd+ " >/dev/null 2>&1");
-    sig_val=0    
-    if not use_signal:
-        sig_val = retval & 0xF
-        retval = retval >> 8
-    if sig_val == signal.SIGINT:
-        #Convenience method to exit if the user interrupts it while the child is running.
-        error_quit("\nlinedd terminated by interrupt signal from child process (use --signal to prevent child process
-          signals from terminating linedd).")
-    return retval
-'''
-
-
-def run_stderr(filename):
-    ret = False
-    errcmd = ['/home/tofuzz/z3-debug/build/z3', filename]
-    p = subprocess.Popen(errcmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    timer = Timer(30, terminate, args=[p])
-    timer.start()
-    out = p.stdout.readlines()
-    out = ' '.join([str(element.decode('UTF-8')) for element in out])
-    if args.match_err:
-        if args.match_err in out:
-            print("stderr matching!")
-            ret = True
-    return ret
-
-
-def run_diff(filename):
-    ret = False
-
-    cmd_z3 = [z3_tool, filename]
-    # logging.debug("z3 start to solve")
-    pz3 = subprocess.Popen(cmd_z3, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    timerz3 = Timer(20, terminate, args=[pz3])
-    timerz3.start()
-    outz3 = pz3.stdout.readlines()
-    outz3 = ' '.join([str(element.decode('UTF-8')) for element in outz3])
-    # logging.debug(outz3)
-
-    cmd_cvc4 = [cvc4_tool, '-i', filename]
-    # logging.debug("cvc4 start to solve")
-    pcvc4 = subprocess.Popen(cmd_cvc4, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    timercvc4 = Timer(20, terminate, args=[pcvc4])
-    timercvc4.start()
-    outcvc4 = pcvc4.stdout.readlines()
-    outcvc4 = ' '.join([str(element.decode('UTF-8')) for element in outcvc4])
-    # logging.debug(outcvc4)
-
-    z3_res = 'unknown'
-    if not ('ASS' in outz3 or 'Ass' in outz3 or 'error' in outz3 or 'Add' in outz3):
-        if 'unsat' in outz3:
-            z3_res = 'unsat'
-        elif 'sat' in outz3:
-            z3_res = 'sat'
-
-    cvc4_res = 'unknown'
-    if not ('ASS' in outcvc4 or 'Ass' in outcvc4 or 'error' in outcvc4 or 'Add' in outcvc4):
-        if 'unsat' in outcvc4:
-            cvc4_res = 'unsat'
-        elif 'sat' in outcvc4:
-            cvc4_res = 'sat'
-
-    print("z3, cvc: ", z3_res, cvc4_res)
-    if z3_res != 'unknown' and cvc4_res != 'unknown':
-        if z3_res != cvc4_res:
-            print("find inconsistency!")
-            ret = True
-
-    return ret
-
-
-print_out("Executing command: \"" + command + " " + infile + "\"")
+signature_oracle = None
+if args.match_assert or args.match_frame or args.match_regex or args.match_err:
+    regex = args.match_regex or (re.escape(args.match_err) if args.match_err else None)
+    signature_oracle = SignatureOracle(command, CrashSignature(assertion=args.match_assert,
+                                                               frame=args.match_frame, regex=regex),
+                                       timeout=args.timeout or None)
+
+
+diff_oracle = None
+if m_difftest:
+    diff_oracle = DiffPTAOracle(args.pta, timeout=args.timeout or None, compile_cmd=args.compile,
+                                match_pointer=args.match_pointer, jobs=args.jobs,
+                                loose=args.loose_diff)
+    print_out("Running analyses: " + ", ".join("\"" + pta + "\"" for pta in args.pta))
+    diff_oracle.target = diff_oracle.discrepancy(infile)
+    if not diff_oracle.run(infile):
+        error_quit("The analyses agree on " + infile
+                   + " (or one of them failed), nothing to reduce. Aborting!")
+    print_out("Points-to discrepancies to preserve: " + str(len(diff_oracle.target)))
+else:
+    print_out("Executing command: \"" + command + " " + infile + "\"")
 
 skip_sanity = expect is not None
-# If the user supplied an expected exit code, assume that they are doing so because the run is slow, so skip the
-# sanity check too
+# If the user supplied an expected exit code, assume that they are doing so because the run is
+# slow, so skip the sanity check too
 
-if expect is None:
+if expect is None and signature_oracle is None and not m_difftest:
     expect = run(infile)
+    if expect is None:
+        error_quit("Command timed out after " + str(args.timeout)
+                   + "s on the original input (see --timeout), aborting!")
 
-if use_signal:
+if expect is None:
+    pass
+elif use_signal:
     print_out(
-        "Expected exit code is " + str(expect) + " (value=" + str(expect >> 8) + ", signal=" + str(expect & 0xff) + ")")
+        "Expected exit code is " + str(expect) + " (value=" + str(expect >> 8)
+        + ", signal=" + str(expect & 0xff) + ")")
 else:
     print_out("Expected exit code is " + str(expect))
 
 num_enabled = n_original_lines
-enabled = [True] * num_enabled
+enabled = bytearray([1]) * num_enabled
 
 
-def writeTo(filename):
+def writeTo(filename, enabled=enabled):
     fout = open(filename, 'wb')
     if use_mmap:
-        l = 0
-        line = original_file.readline()
-        while line:
+        for l in range(n_original_lines):
             if enabled[l]:
-                fout.write(line)
-            l += 1
-            line = original_file.readline()
-        original_file.seek(0)
+                fout.write(original_file[line_offsets[l]:line_offsets[l + 1]])
     else:
         for l in range(n_original_lines):
             if enabled[l]:
@@ -392,18 +394,40 @@ def writeTo(filename):
     fout.close()
 
 
+def interesting(candidate):
+    # Every probe gets its own file, so that probes can run concurrently.
+    probeFile = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
+    probeFileName = probeFile.name
+    probeFile.close()
+    try:
+        writeTo(probeFileName, candidate)
+        if diff_oracle is not None:  # the analyses still disagree in the same way
+            return diff_oracle.run(probeFileName)
+        if signature_oracle is not None:  # match the crash signature in stderr
+            return signature_oracle.run(probeFileName)
+        return run(probeFileName) == expect  # match only exit code
+    finally:
+        os.remove(probeFileName)
+
+
 # sanity check:
 testingFile = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
 testingFileName = testingFile.name
 testingFile.close()
 
 writeTo(testingFileName)
-if not skip_sanity:
+if not skip_sanity and signature_oracle is not None:
+    if not signature_oracle.run(testingFileName):
+        error_quit("Output of " + command + " " + testingFileName
+                   + " doesn't show the expected crash signature, even though no changes were "
+                     "made. Aborting!\n")
+elif not skip_sanity and not m_difftest:
     ret = run(testingFileName)
     if ret != expect:
-        error_quit("Return value (" + str(
-            ret) + ") of " + command + " " + testingFileName + " doesn't match expected value (" + str(
-            expect) + "), even though no changes were made. Aborting!\n")
+        error_quit("Return value (" + str(ret) + ") of " + command + " " + testingFileName
+                   + " doesn't match expected value (" + str(expect)
+                   + "), even though no changes were made. Aborting!\n")
+os.remove(testingFileName)
 
 if last < 0:
     last = n_original_lines
@@ -412,108 +436,47 @@ if first >= n_original_lines:
     error_quit("First line to minimize was " + str(first) + ", but file only has " + str(
         n_original_lines) + " lines, aborting.")
 
-changed = True
-round = 0
-nremoved = 0
-num_left = last - first
-
-disabledSet = set()
-# This executes a simple binary search, first removing half the lines at a time, then a quarter of the lines at a time, and so on until eventually individual lines are removed one-by-one.
-while changed:
-    changed = False
-    ntried = 0
-    round += 1
-    cur_removed = 0
-    nsize = last - first - nremoved
-    print_out("Round " + str(round) + ": Tried " + str(ntried) + ", Removed " + str(cur_removed) + "/" + str(nsize),
-              end='')
-
-    stride = num_left if not linear else 1
-    while stride >= 1:
-        nfound = 0
-        disabledSet.clear()
-        for i in range(first, last) if not backward else range(first, last)[::-1]:
-            if enabled[i]:
-                nfound += 1
-                disabledSet.add(i)
-                enabled[i] = False
-                if nfound == stride:
-                    nfound = 0
-                    ntried += 1
-                    writeTo(testingFileName)
-                    if m_difftest:
-                        ret = run_diff(testingFileName)
-                        if ret:  # diff
-                            changed = True
-                            writeTo(outfile)
-                            num_enabled -= len(disabledSet)
-                            num_left -= len(disabledSet)
-                            nremoved += len(disabledSet)
-                            cur_removed += len(disabledSet)
-                            disabledSet.clear()
-                        else:
-                            for p in disabledSet:
-                                enabled[p] = True
-                            disabledSet.clear()
-                    else:
-                        run_res = False
-                        if args.match_err:  # match stderr
-                            run_res = run_stderr(testingFileName)
-                        else:  # match only exist code
-                            ret = run(testingFileName)
-                            if ret == expect: run_res = True
-
-                        if run_res:
-                            changed = True
-                            writeTo(outfile)
-                            num_enabled -= len(disabledSet)
-                            num_left -= len(disabledSet)
-                            nremoved += len(disabledSet)
-                            cur_removed += len(disabledSet)
-                            disabledSet.clear()
-                        else:
-                            for p in disabledSet:
-                                enabled[p] = True
-                            disabledSet.clear()
-                    print_out("\rRound " + str(round) + ": Tried " + str(ntried) + ", Removed " + str(
-                        cur_removed) + "/" + str(nsize), end='')
-
-        # If there are any remaining elements in the disabled set, then test them here.
-        if len(disabledSet) > 0:
-            nfound = 0
-            ntried += 1
-            writeTo(testingFileName)
-            ret = run(testingFileName)
-            if ret == expect:
-                changed = True
-                writeTo(outfile)
-                num_enabled -= len(disabledSet)
-                num_left -= len(disabledSet)
-                nremoved += len(disabledSet)
-                cur_removed += len(disabledSet)
-                disabledSet.clear()
-            else:
-                for p in disabledSet:
-                    enabled[p] = True
-                disabledSet.clear()
-
-            print_out(
-                "\rRound " + str(round) + ": Tried " + str(ntried) + ", Removed " + str(cur_removed) + "/" + str(nsize),
-                end='')
 
-        assert len(disabledSet) == 0
-        if stride == 1:
-            break
+def print_progress(dd):
+    # A new round starts with nothing tried yet; finish the previous round's line first.
+    if dd.round > 1 and dd.round_tried == 0:
+        print_out("")
+    print_out("\rRound " + str(dd.round) + ": Tried " + str(dd.round_tried) + ", Removed " + str(
+        dd.round_removed) + "/" + str(dd.round_size), end='')
 
-        stride = stride // 2
-        assert (stride > 0)
 
-    print_out("\rRound " + str(round) + ": Tried " + str(ntried) + ", Removed " + str(cur_removed) + "/" + str(nsize),
-              end='\n')
+# This executes a simple binary search, first removing half the lines at a time, then a quarter of
+# the lines at a time, and so on until eventually individual lines are removed one-by-one. See
+# pafuzz.reducer.engine.
+if use_mmap:
+    line_sizes = [line_offsets[l + 1] - line_offsets[l] for l in range(n_original_lines)]
+    input_hash = hashlib.sha1(original_file[:]).hexdigest()
+else:
+    line_sizes = [len(line) for line in original_lines]
+    input_hash = hashlib.sha1(b"".join(original_lines)).hexdigest()
+
+reducer = DeltaReducer(n_original_lines, interesting, first=first, last=last, reverse=backward,
+                       linear=linear, jobs=args.jobs, on_update=lambda e: writeTo(outfile, e),
+                       on_progress=print_progress, unit_sizes=line_sizes, unit_name='lines',
+                       state_file=args.state, progress_file=args.progress,
+                       checkpoint_interval=args.checkpoint_interval,
+                       input_id=input_hash + ":" + str(first) + ":" + str(last),
+                       strategy=args.strategy)
+if args.state and os.path.exists(args.state):
+    try:
+        reducer.load_state()
+    except (ValueError, KeyError) as e:
+        error_quit("Cannot resume from " + args.state + ": " + str(e))
+    print_out("Resuming from " + args.state + ": round " + str(reducer.round) + ", " + str(
+        reducer.num_enabled) + " lines left, " + str(len(reducer.cache)) + " cached probes")
+    writeTo(outfile, reducer.enabled)
+enabled = reducer.reduce()
+print_out("")
+num_enabled = reducer.num_enabled
+nremoved = reducer.removed
 
 # just in case this file got over-written at some point.
-writeTo(outfile)
-os.remove(testingFileName)
+writeTo(outfile, enabled)
 if original_open_file is not None:
     original_open_file.close()
 print("Done. Kept " + str(num_enabled) + " lines, removed " + str(nremoved) + "/" + str(
@@ -0,0 +1,372 @@
+"""
+Oracles deciding whether a reduced candidate is still interesting.
+
+The crash buckets used here are the ones the fuzz-pta campaign saves crashes
+under, so a reduction started from a saved crash keeps hunting the same bug.
+DiffPTAOracle does the same for points-to inconsistencies between analyses.
+"""
+
+import hashlib
+import os
+import re
+import signal
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Timer
+from typing import Dict, FrozenSet, List, Optional, Tuple, Union
+
+# Output markers that make fuzz-pta treat an analyzer run as a crash
+ERROR_PATTERNS = ['Assertion', 'Sanitizer', 'PrintStackTrace', 'Segment']
+
+_ASSERT_RE = re.compile(r"([^\s:]+):(\d+):.*Assertion\s.*failed")
+_SANITIZER_RE = re.compile(r"ERROR: (\w+Sanitizer): ([\w-]+)")
+# A frame's function runs up to its "+0x" offset, its "(module+0x...)" or its
+# "file:line" source location; demangled C++ names contain spaces themselves
+_FRAME_END = r"(?=\+0x[0-9a-fA-F]+| \([^()]*\+0x[0-9a-fA-F]+\)| \S+:\d+|\s*$)"
+_SANITIZER_FRAME_RE = re.compile(r"#\d+ 0x[0-9a-fA-F]+ in (.+?)" + _FRAME_END, re.M)
+_STACK_FRAME_RE = re.compile(r"#\d+ 0x[0-9a-fA-F]+ (?:in )?(?!\([^()]*\+0x)(.+?)" + _FRAME_END,
+                             re.M)
+
+# Frames printed by the crash handlers themselves rather than by the bug
+_HANDLER_FRAMES = ('llvm::sys::PrintStackTrace', 'PrintStackTraceSignalHandler',
+                   'llvm::sys::RunSignalHandlers', 'SignalHandler', '__restore_rt',
+                   '__sanitizer', '__asan', '__ubsan', 'raise', 'abort', 'gsignal')
+
+
+def has_error(output: str) -> bool:
+    """Check whether analyzer output contains any crash marker."""
+    return any(pattern in output for pattern in ERROR_PATTERNS)
+
+
+def _first_frame(output: str, frame_re) -> Optional[str]:
+    for match in frame_re.finditer(output):
+        frame = match.group(1)
+        if not frame.startswith(_HANDLER_FRAMES):
+            return frame
+    return None
+
+
+def crash_signature(output: str) -> Optional[str]:
+    """
+    Compute the crash bucket of an analyzer run.
+
+    Returns:
+        "assert:<file>:<line>" for assertion failures, "<sanitizer>:<kind>:<frame>"
+        for sanitizer reports, "crash:<frame>" for other crashes with a stack
+        trace, or None if the output does not look like a crash.
+    """
+    if not has_error(output):
+        return None
+
+    match = _ASSERT_RE.search(output)
+    if match:
+        return f"assert:{os.path.basename(match.group(1))}:{match.group(2)}"
+
+    match = _SANITIZER_RE.search(output)
+    if match:
+        frame = _first_frame(output, _SANITIZER_FRAME_RE) or "?"
+        return f"{match.group(1)}:{match.group(2)}:{frame}"
+
+    frame = _first_frame(output, _STACK_FRAME_RE)
+    return f"crash:{frame or '?'}"
+
+
+class CrashSignature:
+    """
+    What a crash must look like for a candidate to be interesting.
+
+    Every configured part must be seen in the captured output:
+        assertion: assertion location "<file>:<line>" (file compared by basename)
+        frame: function of the first stack frame below the crash handlers, as in
+               crash_signature(); the parameter list may be left out
+        regex: regular expression searched in the output
+    """
+
+    def __init__(self, assertion: Optional[str] = None, frame: Optional[str] = None,
+                 regex: Optional[str] = None):
+        if not (assertion or frame or regex):
+            raise ValueError("A crash signature needs an assertion location, a frame or a regex")
+        self.assertion = assertion
+        self.frame = frame
+        self.regex = re.compile(regex) if regex else None
+        self._frame_re = _STACK_FRAME_RE
+
+    @classmethod
+    def from_bucket(cls, bucket: str) -> 'CrashSignature':
+        """Build the signature that matches a crash_signature() bucket."""
+        kind, _, rest = bucket.partition(':')
+        if kind == 'assert':
+            return cls(assertion=rest)
+        if kind.endswith('Sanitizer'):
+            error, _, frame = rest.partition(':')
+            signature = cls(frame=None if frame in ('', '?') else frame,
+                            regex=re.escape(f"ERROR: {kind}: {error}"))
+            signature._frame_re = _SANITIZER_FRAME_RE
+            return signature
+        return cls(frame=None if rest in ('', '?') else rest,
+                   regex=r"PrintStackTrace|Segment|Sanitizer")
+
+    def _assertion_seen(self, line: str) -> bool:
+        match = _ASSERT_RE.search(line)
+        if not match:
+            return False
+        file, _, lineno = self.assertion.rpartition(':')
+        return (os.path.basename(match.group(1)) == os.path.basename(file)
+                and match.group(2) == lineno)
+
+    def _frame_seen(self, line: str) -> Optional[bool]:
+        """Whether the line's frame is in the expected function; None if it has no bug frame."""
+        match = self._frame_re.search(line)
+        if not match or match.group(1).startswith(_HANDLER_FRAMES):
+            return None
+        frame = match.group(1)
+        return frame == self.frame or frame.startswith(self.frame + '(')
+
+    def feed(self, line: str, seen: dict) -> bool:
+        """Account for one more output line. Returns True once every part has been seen."""
+        if self.assertion and not seen.get('assertion'):
+            seen['assertion'] = self._assertion_seen(line)
+        if self.frame and 'frame' not in seen:
+            # Only the first frame below the crash handlers decides, later ones are callers
+            frame_seen = self._frame_seen(line)
+            if frame_seen is not None:
+                seen['frame'] = frame_seen
+        if self.regex and not seen.get('regex'):
+            seen['regex'] = bool(self.regex.search(line))
+        return self.complete(seen)
+
+    def complete(self, seen: dict) -> bool:
+        return ((not self.assertion or seen.get('assertion', False))
+                and (not self.frame or seen.get('frame', False))
+                and (not self.regex or seen.get('regex', False)))
+
+    def matches(self, output: str) -> bool:
+        """Check a complete captured output at once (also allows multi-line regexes)."""
+        seen = {}
+        for line in output.splitlines():
+            if self.feed(line, seen):
+                return True
+        if self.regex and self.regex.search(output):
+            seen['regex'] = True
+        return self.complete(seen)
+
+
+def _kill(process):
+    """Kill the child together with anything it spawned (it runs in its own session)."""
+    if process.poll() is None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass  # already gone
+
+
+class SignatureOracle:
+    """
+    Runs a command on a candidate and reports whether its output shows the crash signature.
+
+    The child's stderr (and optionally stdout) is read as it is produced, and the child is
+    killed as soon as the signature is complete, so probes do not wait for slow crash
+    handlers or core dumps. A probe that hits the timeout is not interesting.
+    """
+
+    def __init__(self, command: Union[str, List[str]], signature: CrashSignature,
+                 timeout: Optional[float] = 60, include_stdout: bool = False):
+        self.command = command
+        self.signature = signature
+        self.timeout = timeout
+        self.include_stdout = include_stdout
+
+    def run(self, filename: str) -> bool:
+        if isinstance(self.command, str):
+            cmd, shell = self.command + " " + filename, True
+        else:
+            cmd, shell = list(self.command) + [filename], False
+
+        process = subprocess.Popen(
+            cmd, shell=shell, stdin=subprocess.DEVNULL, start_new_session=True,
+            stdout=subprocess.PIPE if self.include_stdout else subprocess.DEVNULL,
+            stderr=subprocess.STDOUT if self.include_stdout else subprocess.PIPE)
+        stream = process.stdout if self.include_stdout else process.stderr
+
+        timed_out = [False]
+        timer = None
+        if self.timeout:
+            timer = Timer(self.timeout, lambda: timed_out.__setitem__(0, True) or _kill(process))
+            timer.start()
+
+        seen, captured, matched = {}, [], False
+        try:
+            for raw in stream:
+                line = raw.decode('utf-8', errors='ignore')
+                captured.append(line)
+                if self.signature.feed(line, seen):
+                    matched = True
+                    _kill(process)
+                    break
+            stream.close()
+            process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if matched:
+            return True
+        if timed_out[0]:
+            return False
+        return self.signature.matches(''.join(captured))
+
+
+_PTS_NAME_RE = re.compile(r"##<([^>]*)>")
+_PTS_RE = re.compile(r"^\s*(?:NodeID|Ptr)\s*:?\s*(\d+)\b.*?PointsTo:?\s*\{([^}]*)\}")
+
+PointsTo = Dict[str, FrozenSet[str]]
+# (index of analysis a, index of analysis b, direction, pointer); direction is
+# "<" if only b has extra pointees, ">" if only a has, "<>" if both have
+Discrepancy = Tuple[int, int, str, str]
+
+
+def parse_points_to(output: str) -> PointsTo:
+    """
+    Normalize `wpa --print-pts` style output into {pointer: pointees}.
+
+    Pointers are keyed by value name when the analysis prints one ("##<name>"),
+    else by node id. Statistics, timings and ordering are dropped, so two runs
+    that agree on every points-to set compare equal.
+    """
+    result: Dict[str, FrozenSet[str]] = {}
+    name = None
+    for line in output.splitlines():
+        match = _PTS_NAME_RE.search(line)
+        if match:
+            name = match.group(1) or None
+        match = _PTS_RE.search(line)
+        if match:
+            key = f"{name}#{match.group(1)}" if name else f"#{match.group(1)}"
+            result[key] = frozenset(match.group(2).split())
+            name = None
+    return result
+
+
+def diff_points_to(results: List[PointsTo]) -> FrozenSet[Discrepancy]:
+    """All pairwise discrepancies between the normalized results of several analyses."""
+    found = set()
+    for a in range(len(results)):
+        for b in range(a + 1, len(results)):
+            for ptr in results[a].keys() | results[b].keys():
+                pts_a = results[a].get(ptr, frozenset())
+                pts_b = results[b].get(ptr, frozenset())
+                if pts_a == pts_b:
+                    continue
+                direction = ">" if pts_b <= pts_a else "<" if pts_a <= pts_b else "<>"
+                found.add((a, b, direction, ptr))
+    return frozenset(found)
+
+
+def _run_captured(cmd: List[str], timeout: Optional[float]) -> Optional[Tuple[int, str]]:
+    """Run a command to completion; returns (returncode, stdout+stderr) or None on timeout."""
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, start_new_session=True)
+    try:
+        output = process.communicate(timeout=timeout)[0]
+    except subprocess.TimeoutExpired:
+        _kill(process)
+        process.communicate()
+        return None
+    return process.returncode, output.decode('utf-8', errors='ignore')
+
+
+class DiffPTAOracle:
+    """
+    Runs two or more pointer analyses on a candidate and checks that they still disagree.
+
+    The analyses run concurrently. Their output is normalized with parse_points_to()
+    and cached by candidate content, so a candidate that is produced twice (or an
+    analysis shared between several oracles) is never analyzed again. Runs that
+    crash or time out make the candidate uninteresting: this oracle reduces
+    inconsistencies, not crashes.
+
+    The discrepancy to preserve is set with `target` (usually the discrepancy of the
+    original input, see discrepancy()). Node ids shift while the input shrinks, so a
+    disagreement is matched on the pair of analyses, its direction and the pointer's
+    source name; unnamed pointers match on pair and direction only. With loose, named
+    pointers are matched that way too, and with match_pointer only disagreements on
+    that pointer count.
+    """
+
+    def __init__(self, tools: List[str], timeout: Optional[float] = 600,
+                 compile_cmd: Optional[str] = None, match_pointer: Optional[str] = None,
+                 jobs: int = 1, cache_size: int = 256, loose: bool = False):
+        if len(tools) < 2:
+            raise ValueError("Differential testing needs at least two analyses")
+        self.tools = [tool.split() for tool in tools]
+        self.timeout = timeout
+        self.compile_cmd = compile_cmd.split() if compile_cmd else None
+        self.match_pointer = match_pointer
+        self.loose = loose
+        self.target: Optional[FrozenSet[Discrepancy]] = None
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[bytes, Optional[List[PointsTo]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Enough workers for every analysis of `jobs` concurrent candidates
+        self._pool = ThreadPoolExecutor(max_workers=len(self.tools) * max(jobs, 1))
+
+    def _analyze_one(self, tool: List[str], bitcode: str) -> Optional[PointsTo]:
+        result = _run_captured(tool + [bitcode], self.timeout)
+        if result is None or result[0] != 0 or has_error(result[1]):
+            return None
+        return parse_points_to(result[1])
+
+    def analyze(self, filename: str) -> Optional[List[PointsTo]]:
+        """Normalized results of every analysis, or None if one of them failed."""
+        with open(filename, 'rb') as f:
+            key = hashlib.sha1(f.read()).digest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        bitcode, tmp = filename, None
+        if self.compile_cmd:
+            fd, tmp = tempfile.mkstemp(suffix='.bc')
+            os.close(fd)
+            result = _run_captured(self.compile_cmd + [filename, '-o', tmp], self.timeout)
+            bitcode = tmp if result is not None and result[0] == 0 else None
+        try:
+            results = None
+            if bitcode is not None:
+                results = list(self._pool.map(lambda tool: self._analyze_one(tool, bitcode),
+                                              self.tools))
+                if any(r is None for r in results):
+                    results = None
+        finally:
+            if tmp:
+                os.remove(tmp)
+
+        with self._lock:
+            self._cache[key] = results
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return results
+
+    def discrepancy(self, filename: str) -> FrozenSet[Discrepancy]:
+        results = self.analyze(filename)
+        if results is None:
+            return frozenset()
+        return diff_points_to(results)
+
+    def _relevant(self, discrepancies: FrozenSet[Discrepancy]) -> FrozenSet[Tuple]:
+        if self.match_pointer:
+            return frozenset(d[:3] + (self.match_pointer,) for d in discrepancies
+                             if d[3].rpartition('#')[0] == self.match_pointer)
+        if self.loose:
+            return frozenset(d[:3] for d in discrepancies)
+        return frozenset(d[:3] + (d[3].rpartition('#')[0],) for d in discrepancies)
+
+    def run(self, filename: str) -> bool:
+        found = self._relevant(self.discrepancy(filename))
+        if self.target is None:
+            return bool(found)
+        return bool(found) and self._relevant(self.target) <= found
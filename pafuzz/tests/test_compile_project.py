@@ -0,0 +1,209 @@
+"""
+This file contains tests for compiling multi-file (YARPGen) programs to one bitcode module,
+with and without the trace_icall pass.
+"""
+
+import os
+import re
+import shutil
+import stat
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from pafuzz.generators.config import config
+from pafuzz.generators.genbc import compile_artifacts, compile_project
+
+# Stands in for clang++: emits one function per translation unit and logs every compile
+FAKE_CLANGXX = """#!/bin/sh
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -o) out="$2"; shift ;;
+    *.cpp) tu="$1" ;;
+  esac
+  shift
+done
+name=$(basename "$tu" .cpp)
+echo "$tu" >> "$(dirname "$0")/compiles.log"
+echo "define i32 @f_$name() { ret i32 0 }" | llvm-as -o "$out"
+"""
+
+# Stands in for clang++ on units that are written in LLVM IR
+FAKE_IR_CLANGXX = """#!/bin/sh
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -o) out="$2"; shift ;;
+    *.cpp) tu="$1" ;;
+  esac
+  shift
+done
+llvm-as "$tu" -o "$out"
+"""
+
+# An indirect call in both units, and an indirect invoke in driver.cpp
+TRACED_UNITS = {
+    "driver": """define i32 @run(i32 ()* %p) personality i32 (...)* @__gxx_personality_v0 {
+  %a = call i32 %p()
+  %b = invoke i32 %p() to label %ok unwind label %lp
+ok:
+  ret i32 %b
+lp:
+  %l = landingpad { i8*, i32 } cleanup
+  resume { i8*, i32 } %l
+}
+declare i32 @__gxx_personality_v0(...)
+""",
+    "func": """define i32 @apply(i32 (i32)* %f) {
+  %r = call i32 %f(i32 1)
+  ret i32 %r
+}
+""",
+}
+
+PASS_SOURCE = Path(__file__).resolve().parents[2] / "instrument" / "trace_icall.cpp"
+
+
+@unittest.skipUnless(shutil.which("llvm-as") and shutil.which("llvm-link"),
+                     "needs llvm-as and llvm-link")
+class TestCompileProject(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.clang = self.root / "clang++"
+        self.clang.write_text(FAKE_CLANGXX)
+        self.clang.chmod(self.clang.stat().st_mode | stat.S_IEXEC)
+        self.program = self.root / "yarpgen_7"
+        self.program.mkdir()
+        for name in ("driver", "func"):
+            (self.program / f"{name}.cpp").write_text(f'#include "init.h"\n// {name}\n')
+        (self.program / "init.h").write_text("extern int x;\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def compiles(self):
+        log = self.root / "compiles.log"
+        return len(log.read_text().splitlines()) if log.exists() else 0
+
+    def test_units_are_linked_and_cached(self):
+        cache = str(self.root / "cache")
+        artifacts = compile_project(str(self.program), clang_path=str(self.clang), cache_dir=cache)
+        self.assertTrue(artifacts.ok, artifacts.errors)
+        self.assertEqual(artifacts.bitcode, f"{self.program}.bc")
+        module = subprocess.run(["llvm-dis", artifacts.bitcode, "-o", "-"],
+                                capture_output=True, text=True).stdout
+        self.assertIn("@f_driver", module)
+        self.assertIn("@f_func", module)
+        self.assertEqual(sorted(os.listdir(self.program)), ["driver.cpp", "func.cpp", "init.h"])
+        self.assertEqual(self.compiles(), 2)
+
+        # Same program and flags: only the link runs
+        artifacts = compile_project(str(self.program), clang_path=str(self.clang), cache_dir=cache)
+        self.assertTrue(artifacts.ok, artifacts.errors)
+        self.assertEqual(self.compiles(), 2)
+        self.assertNotIn("bitcode:func.cpp", artifacts.timings)
+
+        # Other flags, or a changed header, compile again
+        compile_project(str(self.program), flags=["-O1"], clang_path=str(self.clang),
+                        cache_dir=cache)
+        self.assertEqual(self.compiles(), 4)
+        (self.program / "init.h").write_text("extern long x;\n")
+        compile_project(str(self.program), clang_path=str(self.clang), cache_dir=cache)
+        self.assertEqual(self.compiles(), 6)
+
+    def test_failed_unit(self):
+        (self.program / "broken.cpp").write_text("")
+        self.clang.write_text(FAKE_CLANGXX.replace(
+            'name=', '[ "$(basename "$tu")" = broken.cpp ] && exit 1\nname='))
+        artifacts = compile_project(str(self.program), clang_path=str(self.clang), cache_dir="")
+        self.assertFalse(artifacts.ok)
+        self.assertIn("bitcode:broken.cpp", artifacts.errors)
+        self.assertIsNone(artifacts.bitcode)
+        self.assertFalse(any(p.suffix == ".bc" for p in self.program.iterdir()))
+
+
+@unittest.skipUnless(all(map(shutil.which, ("g++", "llvm-config", "llvm-as", "llvm-link", "opt"))),
+                     "needs g++ and the LLVM tools")
+class TestTracedProject(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.plugin = os.path.join(cls.tmp.name, "trace_icall.so")
+        cxxflags = subprocess.run(["llvm-config", "--cxxflags"], capture_output=True, text=True,
+                                  check=True).stdout
+        subprocess.run(["g++", *cxxflags.split(), "-fPIC", "-shared", "-o", cls.plugin,
+                        str(PASS_SOURCE)], check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_linked_module_is_instrumented_once(self):
+        root = Path(self.tmp.name)
+        clang = root / "clang++"
+        clang.write_text(FAKE_IR_CLANGXX)
+        clang.chmod(clang.stat().st_mode | stat.S_IEXEC)
+        program = root / "yarpgen_3"
+        program.mkdir()
+        for name, unit in TRACED_UNITS.items():
+            (program / f"{name}.cpp").write_text(unit)
+
+        artifacts = compile_project(str(program), clang_path=str(clang), cache_dir="",
+                                    trace_pass=self.plugin)
+        self.assertTrue(artifacts.ok, artifacts.errors)
+        self.assertIn("instrument", artifacts.timings)
+        module = subprocess.run(["llvm-dis", artifacts.bitcode, "-o", "-"],
+                                capture_output=True, text=True).stdout
+        # The calls and the invoke, numbered across both units: one site table for the program
+        sites = sorted(map(int, re.findall(
+            r"@__afl_trace_indirect_call\(.*, i32 (\d+), i8\* %func_ptr", module)))
+        self.assertEqual(sites, [0, 1, 2])
+        self.assertEqual(module.count("@__afl_site_state = internal global [3 x"), 1)
+        # Shapes leave out names, but tell the invoke from the call and calls of other types apart
+        shapes = re.search(r"@__afl_site_shapes = private constant \[3 x i32\] \[(.*)\]",
+                           module).group(1)
+        shapes = [int(shape.split()[1]) for shape in shapes.split(",")]
+        self.assertNotIn(0, shapes)
+        self.assertEqual(len(set(shapes)), 3)
+        self.assertEqual(sorted(os.listdir(root)),
+                         ["clang++", "trace_icall.so", "yarpgen_3", "yarpgen_3.bc"])
+
+
+class TestUbsanBuild(unittest.TestCase):
+    """Compile failures of the UBSan build are cached; timeouts are not."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.saved = {"SAN_COMPILE_TIMEOUT": config.SAN_COMPILE_TIMEOUT,
+                      "USE_PCH": config.get("USE_PCH", True)}
+        config.update({"SAN_COMPILE_TIMEOUT": 0.5, "USE_PCH": False})
+
+    def tearDown(self):
+        config.update(self.saved)
+        self.tmp.cleanup()
+
+    def verdicts(self, script: str, source: str):
+        clang = self.root / "clang"
+        clang.write_text(f'#!/bin/sh\necho x >> "{self.root}/compiles.log"\n{script}\n')
+        clang.chmod(clang.stat().st_mode | stat.S_IEXEC)
+        c_file = self.root / "prog.c"
+        c_file.write_text(source)
+        verdicts = [compile_artifacts(str(c_file), bitcode=False, ubsan=True, clang_path=str(clang),
+                                      csmith_runtime=str(self.root)).ub_verdict for _ in range(2)]
+        compiles = len((self.root / "compiles.log").read_text().splitlines())
+        (self.root / "compiles.log").unlink()
+        return verdicts, compiles
+
+    def test_timeout_is_not_cached(self):
+        self.assertEqual(self.verdicts("sleep 5", f"int main() {{ return {os.getpid()}; }}"),
+                         ([3, 3], 2))
+
+    def test_compile_error_is_cached(self):
+        self.assertEqual(self.verdicts("exit 1", f"int main() {{ return -{os.getpid()}; }}"),
+                         ([2, 2], 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+This file contains tests for the function-pointer-dense generation profile.
+"""
+
+import re
+import unittest
+
+from pafuzz.generators.fptr import count_indirect_calls, make_fptr_dense, parse_functions
+
+# Shaped like csmith output: forward declarations, then unindented headers and indented bodies
+PROGRAM = """#include "csmith.h"
+
+struct S0 {
+   int32_t  f0;
+};
+
+static int32_t g_2 = 1L;
+static struct S0 g_9 = {3L};
+
+/* --- FORWARD DECLARATIONS --- */
+static int32_t  func_1(void);
+static uint8_t  func_3(int32_t  p_4, int32_t * p_6);
+static int32_t * func_7(struct S0  p_8);
+static uint8_t  func_12(int32_t  p_13, int32_t * p_14);
+
+/* --- FUNCTIONS --- */
+static int32_t  func_1(void)
+{
+    g_2 = (uint16_t)(func_3(g_2, func_7(g_9)) + func_12(1, &g_2));
+    return (int8_t)(g_2);
+}
+
+static uint8_t  func_3(int32_t  p_4, int32_t * p_6)
+{
+    return (*p_6) + ((uint8_t)p_4);
+}
+
+static int32_t * func_7(struct S0  p_8)
+{
+    return &g_2;
+}
+
+static uint8_t  func_12(int32_t  p_13, int32_t * p_14)
+{
+    return func_3(p_13, p_14) ^ 1;
+}
+
+int main (void)
+{
+    func_1();
+    return 0;
+}
+"""
+
+
+class TestFptrProfile(unittest.TestCase):
+    def test_parse_signatures(self):
+        functions = parse_functions(PROGRAM)
+        self.assertEqual(functions['func_3'], ('uint8_t', ('int32_t', 'int32_t *')))
+        self.assertEqual(functions['func_7'], ('int32_t *', ('struct S0',)))
+        self.assertEqual(functions['func_1'], ('int32_t', ()))
+
+    def test_casts_are_not_calls(self):
+        self.assertEqual(count_indirect_calls(PROGRAM), 0)
+        calls = "x = ops[i](1); y = s->f(2); z = (*fp)(3); w = get(1)(4);"
+        self.assertEqual(count_indirect_calls(calls), 4)
+
+    def test_all_direct_calls_become_indirect(self):
+        dense = make_fptr_dense(PROGRAM, seed=3)
+        self.assertEqual(dense, make_fptr_dense(PROGRAM, seed=3))
+        body = dense[dense.index('/* --- FUNCTIONS --- */'):]
+        self.assertNotRegex(body, r'(?m)^[ \t].*\bfunc_\d+\s*\(')
+        self.assertIn('fp_tab_1[2] = {func_3, func_12}', dense)
+        self.assertIn('fp_decoy_', dense)
+        # 5 call sites, fp_call_N(func_M, ...) trampoline sites included
+        self.assertEqual(count_indirect_calls(dense), 5)
+
+    def test_only_used_helpers_are_emitted(self):
+        for seed in range(6):
+            dense = make_fptr_dense(PROGRAM, seed)
+            body = dense[dense.index('/* --- FUNCTIONS --- */'):]
+            helpers = set(re.findall(r'\b(fp_(?:tab|get|call)_\d+|fp_boxp?_func_\d+)\b', dense))
+            self.assertTrue(helpers)
+            for helper in helpers:
+                # fp_box_func_N may be used only through its fp_boxp_func_N
+                users = rf'\b({helper}|{helper.replace("fp_box_", "fp_boxp_")})\b'
+                self.assertRegex(body, users, f"seed {seed}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+"""
+This file contains tests for the generation pipeline: batch generation, the
+background program pool, timed-out commands, swarm selection, size targeting
+and seed allocation.
+"""
+
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from pafuzz.generators.corpus import Corpus
+from pafuzz.generators.csmith import CsmithGenerator, GeneratedProgram
+from pafuzz.generators.fptr import FptrGenerator
+from pafuzz.generators.pool import ProgramPool
+from pafuzz.generators.seeds import MAX_SEED, SeedAllocator, campaign_stats
+from pafuzz.generators.sizing import SizeBand, SizeController
+from pafuzz.generators.swarm import SwarmSelector
+from pafuzz.generators.utils import run_cmd
+from pafuzz.generators.yarpgen import YarpgenGenerator
+
+# Sleeps in a child process too, which must be killed with the parent on timeout
+SLEEPER = ("import subprocess, sys, time; "
+           "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)']); "
+           "time.sleep(30)")
+
+def _claim_all(log: str, worker_id: int) -> int:
+    """Claim seeds 1-200 with the same configuration; the number of claims won."""
+    with SeedAllocator(worker_id=worker_id, log_path=log) as allocator:
+        return sum(allocator.claim(seed, {"pointers": True}) for seed in range(1, 201))
+
+
+class FakeGenerator(CsmithGenerator):
+    """Writes a placeholder file instead of running csmith; odd seeds fail."""
+
+    def generate(self, output_file, seed=None, *args, **kwargs):
+        if seed % 2:
+            return False
+        Path(output_file).write_text(f"int main() {{ return {seed}; }}\n")
+        return True
+
+
+class TestProgramPool(unittest.TestCase):
+    def test_generate_batch(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            programs = FakeGenerator().generate_batch(6, tmp_dir, seeds=range(10, 20), jobs=3)
+            self.assertEqual([p.seed for p in programs], [10, 12, 14])
+            self.assertTrue(all(p.source.exists() for p in programs))
+            self.assertEqual(len(os.listdir(tmp_dir)), 3)
+
+    def test_producers_block_when_full(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pool = ProgramPool(FakeGenerator(), tmp_dir, capacity=2, jobs=2,
+                               seeds=range(0, 40, 2), check_ub=False, bitcode=False)
+            with pool:
+                time.sleep(0.3)
+                self.assertEqual(pool.ready, 2)
+                # two in the queue, plus at most one finished program per blocked producer
+                self.assertLessEqual(len(os.listdir(tmp_dir)), 4)
+                taken = list(pool)
+            self.assertEqual(sorted(p.seed for p in taken), list(range(0, 40, 2)))
+            self.assertTrue(pool.exhausted)
+            self.assertIsInstance(taken[0], GeneratedProgram)
+
+    def test_close_removes_untaken_programs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with ProgramPool(FakeGenerator(), tmp_dir, capacity=3, jobs=1, check_ub=False,
+                             bitcode=False) as pool:
+                program = pool.get(timeout=5)
+                time.sleep(0.2)
+            self.assertEqual(os.listdir(tmp_dir), [program.source.name])
+
+
+class TestRunCmd(unittest.TestCase):
+    def test_timeout_kills_process_group(self):
+        start = time.time()
+        self.assertEqual(run_cmd([sys.executable, "-c", SLEEPER], 0.5)[0], 124)
+        self.assertLess(time.time() - start, 10)
+
+
+class TestSwarmSelection(unittest.TestCase):
+    def test_isolated_and_reproducible(self):
+        generator = CsmithGenerator()
+        random.seed(7)
+        expected = random.random()
+        random.seed(7)
+        first = generator.swarm_config(42)
+        self.assertEqual(random.random(), expected)
+        self.assertEqual(generator.swarm_config(42), first)
+        self.assertGreaterEqual(sum(first.values()), len(CsmithGenerator.SWARM_FEATURES) // 3)
+
+    def test_bandit_prefers_productive_features(self):
+        selector = SwarmSelector(["pointers", "volatiles", "unions"], min_enabled=0)
+        for _ in range(50):
+            selector.record({"pointers": True, "volatiles": False, "unions": True}, True)
+            selector.record({"pointers": False, "volatiles": True, "unions": True}, False)
+        rng = random.Random(1)
+        configs = [selector.sample(rng) for _ in range(100)]
+        self.assertGreater(sum(c["pointers"] for c in configs), 90)
+        self.assertLess(sum(c["volatiles"] for c in configs), 10)
+        self.assertGreater(selector.productivity()["pointers"], 0.5)
+
+    def test_save_merges(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "swarm.json")
+            a = SwarmSelector(["arrays"], state_file=path)
+            b = SwarmSelector(["arrays"], state_file=path)
+            a.record({"arrays": True}, True)
+            b.record({"arrays": False}, False)
+            a.save()
+            b.save()
+            self.assertEqual(SwarmSelector(["arrays"], state_file=path).stats["arrays"],
+                             [1, 0, 0, 1])
+
+
+class TestCorpus(unittest.TestCase):
+    def test_draws_from_productive_programs(self):
+        features = ["pointers", "volatiles", "unions", "arrays"]
+        found = {"pointers": True, "volatiles": False, "unions": True, "arrays": False}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = Path(tmp_dir, "csmith_5.c")
+            source.write_text("int main(void) { return 0; }\n")
+            directory = os.path.join(tmp_dir, "corpus")
+            corpus = Corpus(directory, SwarmSelector(features, min_enabled=2), explore=0.0)
+            self.assertIsNone(corpus.add(GeneratedProgram(6, source, swarm=found), 0))
+            self.assertEqual(corpus.add(GeneratedProgram(5, source, swarm=found), 4).patterns, 4)
+
+            rng = random.Random(3)
+            configs = [corpus.sample(rng) for _ in range(200)]
+            # As found, or with one feature flipped, but never below the floor of two
+            self.assertTrue(all(sum(c[f] != found[f] for f in features) <= 1 for c in configs))
+            self.assertTrue(all(sum(c.values()) >= 2 for c in configs))
+            self.assertGreater(configs.count(found), 50)
+            self.assertEqual(len(Corpus(directory, SwarmSelector(features))), 1)
+            self.assertTrue(os.path.exists(os.path.join(directory, "csmith_5.c")))
+
+
+class SizedFakeGenerator(CsmithGenerator):
+    """Program length grows with the number of functions, like csmith's."""
+
+    def generate(self, output_file, seed=None, functions=5, swarm=True, check_ub=False,
+                 min_size=None, **kwargs):
+        Path(output_file).write_text("int x;\n" * (functions * 100))
+        return min_size == 0 or functions * 100 >= (min_size or 0)
+
+
+class TestSizeTargeting(unittest.TestCase):
+    def test_controller_steers_into_band(self):
+        controller = SizeController(SizeBand(min_bytes=0, min_loc=2000, max_loc=4000), functions=10)
+        generator = SizedFakeGenerator(size_controller=controller)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            programs = [generator.generate_program(tmp_dir, seed, swarm=False)
+                        for seed in range(1, 6)]
+        self.assertTrue(all(programs))
+        self.assertTrue(20 <= controller.knobs()['functions'] <= 40)
+        self.assertEqual(controller.accepted, 5)
+        self.assertGreater(controller.rejected[-1], 0)
+
+
+class TestSeedAllocation(unittest.TestCase):
+    def test_workers_do_not_overlap(self):
+        a, b = SeedAllocator(node_id=1, worker_id=0), SeedAllocator(node_id=1, worker_id=1)
+        seeds_a = [a.next_seed() for _ in range(100)]
+        seeds_b = [b.next_seed() for _ in range(100)]
+        self.assertFalse(set(seeds_a) & set(seeds_b))
+        self.assertTrue(all(0 < seed <= MAX_SEED for seed in seeds_a + seeds_b))
+
+    def test_seeds_fit_generators(self):
+        last = SeedAllocator(node_id=63, worker_id=63)
+        last._counter = last._counter_mask - 1
+        self.assertEqual(last.next_seed(), MAX_SEED)
+        with self.assertRaises(RuntimeError):
+            last.next_seed()
+        with self.assertRaises(ValueError):
+            SeedAllocator(node_id=64)
+        wide = SeedAllocator(node_id=1000, worker_id=5, node_bits=10, worker_bits=4)
+        self.assertLessEqual(wide.next_seed(), MAX_SEED)
+
+    def test_tested_pairs_are_skipped_across_restarts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log = os.path.join(tmp_dir, "seeds.log")
+            with SeedAllocator(worker_id=3, log_path=log) as allocator:
+                generator = FakeGenerator(seed_allocator=allocator)
+                # FakeGenerator fails odd seeds; those were tried all the same
+                programs = generator.generate_batch(8, tmp_dir)
+                self.assertEqual(len(programs), 4)
+                last_seed = programs[-1].seed
+
+            with SeedAllocator(worker_id=3, log_path=log) as allocator:
+                # The counter resumes after the logged seeds
+                self.assertGreater(allocator.next_seed(), last_seed)
+                generator = FakeGenerator(seed_allocator=allocator)
+                again = generator.generate_batch(4, tmp_dir, seeds=[p.seed for p in programs])
+                self.assertEqual(again, [])
+                self.assertEqual(allocator.duplicate_rate, 1.0)
+                # Another swarm configuration of a tested seed is still new
+                self.assertTrue(allocator.claim(last_seed, {"pointers": False}))
+
+            stats = campaign_stats(log)
+            self.assertEqual((stats['claims'], stats['duplicates']), (13, 4))
+
+    def test_concurrent_processes_claim_each_pair_once(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log = os.path.join(tmp_dir, "seeds.log")
+            with multiprocessing.get_context("fork").Pool(4) as pool:
+                won = pool.starmap(_claim_all, [(log, w) for w in range(4)])
+            self.assertEqual(sum(won), 200)
+            self.assertEqual(campaign_stats(log)['claims'], 800)
+
+    def test_claim_covers_profile_knobs_and_drawn_seeds(self):
+        allocator = SeedAllocator()
+        swarm = {"pointers": True}
+        self.assertTrue(allocator.claim(7, CsmithGenerator().claim_config(swarm)))
+        self.assertTrue(allocator.claim(7, FptrGenerator().claim_config(swarm)))
+        self.assertTrue(allocator.claim(7, CsmithGenerator().claim_config(swarm, functions=9)))
+        self.assertFalse(allocator.claim(7, CsmithGenerator().claim_config(swarm, check_ub=True)))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csmith = os.path.join(tmp_dir, "csmith")
+            Path(csmith).write_text("#!/bin/sh\necho 'int main(void) { return 0; }'\n")
+            os.chmod(csmith, 0o755)
+            generator = CsmithGenerator(csmith_path=csmith, seed_allocator=allocator)
+            self.assertTrue(generator.generate(os.path.join(tmp_dir, "a.c"), min_size=0))
+            self.assertEqual(allocator.claims, 5)
+
+    def test_refused_seed_keeps_existing_program(self):
+        allocator = SeedAllocator()
+        self.assertTrue(allocator.claim(5, YarpgenGenerator.claim_config(max_depth=3)))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            earlier = Path(tmp_dir) / "yarpgen_5" / "func.cpp"
+            earlier.parent.mkdir()
+            earlier.write_text("int f() { return 0; }\n")
+            generator = YarpgenGenerator(yarpgen_bin="false", seed_allocator=allocator)
+            self.assertIsNone(generator.generate_program(tmp_dir, 5, max_depth=3))
+            self.assertTrue(earlier.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,245 @@
+"""
+This file contains tests for the reducer engine and oracles.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from pafuzz.reducer.bcdd import (FIXED, breaks_dependency, split_instructions, split_top_level,
+                                 unit_dependencies)
+from pafuzz.reducer.engine import DeltaReducer
+from pafuzz.reducer.oracle import (CrashSignature, DiffPTAOracle, SignatureOracle, crash_signature,
+                                   diff_points_to, parse_points_to)
+
+IR = """; ModuleID = 'a.c'
+source_filename = "a.c"
+
+@g = global i32 0, align 4
+
+define i32 @f(i32 %x) {
+entry:
+  %y = add i32 %x, 1
+  switch i32 %y, label %done [
+    i32 0, label %done
+  ]
+done:
+  ret i32 %y
+}
+
+declare void @h()
+"""
+
+
+class TestDeltaReducer(unittest.TestCase):
+    def test_reduces_to_required_units(self):
+        required = {3, 17, 18}
+        reducer = DeltaReducer(40, lambda c: all(c[i] for i in required))
+        enabled = reducer.reduce()
+        self.assertEqual({i for i, e in enumerate(enabled) if e}, required)
+
+    def test_first_last_bounds(self):
+        reducer = DeltaReducer(10, lambda c: True, first=2, last=8)
+        enabled = reducer.reduce()
+        self.assertEqual([i for i, e in enumerate(enabled) if e], [0, 1, 8, 9])
+
+    def test_parallel_matches_sequential(self):
+        required = {0, 5, 6, 31}
+        lock = threading.Lock()
+        calls = []
+
+        def test(candidate):
+            with lock:
+                calls.append(bytes(candidate))
+            return all(candidate[i] for i in required)
+
+        sequential = DeltaReducer(32, test).reduce()
+        self.assertEqual(len(calls), len(set(calls)))
+        calls.clear()
+        parallel = DeltaReducer(32, test, jobs=4).reduce()
+        self.assertEqual(sequential, parallel)
+        # Memoized: no candidate reaches the oracle twice, even from concurrent probes
+        self.assertEqual(len(calls), len(set(calls)))
+
+    def test_memoization(self):
+        calls = []
+        reducer = DeltaReducer(8, lambda c: calls.append(1) or c[2] == 1, jobs=3)
+        reducer.reduce()
+        self.assertEqual(len(calls) + reducer.cache_hits, reducer.probes)
+        self.assertEqual(len(calls), len(reducer.cache))
+
+    def test_adaptive_is_one_minimal(self):
+        required = {40, 41, 97, 250}
+        regions = [i // 100 for i in range(300)]
+        for jobs in (1, 4):
+            reducer = DeltaReducer(300, lambda c: all(c[i] for i in required), jobs=jobs,
+                                   strategy='adaptive', regions=regions)
+            enabled = reducer.reduce()
+            self.assertEqual({i for i, e in enumerate(enabled) if e}, required)
+        with self.assertRaises(ValueError):
+            DeltaReducer(3, lambda c: True, strategy='random')
+
+    def test_adaptive_skips_failing_strides(self):
+        # No chunk of two or more units can ever be removed, so the second round skips those strides
+        required = set(range(0, 64, 2))
+        reducer = DeltaReducer(64, lambda c: all(c[i] for i in required), strategy='adaptive')
+        enabled = reducer.reduce()
+        self.assertEqual({i for i, e in enumerate(enabled) if e}, required)
+        self.assertEqual(reducer.round, 2)
+        self.assertGreater(reducer.skipped_strides, 0)
+        self.assertEqual(DeltaReducer(3, lambda c: True).strategy, 'ddmin')
+
+    def test_resume_from_checkpoint(self):
+        required = {4, 9, 22}
+
+        class Interrupt(Exception):
+            pass
+
+        calls = []
+
+        def interrupted(candidate):
+            if len(calls) == 6:
+                raise Interrupt()
+            calls.append(1)
+            return all(candidate[i] for i in required)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state = os.path.join(tmp_dir, "state.json")
+            progress = os.path.join(tmp_dir, "progress.json")
+            reducer = DeltaReducer(30, interrupted, state_file=state, progress_file=progress,
+                                   unit_sizes=[2] * 30, input_id="x")
+            with self.assertRaises(Interrupt):
+                reducer.reduce()
+
+            resumed_calls = []
+            resumed = DeltaReducer(30,
+                                   lambda c: resumed_calls.append(1) or all(c[i] for i in required),
+                                   state_file=state, progress_file=progress,
+                                   unit_sizes=[2] * 30, input_id="x")
+            resumed.load_state()
+            enabled = resumed.reduce()
+            self.assertEqual({i for i, e in enumerate(enabled) if e}, required)
+            self.assertGreater(resumed.cache_hits, 0)
+
+            with open(progress) as f:
+                report = json.load(f)
+            self.assertTrue(report['done'])
+            self.assertEqual(report['units_left'], 3)
+            self.assertEqual(report['bytes'], 6)
+
+            with self.assertRaises(ValueError):
+                DeltaReducer(30, lambda c: True, input_id="y").load_state(state)
+
+
+class TestOracle(unittest.TestCase):
+    def test_assertion_signature(self):
+        out = "wpa: /home/work/SVF/include/Graphs/VFG.h:417: void f(): Assertion `x' failed.\n"
+        self.assertEqual(crash_signature(out), "assert:VFG.h:417")
+
+    def test_sanitizer_signature(self):
+        out = ("==1==ERROR: AddressSanitizer: heap-use-after-free on address 0x1\n"
+               "    #0 0x4f2 in SVF::PAG::getNode(unsigned int) PAG.h:12\n")
+        self.assertEqual(crash_signature(out),
+                         "AddressSanitizer:heap-use-after-free:SVF::PAG::getNode(unsigned int)")
+        self.assertTrue(CrashSignature.from_bucket(crash_signature(out)).matches(out))
+
+    def test_stack_frame_names(self):
+        out = ("Stack dump:\n"
+               " #0 0x55d1 llvm::sys::PrintStackTrace(llvm::raw_ostream&, int) (/bin/wpa+0x1d1)\n"
+               " #1 0x55d2 (/bin/wpa+0x2e2)\n"
+               " #2 0x55d3 f(std::function<void (int)>, std::vector<int> const&) /src/a.cpp:3:1\n")
+        self.assertEqual(crash_signature(out),
+                         "crash:f(std::function<void (int)>, std::vector<int> const&)")
+
+    def test_no_crash(self):
+        self.assertIsNone(crash_signature("NodeID: 1\n"))
+
+    def test_signature_from_bucket(self):
+        signature = CrashSignature.from_bucket("assert:VFG.h:417")
+        self.assertTrue(signature.matches("wpa: /x/VFG.h:417: void f(): Assertion `x' failed.\n"))
+        self.assertFalse(signature.matches("wpa: /x/VFG.h:418: void f(): Assertion `x' failed.\n"))
+
+    def test_frame_is_first_bug_frame(self):
+        out = ("Stack dump:\n"
+               " #0 0x55d1 llvm::sys::PrintStackTrace(llvm::raw_ostream&, int) (/bin/wpa+0x1d1)\n"
+               " #1 0x55d2 SVF::PAG::getNodeID(int) /src/PAG.h:40:3\n"
+               " #2 0x55d3 SVF::PAG::getNode(int) /src/PAG.h:12:5\n")
+        self.assertFalse(CrashSignature(frame="SVF::PAG::getNode").matches(out))
+        self.assertTrue(CrashSignature(frame="SVF::PAG::getNodeID").matches(out))
+        self.assertTrue(CrashSignature.from_bucket(crash_signature(out)).matches(out))
+
+    def test_oracle_kills_on_match(self):
+        script = "import sys, time; sys.stderr.write(\"a.cpp:3: f: Assertion `x' failed.\\n\"); " \
+                 "sys.stderr.flush(); time.sleep(30)"
+        oracle = SignatureOracle([sys.executable, "-c", script],
+                                 CrashSignature(assertion="a.cpp:3"), timeout=20)
+        start = time.time()
+        self.assertTrue(oracle.run("unused"))
+        self.assertLess(time.time() - start, 10)
+
+    def test_oracle_timeout(self):
+        oracle = SignatureOracle([sys.executable, "-c", "import time; time.sleep(30)"],
+                                 CrashSignature(regex="never"), timeout=0.5)
+        self.assertFalse(oracle.run("unused"))
+
+
+class TestDiffPTA(unittest.TestCase):
+    LANDER = ("##<p> Source Loc: ln: 3\nPtr 7 \t\tPointsTo: { 9 8 }\n\n"
+              "Ptr 10 \t\tPointsTo: { }\nTime: 1.0\n")
+    WANDER = ("##<p> Source Loc: ln: 3\nPtr 7 \t\tPointsTo: { 8 }\n\n"
+              "Ptr 10 \t\tPointsTo: { }\nTime: 2.0\n")
+
+    def test_parse_normalizes(self):
+        self.assertEqual(parse_points_to(self.LANDER),
+                         {"p#7": frozenset({"8", "9"}), "#10": frozenset()})
+
+    def test_diff_direction(self):
+        results = [parse_points_to(self.LANDER), parse_points_to(self.WANDER)]
+        self.assertEqual(diff_points_to(results), frozenset({(0, 1, ">", "p#7")}))
+        self.assertEqual(diff_points_to(results[:1] * 2), frozenset())
+
+    def test_relevant_matches_pointer_names(self):
+        oracle = DiffPTAOracle(["lander", "wander"])
+        oracle.target = frozenset({(0, 1, ">", "p#7"), (0, 1, "<", "#10")})
+        oracle.discrepancy = lambda _: frozenset({(0, 1, ">", "q#3"), (0, 1, "<", "#4")})
+        self.assertFalse(oracle.run("unused"))
+        oracle.discrepancy = lambda _: frozenset({(0, 1, ">", "p#3"), (0, 1, "<", "#4")})
+        self.assertTrue(oracle.run("unused"))
+        oracle.loose = True
+        oracle.discrepancy = lambda _: frozenset({(0, 1, ">", "q#3"), (0, 1, "<", "#4")})
+        self.assertTrue(oracle.run("unused"))
+
+
+class TestBitcodeSplitting(unittest.TestCase):
+    def test_top_level_entities(self):
+        lines = IR.splitlines(keepends=True)
+        units = split_top_level(lines)
+        self.assertEqual([lines[u[0]].split()[0] for u in units], ['@g', 'define', 'declare'])
+        self.assertEqual(lines[units[1][-1]], '}\n')
+
+    def test_instructions_skip_terminators(self):
+        lines = IR.splitlines(keepends=True)
+        units = split_instructions(lines)
+        self.assertEqual([lines[u[0]].strip() for u in units], ['%y = add i32 %x, 1'])
+
+    def test_dependencies(self):
+        lines = IR.splitlines(keepends=True)
+        units = split_instructions(lines)
+        self.assertEqual(unit_dependencies(lines, units), {0: {FIXED}})
+        self.assertTrue(breaks_dependency({0: {FIXED}}, bytearray([0])))
+
+        lines = (IR + '@p = global ptr @f, c"@h %y"\n').splitlines(keepends=True)
+        units = split_top_level(lines)
+        users = unit_dependencies(lines, units)
+        self.assertEqual(users, {1: {3}})
+        self.assertTrue(breaks_dependency(users, bytearray([1, 0, 1, 1])))
+        self.assertFalse(breaks_dependency(users, bytearray([1, 0, 1, 0])))
+        self.assertFalse(breaks_dependency(users, bytearray([1, 1, 0, 1])))
+
+
+if __name__ == "__main__":
+    unittest.main()
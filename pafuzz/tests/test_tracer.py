@@ -0,0 +1,437 @@
+"""
+This file contains tests for the indirect call trace readers and the logging modes of the runtime.
+"""
+
+import importlib.util
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from pafuzz.tracer.coverage import CoverageMap, run_covered
+from pafuzz.tracer.edges import callsite_targets
+from pafuzz.tracer.reader import (TRACE_MAGIC, function_id, read_edge_table, read_trace,
+                                  trace_segments)
+from pafuzz.tracer.soundness import (build_traced, campaign_jobs, check_observed, find_unsound,
+                                     load_static_callsites, run_traced)
+from pafuzz.tracer.store import TraceStore
+
+RUNTIME = Path(__file__).resolve().parents[2] / "instrument" / "runtime.cpp"
+LOG_ANALYZER = Path(__file__).resolve().parents[2] / "fuzz-cg" / "log_analyzer.py"
+
+# An SVF call graph log, as fuzz-cg/log_analyzer.py parses it
+SVF_LOG = """NodeID: 7
+CallSite:   call void %5(i32 1), !dbg !20\tLocation: { ln: 12 fl: /src/a.c }\t with Targets: 
+\tf
+\tg
+
+NodeID: 9
+CallSite:   call void %8(), !dbg !31\tLocation: { ln: 30 fl: /src/a.c }\t with Targets: 
+\th
+
+"""
+
+# Calls the runtime the way instrumented code does, from two threads; with "fork",
+# a child forked while the worker runs makes calls of its own; with "big", calls
+# come from site IDs above 65536 too; with "sampled", site 3 calls add 1000 times,
+# sub once and add 1000 times more through the pass's inline check. Registers add
+# (ADD_ID is defined when compiling) but not sub, and the strings and shapes of
+# sites 0 and 1, like the pass would.
+HARNESS = r"""
+#include <pthread.h>
+#include <stdlib.h>
+#include <sys/wait.h>
+#include <unistd.h>
+void __afl_log_indirect_call(int, void *, char *, char *);
+char *__afl_resolve_function_name(void *);
+void __afl_trace_indirect_call(void *, int, void *, char *);
+int add(int a) { return a + 1; }
+int sub(int a) { return a - 1; }
+int (*fps[2])(int) = {add, sub};
+struct function_entry { void *address; unsigned long long id; const char *name; unsigned shape; };
+void __afl_register_functions(const void *, unsigned long long);
+void __afl_register_sites(const char *, const unsigned *, const unsigned *, unsigned long long);
+static const char site_strings[] = "main:h.c:10:3\0worker:h.c:20:5";
+static const unsigned site_offsets[] = {0, 14}, site_shapes[] = {11, 12};
+__attribute__((constructor(1))) static void register_module(void) {
+    static struct function_entry table[] = {{(void *)add, ADD_ID, "add", 7}};
+    __afl_register_sites(site_strings, site_offsets, site_shapes, 2);
+    __afl_register_functions(table, 1);
+}
+static char main_site[] = "main:h.c:10:3", worker_site[] = "worker:h.c:20:5",
+            child_site[] = "child:h.c:30:7", big_site[] = "big:h.c:40:9",
+            sampled_site[] = "sampled:h.c:50:11";
+struct site_state { void *last; unsigned countdown, hits; } sampled_state;
+void sampled_call(int (*fp)(int)) {
+    if (sampled_state.countdown && sampled_state.last == (void *)fp)
+        sampled_state.countdown--;
+    else
+        __afl_trace_indirect_call(&sampled_state, 3, (void *)fp, sampled_site);
+}
+void *worker(void *arg) {
+    for (int i = 0; i < 30000; i++)
+        __afl_log_indirect_call(1, (void *)fps[1], worker_site,
+                                __afl_resolve_function_name((void *)fps[1]));
+    return 0;
+}
+int main(int argc, char **argv) {
+    pthread_t thread;
+    pthread_create(&thread, 0, worker, 0);
+    for (int i = 0; i < 20000; i++)
+        __afl_log_indirect_call(0, (void *)fps[i & 1], main_site,
+                                __afl_resolve_function_name((void *)fps[i & 1]));
+    if (argc > 1 && argv[1][0] == 'f') {
+        pid_t child = fork();
+        if (child == 0) {
+            for (int i = 0; i < 5; i++)
+                __afl_log_indirect_call(2, (void *)fps[0], child_site,
+                                        __afl_resolve_function_name((void *)fps[0]));
+            return 0;
+        }
+        waitpid(child, 0, 0);
+    }
+    pthread_join(thread, 0);
+    if (argc > 1 && argv[1][0] == 'b') {
+        for (int i = 0; i < 3; i++)
+            __afl_log_indirect_call(70000 + (i << 20), (void *)fps[1], big_site,
+                                    __afl_resolve_function_name((void *)fps[1]));
+        return 0;
+    }
+    if (argc > 1 && argv[1][0] == 's') {
+        for (int i = 0; i < 2001; i++)
+            sampled_call(fps[i == 1000]);
+        return 0;
+    }
+    if (argc > 1 && argv[1][0] == 'c')
+        abort();
+    while (argc > 1 && argv[1][0] != 'f')
+        ;
+    return 0;
+}
+"""
+
+
+def chunk(tag: bytes, payload: bytes) -> bytes:
+    return tag + struct.pack('<I', len(payload)) + payload
+
+
+class TestTraceReader(unittest.TestCase):
+    def test_binary_and_text_logs_agree(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            binary = os.path.join(tmp_dir, "trace.bin")
+            with open(binary, 'wb') as f:
+                f.write(TRACE_MAGIC + struct.pack('<II', 1, 16))
+                f.write(chunk(b'RECS', struct.pack('<QIIQII', 0x1000, 0, 0, 0x2000, 3, 1)))
+                f.write(chunk(b'SITE', struct.pack('<II', 0, 6) + b'main:1' +
+                              struct.pack('<II', 3, 4) + b'f:12'))
+                f.write(chunk(b'SYMS', struct.pack('<QI', 0x1000, 3) + b'add' +
+                              struct.pack('<QI', 0x2000, 3) + b'sub'))
+                f.write(chunk(b'RECS', struct.pack('<QII', 0x1000, 0, 0))[:-4])  # killed mid-write
+            text = os.path.join(tmp_dir, "trace.log")
+            with open(text, 'w') as f:
+                f.write("# AFL Indirect Call Log\n0|main:1|0x1000|add\n3|f:12|0x2000|sub\n")
+
+            from_binary, from_text = read_trace(binary), read_trace(text)
+            self.assertFalse(from_binary.complete)
+            self.assertEqual([(c.call_site_id, c.caller, c.target, c.target_name)
+                              for c in from_binary.calls()],
+                             [(c.call_site_id, c.caller, c.target, c.target_name)
+                              for c in from_text.calls()])
+            self.assertEqual(from_binary.edges(), {0: {'add': 1}, 3: {'sub': 1}})
+
+
+class TestTraceStore(unittest.TestCase):
+    def test_ingest_and_query(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            binary = os.path.join(tmp_dir, "trace.bin")
+            with open(binary, 'wb') as f:
+                f.write(TRACE_MAGIC + struct.pack('<II', 1, 16))
+                f.write(chunk(b'RECS', struct.pack('<QIIQIIQII', 0x1000, 0, 0, 0x2000, 3, 1,
+                                                   0x1000, 0, 1)))
+                f.write(chunk(b'SITE', struct.pack('<II', 0, 8) + b'main:a:1' +
+                              struct.pack('<II', 3, 6) + b'f:a:12'))
+                f.write(chunk(b'SYMS', struct.pack('<QI', 0x1000, 3) + b'add' +
+                              struct.pack('<QI', 0x2000, 3) + b'sub'))
+            text = os.path.join(tmp_dir, "trace.log")
+            with open(text, 'w') as f:
+                f.write("# AFL Indirect Call Log\n0|main:a:1|0x1000|add\n0|main:a:1|0x3000|mul\n")
+            path = os.path.join(tmp_dir, "store")
+
+            store = TraceStore(path)
+            self.assertEqual(store.ingest(binary, program="p1"), 2)
+            self.assertEqual(store.ingest(text, program="p2"), 2)
+            with self.assertRaises(ValueError):
+                store.ingest(text, program="p2")
+            with open(os.path.join(path, "site.u32"), 'ab') as f:
+                f.write(b'\0\0')  # interrupted append
+
+            store = TraceStore(path)
+            self.assertEqual(store.rows, 4)
+            self.assertEqual(store.edge_counts(), {("main:a:1", "add"): 3, ("main:a:1", "mul"): 1,
+                                                   ("f:a:12", "sub"): 1})
+            self.assertEqual(store.edge_counts("p2"),
+                             {("main:a:1", "add"): 1, ("main:a:1", "mul"): 1})
+            self.assertEqual(store.site_targets("p1"), {"main:a:1": {"add"}, "f:a:12": {"sub"}})
+            self.assertEqual(store.edge_programs()[("main:a:1", "add")], 2)
+            self.assertEqual(store.callsite_targets(),
+                             {("a", 1): {"add", "mul"}, ("a", 12): {"sub"}})
+            self.assertEqual(list(store.column("count")), [1, 2, 1, 1])
+
+
+@unittest.skipUnless(shutil.which("g++") and shutil.which("gcc"), "needs g++ and gcc")
+class TestRuntimeModes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        runtime = os.path.join(cls.tmp.name, "runtime.so")
+        harness = os.path.join(cls.tmp.name, "h.c")
+        cls.exe = os.path.join(cls.tmp.name, "h")
+        Path(harness).write_text(HARNESS)
+        subprocess.run(["g++", "-fPIC", "-O2", "-shared", "-o", runtime, str(RUNTIME), "-ldl",
+                        "-lpthread", "-lrt"], check=True)
+        subprocess.run(["gcc", "-rdynamic", f"-DADD_ID={function_id('add'):#x}ULL", "-o", cls.exe,
+                        harness, runtime, "-lpthread"], check=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def run_harness(self, log_format, *args, **env):
+        trace_file = os.path.join(self.tmp.name, f"trace.{log_format}")
+        env = dict(os.environ, AFL_INDIRECT_CALL_FORMAT=log_format,
+                   AFL_INDIRECT_CALL_LOG=trace_file, **env)
+        result = subprocess.run([self.exe, *args], env=env, capture_output=True, text=True)
+        self.assertEqual(result.stderr, "")
+        return result.returncode, trace_file
+
+    def test_binary_trace(self):
+        returncode, trace_file = self.run_harness("binary")
+        self.assertEqual(returncode, 0)
+        trace = read_trace(trace_file)
+        self.assertTrue(trace.complete)
+        self.assertEqual(trace.edges(), {0: {'add': 10000, 'sub': 10000}, 1: {'sub': 30000}})
+        self.assertEqual(trace.sites, {0: "main:h.c:10:3", 1: "worker:h.c:20:5"})
+        threads = [{thread for _, site, thread in trace.records if site == s} for s in (0, 1)]
+        self.assertEqual([len(t) for t in threads], [1, 1])
+        self.assertNotEqual(threads[0], threads[1])
+        # add is registered and recorded by its ID; sub by its address
+        targets = {trace.target_name(target): target for target, _, _ in trace.records}
+        self.assertEqual(targets['add'], function_id('add'))
+        self.assertLess(targets['sub'], 1 << 63)
+
+    def test_text_log_from_threads(self):
+        returncode, trace_file = self.run_harness("text")
+        self.assertEqual(returncode, 0)
+        with open(trace_file) as f:
+            self.assertEqual(sum(1 for line in f if not line.startswith('#')), 50000)
+        self.assertEqual(read_trace(trace_file).edges(),
+                         {0: {'add': 10000, 'sub': 10000}, 1: {'sub': 30000}})
+
+    def test_forked_child_logs_to_own_segment(self):
+        for log_format in ("binary", "text"):
+            with self.subTest(log_format=log_format):
+                old_trace = os.path.join(self.tmp.name, f"trace.{log_format}")
+                for segment in trace_segments(old_trace)[1:]:
+                    os.remove(segment)
+                returncode, trace_file = self.run_harness(log_format, "fork")
+                self.assertEqual(returncode, 0)
+                segments = trace_segments(trace_file)
+                self.assertEqual(len(segments), 2)
+                self.assertEqual(read_trace(trace_file).edges(),
+                                 {0: {'add': 10000, 'sub': 10000}, 1: {'sub': 30000}})
+                self.assertEqual(read_trace(segments[1]).edges(), {2: {'add': 5}})
+                self.assertEqual(read_trace(trace_file, segments=True).edges(),
+                                 {0: {'add': 10000, 'sub': 10000}, 1: {'sub': 30000},
+                                  2: {'add': 5}})
+
+    def test_registered_and_large_site_ids(self):
+        big = {70000: {'sub': 1}, 70000 + (1 << 20): {'sub': 1}, 70000 + (2 << 20): {'sub': 1}}
+        for log_format in ("binary", "edges"):
+            with self.subTest(log_format=log_format):
+                returncode, trace_file = self.run_harness(log_format, "big")
+                self.assertEqual(returncode, 0)
+                trace = read_trace(trace_file)
+                self.assertEqual(trace.sites, {0: "main:h.c:10:3", 1: "worker:h.c:20:5",
+                                               **{site: "big:h.c:40:9" for site in big}})
+                if log_format == "binary":
+                    self.assertEqual(trace.edges(),
+                                     {0: {'add': 10000, 'sub': 10000}, 1: {'sub': 30000}, **big})
+                else:
+                    self.assertEqual({site for site, _ in trace.edge_set}, {0, 1, *big})
+
+    def test_sampled_site(self):
+        # Muted after 10 calls to known targets, then one call in 100; sub unmutes the site
+        limits = {"AFL_INDIRECT_CALL_STABLE": "10", "AFL_INDIRECT_CALL_SAMPLE": "100"}
+        for env, sampled in (({}, {'add': 2000, 'sub': 1}), (limits, {'add': 39, 'sub': 1})):
+            with self.subTest(env=env):
+                returncode, trace_file = self.run_harness("binary", "sampled", **env)
+                self.assertEqual(returncode, 0)
+                self.assertEqual(read_trace(trace_file).edges(),
+                                 {0: {'add': 10000, 'sub': 10000}, 1: {'sub': 30000}, 3: sampled})
+        returncode, trace_file = self.run_harness("edges", "sampled", AFL_INDIRECT_CALL_STABLE="10")
+        self.assertEqual(returncode, 0)
+        self.assertEqual(callsite_targets(read_trace(trace_file))[("h.c", 50)], {"add", "sub"})
+
+    def test_edge_set(self):
+        returncode, trace_file = self.run_harness("edges")
+        self.assertEqual(returncode, 0)
+        self.assertLess(os.path.getsize(trace_file), 512)
+        self.assertEqual(callsite_targets(read_trace(trace_file)),
+                         {("h.c", 10): {"add", "sub"}, ("h.c", 20): {"sub"}})
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "needs /dev/shm")
+    def test_edge_set_survives_crash(self):
+        name = f"pafuzz-test-{os.getpid()}"
+        try:
+            returncode, trace_file = self.run_harness("edges", "crash",
+                                                      AFL_INDIRECT_CALL_SHM=f"/{name}")
+            self.assertNotEqual(returncode, 0)
+            trace = read_trace(trace_file)
+            edges, dropped = read_edge_table(f"/dev/shm/{name}")
+            self.assertEqual(edges, trace.edge_set)
+            self.assertEqual((len(edges), dropped), (3, 0))
+        finally:
+            if os.path.exists(f"/dev/shm/{name}"):
+                os.remove(f"/dev/shm/{name}")
+
+    def test_timed_out_run_still_dumps_edges(self):
+        harness = os.path.join(self.tmp.name, "hang")
+        with open(harness, 'w') as f:
+            f.write(f'#!/bin/sh\nexec {self.exe} hang\n')
+        os.chmod(harness, 0o755)
+        observed = run_traced(harness, os.path.join(self.tmp.name, "hang.edges"), timeout=0.5)
+        self.assertEqual(observed, {("h.c", 10): {"add", "sub"}, ("h.c", 20): {"sub"}})
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "needs /dev/shm")
+    def test_coverage_map(self):
+        virgin = os.path.join(self.tmp.name, "virgin.map")
+        with CoverageMap(virgin) as coverage:
+            # (site shape, target shape): (11, 7), (11, 0) and (12, 0)
+            self.assertEqual(run_covered(self.exe, coverage, timeout=10), 0)
+            self.assertEqual(coverage.collect(), 3)
+            self.assertEqual(run_covered(self.exe, coverage, timeout=10), 0)
+            self.assertEqual(coverage.collect(), 0)
+            # Site 3 is not registered: (0, 7) and (0, 0) are new
+            returncode, log = self.run_harness("none", "sampled",
+                                               AFL_INDIRECT_CALL_COVERAGE=coverage.name)
+            self.assertEqual(returncode, 0)
+            self.assertFalse(os.path.exists(log))
+            self.assertEqual(coverage.collect(), 2)
+        with CoverageMap(virgin) as coverage:
+            self.assertEqual(coverage.seen, 5)
+
+
+@unittest.skipUnless(os.path.isdir("/dev/shm"), "needs /dev/shm")
+class TestCoverageMap(unittest.TestCase):
+    def test_processes_share_the_virgin_map(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            virgin = os.path.join(tmp_dir, "virgin.map")
+            with CoverageMap(virgin) as first, CoverageMap(virgin) as second:
+                first.shm.buf[3] = 1
+                second.shm.buf[3] = second.shm.buf[9] = 1
+                self.assertEqual((first.collect(), second.collect()), (1, 2))
+                first.save()
+                second.save()
+                first.save()
+                self.assertEqual((first.seen, second.seen), (2, 2))
+                second.shm.buf[9] = 1
+                self.assertEqual(second.collect(), 0)
+
+
+class TestSoundness(unittest.TestCase):
+    OBSERVED = {("a.c", 12): {"f", "g"}, ("a.c", 30): {"h"}}
+
+    def test_static_result_shapes(self):
+        shapes = [
+            {"callsites": [{"file": "/src/a.c", "line": 12, "pointsto": ["f", "g"]}]},
+            [{"file": "a.c", "line": 12, "targets": ["f", "g"]}],
+            {"/tmp/x/a.c:12": ["f", "g"]},
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i, shape in enumerate(shapes):
+                path = os.path.join(tmp_dir, f"{i}.json")
+                with open(path, 'w') as f:
+                    json.dump(shape, f)
+                self.assertEqual(load_static_callsites(path), {("a.c", 12): {"f", "g"}})
+
+    def test_log_analyzer_results(self):
+        # Keyed by the IR call site, location inside; PHASAR and CANARY entries have none
+        result = {
+            "call void %5(i32 1), !dbg !20": {"pointsto": ["f", "g"], "line": 12,
+                                              "file": "/src/a.c", "id": 7},
+            "call void %8(), !dbg !31": {"pointsto": ["h"], "line": 30, "file": "/src/a.c",
+                                         "id": 9},
+            "call void %9(), !dbg !40": {"pointsto": ["k"], "line": -1, "file": None, "id": 11},
+            "a.c:7": {"pointsto": ["h"]},
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "prog.SVF.json")
+            with open(path, 'w') as f:
+                json.dump(result, f)
+            self.assertEqual(load_static_callsites(path),
+                             {("a.c", 12): {"f", "g"}, ("a.c", 30): {"h"}, ("a.c", 7): {"h"}})
+            self.assertTrue(check_observed("a.c", self.OBSERVED, {"svf": path}).sound)
+
+            with open(path, 'w') as f:
+                json.dump({"call void %5(i32 1)": {"pointsto": ["f"]}}, f)
+            with self.assertRaises(ValueError):
+                load_static_callsites(path)
+
+    @unittest.skipUnless(importlib.util.find_spec("tqdm"), "fuzz-cg/log_analyzer.py needs tqdm")
+    def test_svf_log_through_log_analyzer(self):
+        spec = importlib.util.spec_from_file_location("log_analyzer", LOG_ANALYZER)
+        log_analyzer = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(log_analyzer)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log = os.path.join(tmp_dir, "prog.SVF.txt")
+            Path(log).write_text(SVF_LOG)
+            analyzer = log_analyzer.SVFLogAnalyzer(log)
+            analyzer.parse()
+            analyzer.print_to_json()
+            report = check_observed("a.c", self.OBSERVED, {"svf": log.replace("txt", "json")})
+        self.assertEqual((report.observed_sites, report.findings), (2, []))
+
+    def test_missing_targets_are_unsound(self):
+        findings = find_unsound(self.OBSERVED, {("a.c", 12): {"f"}, ("a.c", 40): {"h"}}, "tool")
+        self.assertEqual([(u.line, set(u.missing), u.site_reported) for u in findings],
+                         [(12, {"g"}, True), (30, {"h"}, False)])
+        static = {("a.c", 12): {"f", "g", "k"}, ("a.c", 30): {"h"}}
+        self.assertEqual(find_unsound(self.OBSERVED, static, "tool"), [])
+
+    def test_every_tool_is_checked(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sound = os.path.join(tmp_dir, "sound.json")
+            unsound = os.path.join(tmp_dir, "unsound.json")
+            with open(sound, 'w') as f:
+                json.dump({"a.c:12": ["f", "g"], "a.c:30": ["h", "k"]}, f)
+            with open(unsound, 'w') as f:
+                json.dump({"a.c:12": ["f"]}, f)
+            report = check_observed("a.c", self.OBSERVED, {"sound": sound, "unsound": unsound})
+        self.assertEqual((report.observed_sites, report.observed_edges), (2, 3))
+        self.assertEqual({u.tool for u in report.findings}, {"unsound"})
+        self.assertFalse(report.sound)
+
+    def test_campaign_jobs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results, sources = os.path.join(tmp_dir, "out", "prj"), os.path.join(tmp_dir, "src")
+            os.makedirs(results)
+            os.makedirs(sources)
+            Path(sources, "csmith_7.c").write_text("int main(void) { return 0; }\n")
+            for name in ("csmith_7.bc.SVF.all.json", "csmith_7.bc.DSA.all.json",
+                         "csmith_8.bc.SVF.all.json", "soundness.json"):
+                Path(results, name).write_text("{}")
+            jobs = campaign_jobs(os.path.join(tmp_dir, "out"), [sources])
+        self.assertEqual([(Path(source).name, sorted(tools)) for source, tools in jobs],
+                         [("csmith_7.c", ["DSA.all", "SVF.all"])])
+
+    def test_missing_runtime_is_a_build_error(self):
+        artifacts = build_traced("a.c", "a.out", pass_path="trace_icall.so", runtime_path="")
+        self.assertIn("TRACE_RUNTIME", artifacts.errors["build"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+This file contains tests for the undefined behavior filter.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pafuzz.generators.utils import UBVerdictCache, check_undefined_behavior
+
+CC = shutil.which("clang") or shutil.which("gcc")
+
+OVERFLOW = """#include <stdio.h>
+#include <unistd.h>
+int main(void) {
+    volatile int x = 2147483647;
+    x += 1;
+    printf("%d\\n", x);
+    fflush(stdout);
+    sleep(30);
+    return 0;
+}
+"""
+
+CLEAN = """#include <stdio.h>
+int main(void) { printf("checksum = 0\\n"); return 0; }
+"""
+
+
+@unittest.skipUnless(CC, "no C compiler available")
+class TestUBCheck(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, text):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_kills_on_first_report(self):
+        start = time.time()
+        verdict = check_undefined_behavior(self._write("ub.c", OVERFLOW), CC, self.tmp_dir,
+                                           use_cache=False)
+        self.assertEqual(verdict, 1)
+        self.assertLess(time.time() - start, 20)
+
+    def test_verdicts_are_cached(self):
+        cache_file = os.path.join(self.tmp_dir, "verdicts")
+        clean = self._write("clean.c", CLEAN)
+        cache = UBVerdictCache(cache_file)
+        self.assertEqual(check_undefined_behavior(clean, CC, self.tmp_dir, cache=cache), 0)
+        self.assertEqual(check_undefined_behavior(clean, CC, self.tmp_dir, cache=cache), 0)
+        self.assertEqual(cache.hits, 1)
+
+        broken = self._write("broken.c", "int main(void) { return }\n")
+        self.assertEqual(check_undefined_behavior(broken, CC, self.tmp_dir, cache=cache), 2)
+        self.assertEqual(len(UBVerdictCache(cache_file)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
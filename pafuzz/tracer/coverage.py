@@ -0,0 +1,150 @@
+"""
+Indirect call coverage as feedback for program generation.
+
+A traced program run with AFL_INDIRECT_CALL_COVERAGE=/<name> marks one byte of
+a MAP_SIZE bitmap in the shared memory object <name> for every (call site
+shape, target shape) pattern it executes. Shapes are what the trace_icall pass
+sees of a site and a target without their names (kind of call, function type,
+where the pointer was loaded from; linkage and type of the target), so a
+pattern found by one generated program is not new in the next one.
+
+CoverageMap creates the bitmap and reads it in place through the shared
+memory buffer (with NumPy if it is installed), and keeps the "virgin" map of
+the patterns seen so far, like AFL: collect() returns how many patterns of the
+last run were new and clears the bitmap for the next one.
+
+Several processes can share one virgin file: save() merges the patterns of
+this process into it under a file lock and picks up those the others saved.
+A pattern is thus new to the whole campaign, except that two processes can
+both count it between two of their saves.
+
+    coverage = CoverageMap('campaign/virgin.map')
+    run_covered('./program.traced', coverage, timeout=15)
+    if coverage.collect():
+        ...  # keep the program (pafuzz.generators.corpus.Corpus)
+"""
+
+import fcntl
+import logging
+import os
+import subprocess
+from multiprocessing import shared_memory
+from typing import Iterator, Optional
+
+from pafuzz.generators.utils import kill_process_group
+from pafuzz.tracer.soundness import STABLE_HITS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Must match kCoverageMapSize in instrument/runtime.cpp
+MAP_SIZE = 1 << 16
+_ZEROS = bytes(MAP_SIZE)
+
+
+class CoverageMap:
+    """A shared-memory pattern bitmap and the patterns seen so far."""
+
+    def __init__(self, virgin_file: Optional[str] = None):
+        """
+        Args:
+            virgin_file: File to load the patterns seen so far from, and save() them to
+        """
+        self.shm = shared_memory.SharedMemory(create=True, size=MAP_SIZE)
+        self.shm.buf[:MAP_SIZE] = _ZEROS
+        self.virgin_file = virgin_file
+        self.virgin = bytearray(MAP_SIZE)
+        if virgin_file and os.path.exists(virgin_file):
+            with open(virgin_file, 'rb') as f:
+                self.virgin[:] = f.read(MAP_SIZE).ljust(MAP_SIZE, b'\0')
+
+    @property
+    def name(self) -> str:
+        """The value of AFL_INDIRECT_CALL_COVERAGE for a run that writes to this map."""
+        return '/' + self.shm.name.lstrip('/')
+
+    @property
+    def seen(self) -> int:
+        """Number of distinct patterns seen so far."""
+        return MAP_SIZE - self.virgin.count(0)
+
+    def patterns(self) -> Iterator[int]:
+        """Indices of the bytes set by the runs since the last collect()."""
+        buf = self.shm.buf[:MAP_SIZE]
+        if numpy is not None:
+            yield from numpy.flatnonzero(numpy.frombuffer(buf, numpy.uint8)).tolist()
+            return
+        # Most of the map stays clear, so only the bytes of non-zero words are looked at
+        for word_index, word in enumerate(buf.cast('Q')):
+            if word:
+                start = word_index * 8
+                yield from (i for i in range(start, start + 8) if buf[i])
+
+    def collect(self) -> int:
+        """Count and remember the new patterns of the runs since the last call; clears the map."""
+        new = 0
+        found = False
+        for index in self.patterns():
+            found = True
+            if not self.virgin[index]:
+                self.virgin[index] = 1
+                new += 1
+        if found:
+            self.shm.buf[:MAP_SIZE] = _ZEROS
+        return new
+
+    def save(self, path: Optional[str] = None):
+        """Merge the patterns seen so far into path (default: the virgin file),
+        and take over the patterns other processes saved there."""
+        path = path or self.virgin_file
+        if not path:
+            return
+        with open(f"{path}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    saved = f.read(MAP_SIZE).ljust(MAP_SIZE, b'\0')
+                # Both maps hold 0 or 1 per byte, so a bitwise or merges them
+                merged = int.from_bytes(self.virgin, 'little') | int.from_bytes(saved, 'little')
+                self.virgin[:] = merged.to_bytes(MAP_SIZE, 'little')
+            tmp = f"{path}.tmp{os.getpid()}"
+            with open(tmp, 'wb') as f:
+                f.write(self.virgin)
+            os.replace(tmp, path)
+
+    def close(self):
+        """Save and remove the shared memory object."""
+        self.save()
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self) -> 'CoverageMap':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def run_covered(exe: str, coverage: CoverageMap, timeout: float) -> Optional[int]:
+    """
+    Run a traced program so that it marks its patterns in coverage, without writing a log.
+
+    Returns:
+        The program's exit status, or None if it timed out (the patterns of
+        the calls it made are in the map all the same)
+    """
+    env = dict(os.environ, AFL_INDIRECT_CALL_FORMAT='none',
+               AFL_INDIRECT_CALL_COVERAGE=coverage.name)
+    # New patterns need new (site, target) edges, which muted sites still report
+    env.setdefault('AFL_INDIRECT_CALL_STABLE', str(STABLE_HITS))
+    process = subprocess.Popen([exe], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, env=env, start_new_session=True)
+    try:
+        return process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        logging.debug(f"{exe} timed out")
+        kill_process_group(process)
+        process.wait()
+        return None
@@ -0,0 +1,53 @@
+"""
+Per-call-site target sets of an indirect call log.
+
+The runtime's call site ids are mapped to (file, line) through the caller
+strings ("<function>:<file>:<line>:<column>") the instrumentation pass embeds.
+Sites without debug information come out as ("unknown", 0) and are dropped.
+
+Static results do not share these ids. fuzz-cg/log_analyzer.py keys its call
+sites by the IR call instruction text and stores the debug location in "file"
+and "line" fields, which PHASAR and CANARY results lack. The two sides are
+therefore joined on (file base name, line) (see pafuzz.tracer.soundness). This
+is an approximation: calls on the same line share a key, and call sites
+without a location cannot be joined.
+"""
+
+from typing import Dict, NamedTuple, Set, Tuple
+
+from pafuzz.tracer.reader import Trace, read_trace
+
+SiteKey = Tuple[str, int]
+
+
+class CallSite(NamedTuple):
+    function: str
+    file: str
+    line: int
+    column: int
+
+
+def parse_site(caller: str) -> CallSite:
+    """Split a caller string; file names may contain ':'."""
+    function, _, rest = caller.partition(':')
+    file, line, column = (rest.rsplit(':', 2) + ['0', '0'])[:3] if rest else ('unknown', '0', '0')
+    try:
+        return CallSite(function, file, int(line), int(column))
+    except ValueError:
+        return CallSite(function, rest, 0, 0)
+
+
+def callsite_targets(trace: Trace) -> Dict[SiteKey, Set[str]]:
+    """(file, line) -> names of the functions called there at run time."""
+    targets: Dict[SiteKey, Set[str]] = {}
+    for site, target in trace.edge_pairs():
+        position = parse_site(trace.sites.get(site, 'unknown'))
+        if position.line == 0:
+            continue
+        targets.setdefault((position.file, position.line), set()).add(trace.target_name(target))
+    return targets
+
+
+def load_callsite_targets(path: str) -> Dict[SiteKey, Set[str]]:
+    """callsite_targets() of a log of any format."""
+    return callsite_targets(read_trace(path))
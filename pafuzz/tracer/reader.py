@@ -0,0 +1,298 @@
+"""
+Readers for the indirect call logs written by instrument/runtime.cpp.
+
+The runtime writes either a text log (one `call_site_id|caller_info|target_ptr|
+target_name` line per call) or, with AFL_INDIRECT_CALL_FORMAT=binary, a
+compact binary trace: fixed-size (target, site, thread) records written in
+bulk, followed by a table of call site strings and the target symbols
+resolved at exit. With AFL_INDIRECT_CALL_FORMAT=edges the binary file holds
+the distinct (call site, target) edges instead of the records.
+read_trace() accepts all of them and returns the same Trace, so consumers do
+not care which mode the program ran in. A forked child logs to a segment of
+its own, <log>.<pid>; read_trace(path, segments=True) merges them.
+
+Targets that the trace_icall pass registered are recorded by their stable
+function_id() instead of their address, and named by the pass's table, so
+the traces of different runs and builds agree on them despite ASLR.
+
+$python -m pafuzz.tracer.reader trace.bin    # prints the trace in the text format
+"""
+
+import argparse
+import logging
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+TRACE_MAGIC = b'AFLICT01'
+EDGE_TABLE_MAGIC = b'AFLEDG01'
+_HEADER = struct.Struct('<8sII')
+_CHUNK = struct.Struct('<4sI')
+_RECORD = struct.Struct('<QII')
+_SITE = struct.Struct('<II')
+_SYMBOL = struct.Struct('<QI')
+_EDGE = struct.Struct('<QII')
+_EDGE_TABLE = struct.Struct('<8sIIQQ')
+_SLOT_FULL = 2
+FUNCTION_ID_BIT = 1 << 63
+
+# (target address, call site id, thread index)
+Record = Tuple[int, int, int]
+
+# Kinds of the events of iter_binary_events()
+RECORDS, SITES, SYMBOLS, EDGES, TRUNCATED = 'records', 'sites', 'symbols', 'edges', 'truncated'
+
+
+def function_id(name: str) -> int:
+    """The stable ID the trace_icall pass gives an address-taken function (FNV-1a, top bit set)."""
+    value = 0xcbf29ce484222325
+    for byte in name.encode():
+        value = ((value ^ byte) * 0x100000001b3) & 0xffffffffffffffff
+    return value | FUNCTION_ID_BIT
+
+
+@dataclass(frozen=True)
+class IndirectCall:
+    """One logged indirect call."""
+    call_site_id: int
+    caller: str  # "<function>:<file>:<line>:<column>"
+    target: int  # function_id() of a registered target, else its address
+    target_name: str
+    thread: int = 0
+
+
+@dataclass
+class Trace:
+    """Decoded indirect call log."""
+    records: List[Record] = field(default_factory=list)
+    sites: Dict[int, str] = field(default_factory=dict)
+    symbols: Dict[int, str] = field(default_factory=dict)
+    # (site, target), edge set mode only
+    edge_set: Set[Tuple[int, int]] = field(default_factory=set)
+    complete: bool = True  # False if the log ends in the middle of a chunk
+
+    def calls(self) -> Iterator[IndirectCall]:
+        """The calls in log order (per thread; threads are interleaved in buffer-sized runs)."""
+        for target, site, thread in self.records:
+            yield IndirectCall(site, self.sites.get(site, 'unknown'), target,
+                               self.target_name(target), thread)
+
+    def edge_pairs(self) -> Set[Tuple[int, int]]:
+        """Distinct (call site id, target address) edges, in every mode."""
+        return self.edge_set | {(site, target) for target, site, _ in self.records}
+
+    def target_name(self, target: int) -> str:
+        return self.symbols.get(target, f"func_{target:#x}")
+
+    def edges(self) -> Dict[int, Dict[str, int]]:
+        """Call site id -> {target name: number of calls}."""
+        edges: Dict[int, Dict[str, int]] = {}
+        for call in self.calls():
+            targets = edges.setdefault(call.call_site_id, {})
+            targets[call.target_name] = targets.get(call.target_name, 0) + 1
+        return edges
+
+
+def _entries(payload: bytes, key: struct.Struct) -> Iterator[Tuple[int, str]]:
+    offset = 0
+    while offset + key.size <= len(payload):
+        value, length = key.unpack_from(payload, offset)
+        offset += key.size
+        yield value, payload[offset:offset + length].decode('utf-8', errors='replace')
+        offset += length
+
+
+def iter_chunks(path: str) -> Iterator[Tuple[Optional[bytes], bytes]]:
+    """
+    (tag, payload) of every chunk of a binary trace, reading one chunk at a time.
+
+    A trace that ends in the middle of a chunk (killed program) ends with a
+    (None, b'') pair instead.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        magic, version, record_size = (_HEADER.unpack(header) if len(header) == _HEADER.size
+                                       else (b'', 0, 0))
+        if magic != TRACE_MAGIC or record_size != _RECORD.size:
+            raise ValueError(f"{path}: not a version {version} indirect call trace")
+        while True:
+            header = f.read(_CHUNK.size)
+            if not header:
+                return
+            if len(header) < _CHUNK.size:
+                yield None, b''
+                return
+            tag, size = _CHUNK.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                yield None, b''
+                return
+            yield tag, payload
+
+
+def iter_binary_events(path: str) -> Iterator[Tuple[str, Iterator[tuple]]]:
+    """
+    Decode a binary trace one chunk at a time, as (kind, items) pairs:
+
+        RECORDS    (target, call site id, thread) records
+        SITES      (call site id, caller string) pairs
+        SYMBOLS    (target, name) pairs
+        EDGES      (call site id, target) edges of the edge set mode
+        TRUNCATED  no items; the trace ends in the middle of a chunk
+
+    The items of a chunk must be consumed before the next pair is requested.
+    Unknown chunks are skipped.
+    """
+    for tag, payload in iter_chunks(path):
+        if tag is None:
+            yield TRUNCATED, iter(())
+        elif tag == b'RECS':
+            yield RECORDS, _RECORD.iter_unpack(payload)
+        elif tag == b'SITE':
+            yield SITES, _entries(payload, _SITE)
+        elif tag == b'SYMS':
+            yield SYMBOLS, _entries(payload, _SYMBOL)
+        elif tag == b'EDGS':
+            yield EDGES, ((site, target) for target, site, _ in _EDGE.iter_unpack(payload))
+        else:
+            logging.debug(f"{path}: skipping unknown chunk {tag!r}")
+
+
+def read_binary_trace(path: str) -> Trace:
+    """Decode a binary trace. A truncated trace (killed program) yields the complete chunks."""
+    trace = Trace()
+    for kind, items in iter_binary_events(path):
+        if kind == RECORDS:
+            trace.records.extend(items)
+        elif kind == SITES:
+            trace.sites.update(items)
+        elif kind == SYMBOLS:
+            trace.symbols.update(items)
+        elif kind == EDGES:
+            trace.edge_set.update(items)
+        else:
+            trace.complete = False
+    if not trace.complete:
+        logging.warning(f"{path}: trace is truncated, the last calls are missing")
+    return trace
+
+
+def iter_text_log(path: str) -> Iterator[Tuple[int, str, int, str]]:
+    """(call site id, caller, target address, target name) of every line of a text log."""
+    with open(path, errors='replace') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            parts = line.rstrip('\n').split('|')
+            if len(parts) != 4:
+                continue
+            site, caller, target, name = parts
+            try:
+                address = int(target, 16) if target not in ('(nil)', '0') else 0
+                site = int(site)
+            except ValueError:
+                continue
+            yield site, caller, address, name
+
+
+def read_text_log(path: str) -> Trace:
+    """Decode a text log into the same Trace as a binary one."""
+    trace = Trace()
+    for site, caller, address, name in iter_text_log(path):
+        trace.records.append((address, site, 0))
+        trace.sites.setdefault(site, caller)
+        trace.symbols.setdefault(address, name)
+    return trace
+
+
+def read_edge_table(path: str) -> Tuple[Set[Tuple[int, int]], int]:
+    """
+    Read the live shared-memory edge set of a program run with AFL_INDIRECT_CALL_SHM.
+
+    Useful when the program was killed before it could dump the set; there are
+    no call site strings or symbols then, only ids and addresses.
+
+    Args:
+        path: The shared memory object, e.g. /dev/shm/<name>
+
+    Returns:
+        The (site, target) edges and the number of edges that did not fit
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, _, slots, dropped, _ = _EDGE_TABLE.unpack_from(data)
+    if magic != EDGE_TABLE_MAGIC:
+        raise ValueError(f"{path}: not an indirect call edge table")
+    table = data[_EDGE_TABLE.size:_EDGE_TABLE.size + slots * _EDGE.size]
+    edges = {(site, target) for target, site, state in _EDGE.iter_unpack(table)
+             if state == _SLOT_FULL}
+    return edges, dropped
+
+
+def trace_segments(path: str) -> List[str]:
+    """The log and the segments (<path>.<pid>) of the processes the program forked."""
+    directory, name = os.path.split(path)
+    pids = sorted(int(entry[len(name) + 1:]) for entry in os.listdir(directory or '.')
+                  if entry.startswith(name + '.') and entry[len(name) + 1:].isdigit())
+    return [path] + [f"{path}.{pid}" for pid in pids]
+
+
+def merge_traces(traces: Iterable[Trace]) -> Trace:
+    """
+    One trace of several processes.
+
+    Sites and symbols agree across processes forked from one program; thread
+    indices do not (a child's first thread has the index of the thread that forked).
+    """
+    merged = Trace()
+    for trace in traces:
+        merged.records.extend(trace.records)
+        merged.sites.update(trace.sites)
+        merged.symbols.update(trace.symbols)
+        merged.edge_set |= trace.edge_set
+        merged.complete &= trace.complete
+    return merged
+
+
+def is_binary_trace(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+
+def _read_one(path: str) -> Trace:
+    return read_binary_trace(path) if is_binary_trace(path) else read_text_log(path)
+
+
+def read_trace(path: str, segments: bool = False) -> Trace:
+    """Decode an indirect call log of either format, with segments also those of forked children."""
+    if segments:
+        return merge_traces(_read_one(segment) for segment in trace_segments(path))
+    return _read_one(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print an indirect call log in the text format")
+    parser.add_argument('trace', help='Log written by the instrumentation runtime')
+    parser.add_argument('--edges', action='store_true',
+                        help='Print call site -> target counts instead')
+    parser.add_argument('--segments', action='store_true',
+                        help='Include the logs of forked children')
+    args = parser.parse_args()
+
+    trace = read_trace(args.trace, segments=args.segments)
+    if args.edges and trace.edge_set:
+        for site, target in sorted(trace.edge_set):
+            print(f"{site}|{trace.sites.get(site, 'unknown')}|{trace.target_name(target)}")
+        return
+    if args.edges:
+        for site, targets in sorted(trace.edges().items()):
+            for name, count in sorted(targets.items()):
+                print(f"{site}|{trace.sites.get(site, 'unknown')}|{name}|{count}")
+        return
+    for call in trace.calls():
+        print(f"{call.call_site_id}|{call.caller}|{call.target:#x}|{call.target_name}")
+
+
+if __name__ == '__main__':
+    main()
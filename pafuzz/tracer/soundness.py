@@ -0,0 +1,337 @@
+"""
+Dynamic ground truth for call graph soundness.
+
+A call graph (or points-to) analysis is unsound if a target that a call site
+really called at run time is missing from the call site's static target set.
+The tracer gives the observed edges: the program is compiled with the
+trace_icall pass plugin, linked with the runtime and run in edge set mode. The
+observed edges are joined with each tool's static results on the debug
+location (file, line) of the call site, and every observed target missing
+from a static set is reported.
+
+Static results are JSON; any of these shapes is accepted (call site objects
+may name their targets "pointsto", "targets" or "callees"):
+
+    {"<IR call site>": {"pointsto": ["f", "g"], "file": "a.c", "line": 12}, ...}
+    {"callsites": [{"file": "a.c", "line": 12, "pointsto": ["f", "g"]}, ...]}
+    [{"file": "a.c", "line": 12, "pointsto": ["f", "g"]}, ...]
+    {"a.c:12": ["f", "g"], ...}
+
+The first is what fuzz-cg/log_analyzer.py writes. Call sites without a
+location (PHASAR and CANARY logs, or line -1) cannot be joined and are skipped.
+
+Locations are matched on the file's base name, since tools report absolute
+paths and debug information keeps the paths the compiler was given.
+
+$python -m pafuzz.tracer.soundness prog.c --static svf=svf.json sea=sea.json
+
+fuzz-cg/log_analyzer.py --soundness runs the check over a whole campaign (see
+campaign_jobs()).
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pafuzz.generators.config import config
+from pafuzz.generators.genbc import BITCODE_FLAGS, CompileArtifacts, pass_plugin_flags, run_step
+from pafuzz.generators.utils import kill_process_group
+from pafuzz.tracer.edges import SiteKey, callsite_targets
+from pafuzz.tracer.reader import read_trace
+
+TARGET_KEYS = ('pointsto', 'targets', 'callees')
+
+# Grace period for the runtime to dump its edge set after SIGTERM
+DUMP_GRACE = 2.0
+
+# Calls to known targets after which the runtime stops being called from a
+# call site (AFL_INDIRECT_CALL_STABLE); a call to a new target always reaches
+# it, so the edge set stays exact
+STABLE_HITS = 64
+
+
+@dataclass(frozen=True)
+class Unsoundness:
+    """Observed targets of a call site that a tool's static result misses."""
+    tool: str
+    file: str
+    line: int
+    missing: FrozenSet[str]
+    site_reported: bool  # False if the tool reported no targets at all for the site
+
+
+@dataclass
+class SoundnessReport:
+    """Result of checking one program against every tool."""
+    source: str
+    observed_sites: int = 0
+    observed_edges: int = 0
+    findings: List[Unsoundness] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def sound(self) -> bool:
+        return self.error is None and not self.findings
+
+    def to_json(self) -> dict:
+        return {
+            'source': self.source,
+            'error': self.error,
+            'observed_sites': self.observed_sites,
+            'observed_edges': self.observed_edges,
+            'findings': [{'tool': u.tool, 'file': u.file, 'line': u.line,
+                          'missing': sorted(u.missing), 'site_reported': u.site_reported}
+                         for u in self.findings],
+        }
+
+
+def site_key(file: str, line: int) -> SiteKey:
+    return os.path.basename(file), int(line)
+
+
+def _normalize(observed: Dict[SiteKey, Set[str]]) -> Dict[SiteKey, Set[str]]:
+    normalized: Dict[SiteKey, Set[str]] = {}
+    for (file, line), targets in observed.items():
+        normalized.setdefault(site_key(file, line), set()).update(targets)
+    return normalized
+
+
+def _location(key: str) -> Tuple[Optional[str], Optional[int]]:
+    file, _, line = key.rpartition(':')
+    return (file, int(line)) if file and line.isdigit() else (None, None)
+
+
+def _static_entries(data) -> Iterator[Tuple[Optional[str], Optional[int], List[str]]]:
+    if isinstance(data, dict) and isinstance(data.get('callsites'), list):
+        data = data['callsites']
+    if isinstance(data, list):
+        for entry in data:
+            targets = next((entry[k] for k in TARGET_KEYS if k in entry), [])
+            yield entry.get('file'), entry.get('line'), targets
+        return
+    for key, value in data.items():
+        if isinstance(value, dict):
+            file, line = value.get('file'), value.get('line')
+            if file is None or line is None:
+                file, line = _location(key)
+            yield file, line, next((value[k] for k in TARGET_KEYS if k in value), [])
+        else:
+            yield (*_location(key), value)
+
+
+def load_static_callsites(path: str) -> Dict[SiteKey, Set[str]]:
+    """
+    (file base name, line) -> static targets, from a tool's JSON result.
+
+    Raises:
+        ValueError: The result has call sites, but none with a location
+    """
+    with open(path) as f:
+        data = json.load(f)
+
+    sites: Dict[SiteKey, Set[str]] = {}
+    entries = skipped = 0
+    for file, line, targets in _static_entries(data):
+        entries += 1
+        if not file or line is None or int(line) < 1:
+            skipped += 1
+            continue
+        # DSA lists callees as " @f"
+        sites.setdefault(site_key(file, line), set()).update(
+            t.strip().lstrip('@') for t in targets if t.strip())
+    if entries and not sites:
+        raise ValueError(f"none of the {entries} call sites has a location")
+    if skipped:
+        logging.debug(f"{path}: skipped {skipped} call sites without a location")
+    return sites
+
+
+def find_unsound(observed: Dict[SiteKey, Set[str]], static: Dict[SiteKey, Set[str]],
+                 tool: str) -> List[Unsoundness]:
+    """Observed targets missing from the static targets of the same call site."""
+    findings = []
+    for key, targets in observed.items():
+        reported = static.get(key)
+        missing = targets - reported if reported is not None else targets
+        if missing:
+            findings.append(Unsoundness(tool, key[0], key[1], frozenset(missing),
+                                        reported is not None))
+    return sorted(findings, key=lambda u: (u.file, u.line))
+
+
+def build_traced(c_file: str, exe: str, clang_path: Optional[str] = None,
+                 csmith_runtime: Optional[str] = None, pass_path: Optional[str] = None,
+                 runtime_path: Optional[str] = None) -> CompileArtifacts:
+    """
+    Compile a program with the trace_icall pass and link it with the tracer runtime.
+
+    clang runs the pass as a plugin, so compiling, instrumenting and linking
+    take one clang invocation.
+
+    Returns:
+        Timing and error of the "build" step; if there is no error, the
+        traced program is at exe
+    """
+    clang = clang_path or config.CLANG
+    runtime = csmith_runtime or config.CSMITH_HOME
+    pass_path = pass_path or config.get('TRACE_PASS', '')
+    runtime_path = runtime_path or config.get('TRACE_RUNTIME', '')
+    artifacts = CompileArtifacts(c_file)
+    if not pass_path:
+        artifacts.errors["build"] = "no trace_icall pass plugin (TRACE_PASS)"
+        return artifacts
+    if not runtime_path:
+        artifacts.errors["build"] = "no tracer runtime library (TRACE_RUNTIME)"
+        return artifacts
+    runtime_path = os.path.abspath(runtime_path)
+    cmd = [clang, *BITCODE_FLAGS, *pass_plugin_flags(pass_path), f"-I{runtime}", c_file,
+           runtime_path, f"-Wl,-rpath,{os.path.dirname(runtime_path)}", "-o", exe]
+    run_step(artifacts, "build", cmd, config.COMPILE_TIMEOUT)
+    return artifacts
+
+
+def run_traced(exe: str, edges_file: str, timeout: float) -> Optional[Dict[SiteKey, Set[str]]]:
+    """
+    Run a traced program in edge set mode and return its observed call site targets.
+
+    A program that times out gets SIGTERM first, so that the runtime dumps the
+    edges it has seen; the edges of a timed-out run are still ground truth.
+    """
+    env = dict(os.environ, AFL_INDIRECT_CALL_FORMAT='edges', AFL_INDIRECT_CALL_LOG=edges_file)
+    env.setdefault('AFL_INDIRECT_CALL_STABLE', str(STABLE_HITS))
+    process = subprocess.Popen([exe], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, env=env, start_new_session=True)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(DUMP_GRACE)
+        except (ProcessLookupError, subprocess.TimeoutExpired):
+            kill_process_group(process)
+            process.wait()
+    if not os.path.exists(edges_file):
+        return None
+    return _normalize(callsite_targets(read_trace(edges_file)))
+
+
+def check_program(c_file: str, static_results: Dict[str, str], work_dir: Optional[str] = None,
+                  timeout: Optional[float] = None, **build_kwargs) -> SoundnessReport:
+    """
+    Trace one program and check the static results of every tool against it.
+
+    Args:
+        c_file: Program to trace
+        static_results: Tool name -> JSON result of the tool for this program
+        work_dir: Directory for the temporary files (default: a fresh temporary directory)
+        timeout: Run timeout (default: RUN_TIMEOUT)
+        **build_kwargs: Passed on to build_traced()
+    """
+    report = SoundnessReport(c_file)
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        exe = os.path.join(tmp_dir, Path(c_file).stem)
+        artifacts = build_traced(c_file, exe, **build_kwargs)
+        if not artifacts.ok:
+            report.error = f"build failed: {artifacts.errors}"
+            return report
+        observed = run_traced(exe, f"{exe}.edges", timeout or config.RUN_TIMEOUT)
+    if observed is None:
+        report.error = "no edges were dumped"
+        return report
+    return check_observed(c_file, observed, static_results, report)
+
+
+def check_observed(source: str, observed: Dict[SiteKey, Set[str]], static_results: Dict[str, str],
+                   report: Optional[SoundnessReport] = None) -> SoundnessReport:
+    """Check the static results of every tool against already observed edges."""
+    report = report or SoundnessReport(source)
+    report.observed_sites = len(observed)
+    report.observed_edges = sum(len(targets) for targets in observed.values())
+    for tool, path in static_results.items():
+        try:
+            static = load_static_callsites(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Skipping {tool} result {path}: {e}")
+            continue
+        report.findings.extend(find_unsound(observed, static, tool))
+    return report
+
+
+def check_programs(jobs: Iterable[Tuple[str, Dict[str, str]]], workers: int = 1,
+                   **kwargs) -> List[SoundnessReport]:
+    """check_program() over (program, static results) pairs, workers at a time."""
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        return list(pool.map(lambda job: check_program(job[0], job[1], **kwargs), jobs))
+
+
+def campaign_jobs(results_dir: str, source_dirs: Iterable[str]) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    (program, static results) pairs of a fuzz-cg campaign, for check_programs().
+
+    fuzz-cg/main.py writes one <bitcode name>.<tool>.<mode>.txt per tool run and
+    log_analyzer.py turns each into a .json next to it. The program is the C
+    source with the bitcode's stem (csmith_7.c for csmith_7.bc) under one of
+    source_dirs; results of bitcodes without a source are skipped.
+    """
+    sources: Dict[str, str] = {}
+    for directory in source_dirs:
+        for path in sorted(Path(directory).rglob('*.c')):
+            sources.setdefault(path.stem, str(path))
+
+    programs: Dict[str, Dict[str, str]] = {}
+    for path in sorted(Path(results_dir).rglob('*.json')):
+        parts = path.name.rsplit('.', 3)
+        if len(parts) == 4:
+            bitcode, tool, mode, _ = parts
+            programs.setdefault(bitcode, {})[f"{tool}.{mode}"] = str(path)
+
+    jobs = []
+    for bitcode, results in programs.items():
+        source = sources.get(Path(bitcode).stem)
+        if source is None:
+            logging.warning(f"No source of {bitcode}, skipping its soundness check")
+            continue
+        jobs.append((source, results))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check static call graphs against the observed indirect calls")
+    parser.add_argument('program', help='C program, or an indirect call log with --trace')
+    parser.add_argument('--static', nargs='+', required=True, metavar='TOOL=JSON',
+                        help='Static result of each tool for the program')
+    parser.add_argument('--trace', action='store_true', help='program is a log of an earlier run')
+    parser.add_argument('--pass', dest='pass_path', help='trace_icall pass (default: TRACE_PASS)')
+    parser.add_argument('--runtime', help='Tracer runtime library (default: TRACE_RUNTIME)')
+    args = parser.parse_args()
+
+    static_results = dict(item.split('=', 1) for item in args.static)
+    if args.trace:
+        observed = _normalize(callsite_targets(read_trace(args.program)))
+        report = check_observed(args.program, observed, static_results)
+    else:
+        report = check_program(args.program, static_results, pass_path=args.pass_path,
+                               runtime_path=args.runtime)
+    if report.error:
+        print(f"error: {report.error}")
+        sys.exit(2)
+    print(f"{report.observed_edges} observed edges at {report.observed_sites} call sites")
+    for finding in report.findings:
+        where = "" if finding.site_reported else " (call site not reported)"
+        missing = ', '.join(sorted(finding.missing))
+        print(f"{finding.tool}: {finding.file}:{finding.line} misses {missing}{where}")
+    sys.exit(0 if report.sound else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+Columnar store of the indirect call logs of a campaign.
+
+Every ingested log is reduced to its distinct (call site, target) edges and
+appended as one row per edge to fixed-width column files:
+
+    program.u32   program id (line of programs.txt)
+    site.u32      caller string id (line of strings.txt)
+    target.u32    target name id (line of strings.txt)
+    count.u64     calls of the edge, 0 if the log only has the edge set
+
+Strings are interned, so the caller and target names of thousands of programs
+take the space of one. Logs are read one chunk (binary) or line (text) at a
+time, and queries scan the columns in blocks of BLOCK_ROWS rows and aggregate
+integer ids, resolving them to strings only for the result, so neither needs
+memory in proportion to the log or store size. Columns are plain little-endian
+arrays: column() maps them as NumPy arrays when NumPy is installed.
+
+A store that was interrupted while appending is cut back to its last complete
+row when it is opened again.
+
+$python -m pafuzz.tracer.store campaign.store --ingest calls.bin calls.log
+$python -m pafuzz.tracer.store campaign.store             # call site -> target counts
+$python -m pafuzz.tracer.store campaign.store --programs  # call site -> target -> programs
+"""
+
+import argparse
+import logging
+import os
+import sys
+from array import array
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from pafuzz.tracer.edges import SiteKey, parse_site
+from pafuzz.tracer.reader import (EDGES, RECORDS, SITES, SYMBOLS, TRUNCATED, Trace,
+                                  is_binary_trace, iter_binary_events, iter_text_log,
+                                  trace_segments)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BLOCK_ROWS = 1 << 16
+_U32 = next(code for code in 'IL' if array(code).itemsize == 4)
+_U64 = next(code for code in 'LQ' if array(code).itemsize == 8)
+COLUMNS = {'program': _U32, 'site': _U32, 'target': _U32, 'count': _U64}
+_SUFFIX = {_U32: 'u32', _U64: 'u64'}
+
+# (caller, target name) -> number of calls
+EdgeCounts = Dict[Tuple[str, str], int]
+
+
+def _string_list(path: str) -> List[str]:
+    """Lines of an interned string file, without a partially written last line."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    complete = data[:data.rfind(b'\n') + 1]
+    if len(complete) < len(data):
+        with open(path, 'r+b') as f:
+            f.truncate(len(complete))
+    return complete.decode('utf-8', errors='replace').split('\n')[:-1]
+
+
+def _edge_counts(path: str) -> Counter:
+    """(caller, target name) -> calls of one log of any format, read in a streaming pass."""
+    if not is_binary_trace(path):
+        return Counter((caller, name) for _, caller, _, name in iter_text_log(path))
+    calls: Counter = Counter()
+    seen: Set[Tuple[int, int]] = set()
+    trace = Trace()
+    for kind, items in iter_binary_events(path):
+        if kind == RECORDS:
+            calls.update((site, target) for target, site, _ in items)
+        elif kind == SITES:
+            trace.sites.update(items)
+        elif kind == SYMBOLS:
+            trace.symbols.update(items)
+        elif kind == EDGES:
+            seen.update(items)
+        elif kind == TRUNCATED:
+            logging.warning(f"{path}: trace is truncated, the last calls are missing")
+    edges: Counter = Counter()
+    for site, target in seen | calls.keys():
+        edges[trace.sites.get(site, 'unknown'), trace.target_name(target)] += calls[site, target]
+    return edges
+
+
+class TraceStore:
+    """Directory of interned strings and edge columns, see the module docstring."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.strings = _string_list(self._file('strings.txt'))
+        self.programs = _string_list(self._file('programs.txt'))
+        self._string_ids = {string: i for i, string in enumerate(self.strings)}
+        self._program_ids = {program: i for i, program in enumerate(self.programs)}
+        sizes = [os.path.getsize(self._column_file(name))
+                 if os.path.exists(self._column_file(name)) else 0 for name in COLUMNS]
+        self.rows = min(size // array(code).itemsize for size, code in zip(sizes, COLUMNS.values()))
+        for (name, code), size in zip(COLUMNS.items(), sizes):
+            if size != self.rows * array(code).itemsize:
+                logging.warning(f"{self.path}: dropping the incomplete rows of column {name}")
+                with open(self._column_file(name), 'ab') as f:
+                    f.truncate(self.rows * array(code).itemsize)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _column_file(self, name: str) -> str:
+        return self._file(f"{name}.{_SUFFIX[COLUMNS[name]]}")
+
+    def _intern(self, strings: List[str], ids: Dict[str, int], file: str, values) -> List[int]:
+        values = [value.replace('\n', ' ') for value in values]
+        new = []
+        for value in values:
+            if value not in ids:
+                ids[value] = len(strings)
+                strings.append(value)
+                new.append(value)
+        if new:
+            with open(self._file(file), 'a', encoding='utf-8', errors='replace') as f:
+                f.writelines(value + '\n' for value in new)
+        return [ids[value] for value in values]
+
+    def ingest(self, trace_path: str, program: Optional[str] = None, segments: bool = False) -> int:
+        """
+        Append the edges of a log of any format (with segments also those of forked children)
+        under program, by default the log's path. Returns the number of edges.
+        Raises ValueError if the program was already ingested.
+        """
+        program = (program or trace_path).replace('\n', ' ')
+        if program in self._program_ids:
+            raise ValueError(f"{self.path}: {program} was already ingested")
+        edges: Counter = Counter()
+        for path in trace_segments(trace_path) if segments else [trace_path]:
+            edges.update(_edge_counts(path))
+        # Strings go to disk before the rows that refer to them
+        ordered = sorted(edges)
+        sites = self._intern(self.strings, self._string_ids, 'strings.txt',
+                             [site for site, _ in ordered])
+        targets = self._intern(self.strings, self._string_ids, 'strings.txt',
+                               [target for _, target in ordered])
+        program_id, = self._intern(self.programs, self._program_ids, 'programs.txt', [program])
+        columns = {'program': [program_id] * len(ordered), 'site': sites, 'target': targets,
+                   'count': [edges[edge] for edge in ordered]}
+        for name, code in COLUMNS.items():
+            values = array(code, columns[name])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            with open(self._column_file(name), 'ab') as f:
+                values.tofile(f)
+        self.rows += len(ordered)
+        return len(ordered)
+
+    def blocks(self, *names: str) -> Iterator[Tuple[array, ...]]:
+        """The given columns, BLOCK_ROWS rows at a time."""
+        if not self.rows:
+            return
+        files = [open(self._column_file(name), 'rb') for name in names]
+        try:
+            remaining = self.rows
+            while remaining:
+                size = min(BLOCK_ROWS, remaining)
+                block = []
+                for name, f in zip(names, files):
+                    values = array(COLUMNS[name])
+                    values.fromfile(f, size)
+                    if sys.byteorder == 'big':
+                        values.byteswap()
+                    block.append(values)
+                yield tuple(block)
+                remaining -= size
+        finally:
+            for f in files:
+                f.close()
+
+    def column(self, name: str):
+        """A whole column: a read-only NumPy memmap if NumPy is installed, else an array."""
+        if numpy is None:
+            values = array(COLUMNS[name])
+            for block, in self.blocks(name):
+                values.extend(block)
+            return values
+        dtype = numpy.dtype('<u4' if COLUMNS[name] == _U32 else '<u8')
+        if not self.rows:
+            return numpy.zeros(0, dtype)
+        return numpy.memmap(self._column_file(name), dtype=dtype, mode='r', shape=(self.rows,))
+
+    def _program_filter(self, program: Optional[str]) -> Optional[int]:
+        if program is None:
+            return None
+        if program not in self._program_ids:
+            raise KeyError(program)
+        return self._program_ids[program]
+
+    def edge_counts(self, program: Optional[str] = None) -> EdgeCounts:
+        """(caller, target name) -> calls, of one program or summed over all of them."""
+        wanted = self._program_filter(program)
+        counts: Counter = Counter()
+        for programs, sites, targets, calls in self.blocks('program', 'site', 'target', 'count'):
+            for program_id, site, target, count in zip(programs, sites, targets, calls):
+                if wanted is None or program_id == wanted:
+                    counts[site, target] += count
+        return {(self.strings[site], self.strings[target]): count
+                for (site, target), count in counts.items()}
+
+    def site_targets(self, program: Optional[str] = None) -> Dict[str, Set[str]]:
+        """Caller -> names of the functions called there, by one program or any."""
+        targets: Dict[str, Set[str]] = {}
+        for site, target in self.edge_counts(program):
+            targets.setdefault(site, set()).add(target)
+        return targets
+
+    def edge_programs(self) -> Dict[Tuple[str, str], int]:
+        """(caller, target name) -> number of programs that took the edge."""
+        counts: Counter = Counter()
+        for sites, targets in self.blocks('site', 'target'):
+            counts.update(zip(sites, targets))
+        return {(self.strings[site], self.strings[target]): count
+                for (site, target), count in counts.items()}
+
+    def callsite_targets(self, program: Optional[str] = None) -> Dict[SiteKey, Set[str]]:
+        """(file, line) -> target names, like pafuzz.tracer.edges.callsite_targets()."""
+        targets: Dict[SiteKey, Set[str]] = {}
+        for caller, names in self.site_targets(program).items():
+            position = parse_site(caller)
+            if position.line:
+                targets.setdefault((position.file, position.line), set()).update(names)
+        return targets
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ingest indirect call logs into a columnar store and query it")
+    parser.add_argument('store', help='Store directory')
+    parser.add_argument('--ingest', nargs='+', default=[], metavar='LOG',
+                        help='Logs to append, one per program')
+    parser.add_argument('--segments', action='store_true',
+                        help='Include the logs of forked children')
+    parser.add_argument('--program', help='Only print the edges of this program')
+    parser.add_argument('--programs', action='store_true',
+                        help='Print the number of programs per edge instead')
+    args = parser.parse_args()
+
+    store = TraceStore(args.store)
+    if args.ingest:
+        for log in args.ingest:
+            try:
+                logging.info(f"{log}: {store.ingest(log, segments=args.segments)} edges")
+            except ValueError as e:
+                logging.warning(e)
+        return
+    edges = store.edge_programs() if args.programs else store.edge_counts(args.program)
+    for (site, target), count in sorted(edges.items()):
+        print(f"{site}|{target}|{count}")
+
+
+if __name__ == '__main__':
+    main()